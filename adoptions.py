@@ -0,0 +1,172 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+import migrations
+from models import CourseBooks, CourseList, User
+
+# Term-start course adoptions in bulk. A feed lists a professor's courses and
+# the ISBNs adopted for each; courses are created (or reused when the
+# professor already has a list for that department and course number) and
+# their books attached in batches of BATCH_SIZE courses, one transaction per
+# batch. Books already on a list are skipped, so a feed can be submitted again
+# after fixing unknown ISBNs without creating duplicates.
+#
+# CSV has one row per adopted book: department, course_number, course_title,
+# isbn. JSON is {"courses": [{"department", "course_number", "course_title",
+# "isbns": [...]}]}. Both are accepted by POST /course_lists/bulk and by
+#
+#   python3 adoptions.py fall.csv --professor joobum.kim@mga.edu
+
+BATCH_SIZE = 200
+MAX_COURSES = 5000  # per request
+
+FIELDS = ('department', 'course_number', 'course_title')
+
+
+class AdoptionStats:
+    def __init__(self):
+        self.courses = 0
+        self.created = 0
+        self.requested = 0
+        self.added = 0
+        self.unknown = []
+        self.batch_times = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def already_adopted(self):
+        return self.requested - len(self.unknown) - self.added
+
+    def as_dict(self):
+        return {
+            'courses': self.courses,
+            'course_lists_created': self.created,
+            'books_added': self.added,
+            'already_adopted': self.already_adopted,
+            'unknown_isbns': self.unknown,
+            'batches': [round(seconds * 1000, 2) for seconds in self.batch_times],
+            'elapsed_ms': round(self.elapsed * 1000, 2),
+        }
+
+    def summary(self):
+        slowest = max(self.batch_times, default=0.0)
+        return (f"{self.courses} courses ({self.created} new lists), {self.added} books added, "
+                f"{self.already_adopted} already adopted, {len(self.unknown)} unknown ISBNs "
+                f"in {len(self.batch_times)} batches, {self.elapsed * 1000:.0f} ms "
+                f"(slowest batch {slowest * 1000:.0f} ms)")
+
+
+def _course(record, number):
+    values = [str(record.get(field) or '').strip() for field in FIELDS]
+    if not all(values):
+        raise ValueError(f"course {number}: department, course_number and course_title are required")
+    return CourseBooks.normalize(values[0], values[1]) + (values[2],)
+
+
+def _add(courses, key, title, isbns):
+    if key not in courses:
+        courses[key] = (title, [])
+    courses[key][1].extend(isbn for isbn in isbns if isbn)
+
+
+def _result(courses):
+    if len(courses) > MAX_COURSES:
+        raise ValueError(f"at most {MAX_COURSES} courses per submission, got {len(courses)}")
+    return [(title, department, course_number, list(dict.fromkeys(isbns)))
+            for (department, course_number), (title, isbns) in courses.items()]
+
+
+def read_csv(stream):
+    # Returns [(course_title, department, course_number, isbns)]; rows for the
+    # same course are merged
+    courses = {}
+    for number, row in enumerate(csv.DictReader(stream), 2):
+        department, course_number, course_title = _course(row, f"on line {number}")
+        _add(courses, (department, course_number), course_title, [(row.get('isbn') or '').strip()])
+    return _result(courses)
+
+
+def read_json(data):
+    if isinstance(data, (str, bytes)):
+        data = json.loads(data)
+    records = data.get('courses') if isinstance(data, dict) else data
+    if not isinstance(records, list):
+        raise ValueError('expected {"courses": [...]}')
+    courses = {}
+    for number, record in enumerate(records, 1):
+        if not isinstance(record, dict):
+            raise ValueError(f"course {number}: expected an object")
+        department, course_number, course_title = _course(record, number)
+        isbns = record.get('isbns') or []
+        if not isinstance(isbns, list):
+            raise ValueError(f"course {number}: isbns must be a list")
+        _add(courses, (department, course_number), course_title, [str(isbn).strip() for isbn in isbns if isbn is not None])
+    return _result(courses)
+
+
+def read_feed(text, fmt):
+    return read_json(text) if fmt == 'json' else read_csv(io.StringIO(text))
+
+
+def adopt(professor, professor_name, courses, batch_size=BATCH_SIZE, progress=None):
+    stats = AdoptionStats()
+    for start in range(0, len(courses), batch_size):
+        batch = courses[start:start + batch_size]
+        started = time.perf_counter()
+        created, added, unknown = CourseList.adopt(professor, professor_name, batch)
+        stats.batch_times.append(time.perf_counter() - started)
+        stats.courses += len(batch)
+        stats.created += created
+        stats.requested += sum(len(course[3]) for course in batch)
+        stats.added += added
+        stats.unknown.extend(unknown)
+        if progress is not None:
+            print(f"batch {len(stats.batch_times)}: {len(batch)} courses, {added} books added "
+                  f"in {stats.batch_times[-1] * 1000:.1f} ms", file=progress)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create course lists and adopt books in bulk from a feed.")
+    parser.add_argument('feed', help="CSV or JSON feed, or '-' for stdin")
+    parser.add_argument('--professor', required=True, help='email of the faculty member the lists belong to')
+    parser.add_argument('--format', choices=['csv', 'json'], help='feed format (default: from the file extension)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='courses per transaction')
+    args = parser.parse_args(argv)
+
+    migrations.migrate()
+    user = User.find_by_email(args.professor)
+    if user is None or not user.is_faculty():
+        print(f"{args.professor} is not a faculty account", file=sys.stderr)
+        return 1
+
+    fmt = args.format or ('json' if os.path.splitext(args.feed)[1].lower() == '.json' else 'csv')
+    if args.feed == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.feed, newline='', encoding='utf-8') as f:
+            text = f.read()
+    try:
+        courses = read_feed(text, fmt)
+    except ValueError as e:
+        print(f"invalid feed: {e}", file=sys.stderr)
+        return 1
+
+    stats = adopt(user.email, user.name, courses, max(1, args.batch_size), progress=sys.stderr)
+    for isbn in stats.unknown:
+        print(f"unknown ISBN {isbn}", file=sys.stderr)
+    print(stats.summary())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
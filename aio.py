@@ -0,0 +1,43 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import search as catalog_search
+from models import Book
+
+# Async data access for asgi.py. The sqlite3 calls in models.py block, so they
+# run on a thread pool sized to the connection pool while the event loop keeps
+# serving other requests. The caller's context (Flask request/app context) is
+# copied into the worker so instrumentation still attributes the queries.
+
+WORKERS = db.POOL_SIZE
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='bookstore-db')
+
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+
+async def get_page(sort='title', after=None, before=None, per_page=None):
+    return await run(Book.get_page, sort=sort, after=after, before=before, per_page=per_page)
+
+
+async def get_book_by_id(book_id):
+    return await run(Book.get_book_by_id, book_id)
+
+
+async def get_books_by_ids(book_ids):
+    return await run(Book.get_books_by_ids, book_ids)
+
+
+async def search_books(query, page=1):
+    return await run(catalog_search.search_books, query, page=page)
+
+
+def shutdown(wait=True):
+    executor.shutdown(wait=wait)
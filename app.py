@@ -1,38 +1,149 @@
-import random
-from flask import Flask, render_template, redirect, url_for, flash, request, session
-from models import Book, Cart, User, Student, Staff, Faculty, CourseList, Order, OrderItem
+from flask import Flask, render_template, redirect, url_for, flash, request, session, jsonify, g
+from models import (Book, Catalog, Cart, User, Student, Staff, Faculty, CourseList, CourseBooks, Order, OrderItem,
+                    ReturnPolicy, Inventory, OutOfStock)
+import adoptions
+import covers
+import httpcache
+import instrumentation
+import migrations
+import payments
+import reports
+import search as catalog_search
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
+instrumentation.init_app(app)
+covers.init_app(app)
+payments.init_app(app)
+
+migrations.migrate()
+
+
+@app.before_request
+def load_user():
+    # The signed-in user, resolved once per request (User.cache usually
+    # answers without a query); None for guests
+    g.user = User.find_by_email(session.get('user_email'))
+
+
+@app.before_request
+def sync_catalog():
+    # Every view, not only the cached catalog pages, must see writes made by
+    # other processes: the cart and checkout price books from Book.cache
+    g.catalog_state = Catalog.state()
+    Catalog.sync(g.catalog_state[0])
+
+
+# Request parsing and rendering for the catalog, search and book detail
+# pages, shared with their async versions in asgi.py
+def catalog_page_args():
+    return {
+        'sort': request.args.get('sort', 'title'),
+        'after': request.args.get('after'),
+        'before': request.args.get('before'),
+        'per_page': request.args.get('per_page', type=int),
+    }
+
+
+def render_catalog_page(page):
+    return render_template('index.html', books=page.books, page=page)
+
+
+def search_args():
+    # (query, page); query is '' when no search term was entered
+    return request.args.get('query', '').strip().lower(), request.args.get('page', 1, type=int)
+
+
+def empty_search():
+    flash("Please enter a search term.", "warning")
+    return redirect(url_for('index'))
+
+
+def render_search_results(query, results):
+    if not results.total:
+        flash("No books found matching your search.", "info")
+
+    return render_template('search_results.html', books=results.books, query=query, results=results)
+
+
+def render_book_detail(book):
+    role = session.get('role', 'guest')  #guest is default
+    return render_template('book_detail.html', book=book, role=role)
 
 
 @app.route('/')
+@httpcache.cached_page
 def index():
-    books = Book.get_all_books()
-    return render_template('index.html', books=books)
+    return render_catalog_page(Book.get_page(**catalog_page_args()))
 
 
 @app.route('/search')
+@httpcache.cached_page
 def search():
-    query = request.args.get('query', '').strip().lower()
-    
+    query, page = search_args()
     if not query:
-        flash("Please enter a search term.", "warning")
-        return redirect(url_for('index'))
-
-    matching_books = [book for book in Book.search_all_books() if query in book.title.lower() or query in book.author.lower()]
-
-    if not matching_books:
-        flash("No books found matching your search.", "info")
-
-    return render_template('search_results.html', books=matching_books, query=query)
+        return empty_search()
+    return render_search_results(query, catalog_search.search_books(query, page=page))
 
 
 @app.route('/book/<int:book_id>')
+@httpcache.cached_page
 def book_detail(book_id):
-    book = Book.get_book_by_id(book_id)
-    role = session.get('role', 'guest')  #guest is default
-    return render_template('book_detail.html', book=book, role=role)
+    return render_book_detail(Book.get_book_by_id(book_id))
+
+
+@app.route('/courses')
+@httpcache.cached_page
+def courses():
+    # Course lookup: ?q=ITEC 3500 goes to the course page, otherwise every
+    # course with adopted books (optionally ?department=ITEC) is listed
+    query = request.args.get('q', '').strip()
+    if query:
+        course = CourseBooks.parse(query)
+        if course:
+            return redirect(url_for('course_books', department=course[0], course_number=course[1]))
+    department = request.args.get('department', '')
+    return render_template('courses.html', courses=CourseBooks.courses(department), query=query,
+                           department=department.strip().upper())
+
+
+@app.route('/courses/<department>/<course_number>')
+@httpcache.cached_page
+def course_books(department, course_number):
+    canonical = CourseBooks.normalize(department, course_number)
+    if canonical != (department, course_number):
+        return redirect(url_for('course_books', department=canonical[0], course_number=canonical[1]), 301)
+    sections = CourseBooks.lookup(department, course_number)
+    return render_template('course_books.html', department=department, course_number=course_number,
+                           sections=sections), 200 if sections else 404
+
+
+@app.route('/courses/<department>/<course_number>/cart', methods=['POST'])
+def add_course_to_cart(department, course_number):
+    # Adds every book of the course (or of one of its course lists) that is
+    # not in the cart yet
+    sections = CourseBooks.lookup(department, course_number)
+    course_list_id = request.form.get('course_list_id', type=int)
+    if course_list_id is not None:
+        sections = [section for section in sections if section.course_list_id == course_list_id]
+    name = ' '.join(CourseBooks.normalize(department, course_number))
+    if not sections:
+        flash(f'No books are listed for {name}.', 'warning')
+        return redirect(url_for('courses'))
+    cart = Cart()
+    in_cart = cart.get_items()
+    added = 0
+    for section in sections:
+        for book in section.books:
+            if book.id not in in_cart:
+                cart.add_item(book.id)
+                in_cart[book.id] = 1
+                added += 1
+    if added:
+        flash(f'Added {added} book{"s" if added != 1 else ""} for {name} to your cart!')
+    else:
+        flash(f'The books for {name} are already in your cart.', 'info')
+    return redirect(url_for('view_cart'))
 
 
 @app.route('/add_to_cart/<int:book_id>')
@@ -49,75 +160,118 @@ def add_to_cart(book_id):
 
 @app.route('/cart')
 def view_cart():
+    restore_declined_carts()
     cart = Cart()
-    books = Book.get_books_by_ids(cart.get_items())
-    return render_template('cart.html', books=books)
+    quantities = cart.get_items()
+    books = Book.get_books_by_ids(list(quantities))
+    total_cost = sum(book.price * quantities[book.id] for book in books)
+    return render_template('cart.html', books=books, quantities=quantities, total_cost=total_cost)
+
+
+@app.route('/cart/update/<int:book_id>', methods=['POST'])
+def update_cart(book_id):
+    quantity = request.form.get('quantity', 1, type=int)
+    Cart().update_item(book_id, quantity)
+    return redirect(url_for('view_cart'))
+
+
+@app.route('/cart/remove/<int:book_id>', methods=['POST'])
+def remove_from_cart(book_id):
+    Cart().remove_item(book_id)
+    return redirect(url_for('view_cart'))
 
 @app.route('/checkout', methods=['GET', 'POST'])
 def checkout():
     if 'user_email' not in session:
         flash('You are not logged in. Please sign in or proceed as a guest.', 'warning')
-        return redirect(url_for('login_or_guest'))
+        return redirect(url_for('login'))
     user_email = session['user_email']
 
+    restore_declined_carts()
     cart = Cart()
-    cart_items = cart.get_items()  
-    if not cart_items:
+    quantities = cart.get_items()
+    if not quantities:
         flash('Your cart is empty. Please add items to your cart.', 'danger')
-        return redirect(url_for('shop'))
+        return redirect(url_for('view_cart'))
 
-    books = Book.get_books_by_ids(cart_items)
-    total_cost = sum(book.price for book in books)
+    books = Book.get_books_by_ids(list(quantities))
+    total_cost = sum(book.price * quantities[book.id] for book in books)
     delivery_methods = ['Shipping', 'In-store pickup', 'Digital download']
 
     if request.method == 'POST':
         delivery_method = request.form.get('delivery_method')
         payment_method = request.form.get('payment_method')
 
-        payment_success = process_payment(payment_method)
-
-        if payment_success:
-            order = Order.create_order(user_email, total_cost)
-            for book in books:
-                OrderItem.create_order_item(order.order_id, book.id, 1, book.price) 
-            cart.clear()
-            return redirect(url_for('order_confirmation', order_id=order.order_id, total_cost=total_cost))
-
-    return render_template('checkout.html', books=books, total_cost=total_cost, delivery_methods=delivery_methods)
-
-def process_payment(payment_method):
-    # fake payment processing
-    if payment_method == 'Credit Card':
-        return random.choice([True, False])  
-    elif payment_method == 'PayPal':
-        return random.choice([True, False])  
-    elif payment_method == 'University Account':
-        return random.choice([True, False])  
-    return False
+        items = [(book, quantities[book.id]) for book in books]
+
+        # The order is placed pending, holding its stock, and a payment job
+        # settles it in the background; the confirmation page shows the result
+        try:
+            order = payments.checkout(user_email, items, delivery_method, payment_method)
+        except OutOfStock as e:
+            flash_shortages(books, e)
+            return redirect(url_for('view_cart'))
+        cart.clear()
+        session['checkout_orders'] = session.get('checkout_orders', []) + [order.order_id]
+        return redirect(url_for('order_confirmation', order_id=order.order_id))
+
+    return render_template('checkout.html', books=books, quantities=quantities, total_cost=total_cost, delivery_methods=delivery_methods)
+
+def restore_declined_carts():
+    # Checkout empties the cart straight away; when the payment of one of this
+    # session's orders is declined, its books go back into the cart so the
+    # user can try again. Quantities are raised to the order's rather than
+    # added, so two requests restoring the same order at once are harmless.
+    order_ids = session.get('checkout_orders')
+    if not order_ids:
+        return
+    pending = []
+    for order_id in order_ids:
+        user_email, status = Order.get_status(order_id)
+        if user_email != session.get('user_email'):
+            continue
+        if status == 'pending':
+            pending.append(order_id)
+        elif status == 'failed':
+            cart = Cart()
+            quantities = cart.get_items()
+            for item in OrderItem.get_order_items_by_order_id(order_id):
+                if item.quantity > quantities.get(item.book_id, 0):
+                    cart.update_item(item.book_id, item.quantity)
+                    quantities[item.book_id] = item.quantity
+    if pending:
+        session['checkout_orders'] = pending
+    else:
+        session.pop('checkout_orders')
+
+def flash_shortages(books, error):
+    titles = {book.id: book.title for book in books}
+    for book_id, requested, available in error.shortages:
+        flash(f'Only {available} cop{"y" if available == 1 else "ies"} of "{titles.get(book_id, book_id)}" '
+              f'left for this delivery method; you asked for {requested}.', 'danger')
 
 @app.route('/order_confirmation/<int:order_id>', methods=['GET'])
 def order_confirmation(order_id):
-    order = Order.get_order_by_id(order_id)
+    order = Order.get_order_with_items(order_id)
     
     if not order:
         flash('Order not found', 'danger')
         return redirect(url_for('index'))
-
-    order_items = OrderItem.get_order_items_by_order_id(order_id)
-
-    books = []
-    for item in order_items:
-        book = Book.get_book_by_id(item.book_id)  
-        books.append({
-            'title': book.title,
-            'author': book.author,
-            'price': book.price,
-            'quantity': item.quantity,
-        })
+    restore_declined_carts()
 
     total_cost = order.total_amount
 
-    return render_template('order_confirmation.html', order=order, books=books, total_cost=total_cost)
+    return render_template('order_confirmation.html', order=order, books=order.items, total_cost=total_cost)
+
+@app.route('/order/<int:order_id>/status', methods=['GET'])
+def order_status(order_id):
+    # Polled by the confirmation page while the payment is pending
+    user_email, status = Order.get_status(order_id)
+    if user_email is None or user_email != session.get('user_email'):
+        return jsonify({'error': 'Order not found'}), 404
+    if status != 'pending':
+        restore_declined_carts()
+    return jsonify({'order_id': order_id, 'status': status})
 
 
 # STAFF - book management routes
@@ -138,10 +292,15 @@ def edit_book(book_id):
         price = request.form['price']
 
         Staff.update_book(book_id, title, author, price)
+        # A blank count leaves the book untracked in that channel
+        for channel in Inventory.channels():
+            on_hand = request.form.get(f'stock_{channel}', '').strip()
+            Inventory.set_stock(book_id, channel, max(0, int(on_hand)) if on_hand.isdigit() else None)
         flash('Book updated successfully.', 'success')
         return redirect(url_for('index'))
 
-    return render_template('edit_book.html', book=book)
+    return render_template('edit_book.html', book=book, stock=Inventory.get_stock(book_id),
+                           channels=Inventory.channels())
 
 
 @app.route('/delete_book/<int:book_id>', methods=['POST'])
@@ -155,6 +314,24 @@ def delete_book(book_id):
     return redirect(url_for('index'))
 
 
+@app.route('/reports')
+def sales_reports():
+    if session.get('role') != 'staff':
+        flash('You are not authorized to access this page.', 'danger')
+        return redirect(url_for('index'))
+
+    name = request.args.get('report', 'books')
+    if name not in reports.QUERIES:
+        name = 'books'
+    report = reports.run(
+        name,
+        start=request.args.get('start'),
+        end=request.args.get('end'),
+        limit=request.args.get('limit', reports.DEFAULT_LIMIT, type=int),
+    )
+    return render_template('reports.html', report=report, titles=reports.TITLES)
+
+
 # FACULTY - course list management routes
 @app.route('/add_to_course_list/<int:book_id>', methods=['GET', 'POST'])
 def add_to_course_list(book_id):
@@ -216,6 +393,67 @@ def manage_course_list(course_list_id):
 
     return render_template('manage_course_list.html', books=books, course_list=course_list)
 
+@app.route('/manage_course_list/<int:course_list_id>/books', methods=['POST'])
+def add_books_to_course_list(course_list_id):
+    # Adopts many books at once by ISBN (form textarea or {"isbns": [...]})
+    if session.get('role') != 'faculty':
+        flash('You are not authorized to access this page.', 'danger')
+        return redirect(url_for('index'))
+
+    if not CourseList.get_course_list_by_id(course_list_id):
+        flash('Course list not found.', 'danger')
+        return redirect(url_for('manage_courses'))
+
+    if request.is_json:
+        data = request.get_json(silent=True)
+        isbns = (data.get('isbns') or []) if isinstance(data, dict) else None
+        if not isinstance(isbns, list):
+            return jsonify({'error': 'expected {"isbns": [...]}'}), 400
+        isbns = [isbn for isbn in isbns if isbn is not None]
+    else:
+        isbns = request.form.get('isbns', '').replace(',', ' ').split()
+    added, unknown = Faculty.add_books_to_course_list(course_list_id, [str(isbn) for isbn in isbns])
+    if request.is_json:
+        return jsonify({'books_added': added, 'unknown_isbns': unknown})
+
+    flash(f'{added} book(s) added to the course list.', 'success')
+    if unknown:
+        flash(f'Not in the catalog: {", ".join(unknown)}', 'warning')
+    return redirect(url_for('manage_course_list', course_list_id=course_list_id))
+
+@app.route('/course_lists/bulk', methods=['GET', 'POST'])
+def bulk_adopt():
+    # Term-start adoptions: many course lists and their books in one upload
+    # (see adoptions.py for the CSV and JSON formats)
+    if 'user_email' not in session or session['role'] != 'faculty':
+        if request.is_json:
+            return jsonify({'error': 'Faculty only'}), 403
+        flash('You are not authorized to access this page.', 'danger')
+        return redirect(url_for('index'))
+
+    stats = None
+    if request.method == 'POST':
+        try:
+            if request.is_json:
+                courses = adoptions.read_json(request.get_json(silent=True))
+            else:
+                upload = request.files.get('feed')
+                text = upload.read().decode('utf-8-sig') if upload and upload.filename else request.form.get('feed_text', '')
+                fmt = 'json' if (upload and upload.filename.lower().endswith('.json')) or text.lstrip().startswith(('{', '[')) else 'csv'
+                courses = adoptions.read_feed(text, fmt)
+        except (ValueError, UnicodeDecodeError) as e:
+            if request.is_json:
+                return jsonify({'error': str(e)}), 400
+            flash(f'Could not read the adoptions: {e}', 'danger')
+            return render_template('bulk_adopt.html', stats=None)
+
+        stats = adoptions.adopt(session['user_email'], session.get('user_name'), courses)
+        if request.is_json:
+            return jsonify(stats.as_dict())
+        flash(stats.summary(), 'success')
+
+    return render_template('bulk_adopt.html', stats=stats)
+
 @app.route('/manage_courses')
 def manage_courses():
     if 'user_email' not in session or session['role'] != 'faculty':
@@ -255,7 +493,10 @@ def profile():
     if 'user_email' not in session:
         return redirect(url_for('login'))
 
-    user = User.find_by_email(session['user_email'])
+    user = g.user
+    if user is None:
+        session.clear()
+        return redirect(url_for('login'))
     role = session.get('role')
     print(role)
     if request.method == 'POST':
@@ -273,28 +514,13 @@ def profile():
 #order routes
 @app.route('/order/<int:order_id>')
 def order_details(order_id):
-    order = Order.get_order_by_id(order_id)
+    order = Order.get_order_with_items(order_id)
     if not order:
         flash('Order not found.', 'danger')
         return redirect(url_for('my_orders'))
 
-    order_items = OrderItem.get_order_items_by_order_id(order_id)
-    books = []
-    for item in order_items:
-        book = Book.get_book_by_id(item.book_id)  
-        if book:
-            books.append({
-                'title': book.title,
-                'author': book.author,
-                'price': book.price,
-                'quantity': item.quantity,
-                'order_item_id': item.order_item_id
-            })
-    
-    returnable_items = {
-        book['order_item_id']: OrderItem.is_returnable(book['order_item_id'])
-        for book in books
-    }
+    books = order.items
+    returnable_items = {book['order_item_id']: book['returnable'] for book in books}
 
     total_cost = sum(book['price'] * book['quantity'] for book in books)
 
@@ -313,25 +539,59 @@ def my_orders():
         return redirect(url_for('login'))
 
     user_email = session['user_email']
-    orders = Order.get_orders_by_user_email(user_email)
-    
-    return render_template('my_orders.html', orders=orders)
+    page = Order.get_order_history(
+        user_email,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=request.args.get('per_page', type=int),
+    )
+    summary = Order.get_user_summary(user_email)
+
+    return render_template('my_orders.html', orders=page.orders, page=page, summary=summary)
 
 @app.route('/return_book/<int:order_item_id>', methods=['GET', 'POST'])
 def return_book(order_item_id):
-    order_item = OrderItem.get_order_items_by_order_id(order_item_id)
+    if 'user_email' not in session:
+        flash('You need to be logged in to request a return.', 'danger')
+        return redirect(url_for('login'))
+
+    items = ReturnPolicy.evaluate_items([order_item_id], session['user_email'])
+    if not items:
+        flash('Order item not found.', 'danger')
+        return redirect(url_for('my_orders'))
+    order_item = items[0]
 
-    if not OrderItem.is_returnable(order_item_id):
+    if not order_item['returnable']:
         flash('The return window has expired. You cannot return this item.', 'danger')
         return redirect(url_for('my_orders'))
 
     if request.method == 'POST':
-        OrderItem.request_return(order_item_id)
+        if not OrderItem.request_return(order_item_id, session['user_email']):
+            flash('The return window has expired. You cannot return this item.', 'danger')
+            return redirect(url_for('my_orders'))
         flash('Your return request has been successfully submitted. A return label has been generated.', 'success')
         return redirect(url_for('my_orders'))
 
     return render_template('return_book.html', order_item=order_item)
 
 
+@app.route('/order/<int:order_id>/returns', methods=['POST'])
+def return_books(order_id):
+    if 'user_email' not in session:
+        flash('You need to be logged in to request a return.', 'danger')
+        return redirect(url_for('login'))
+
+    # Items of other users' orders are ignored by request_returns
+    order_item_ids = request.form.getlist('order_item_id', type=int)
+    returned = OrderItem.request_returns(order_item_ids, session['user_email'])
+    if returned:
+        flash(f'Return requested for {len(returned)} item(s). A return label has been generated.', 'success')
+    if len(returned) < len(order_item_ids):
+        flash('Some items could not be returned because their return window has expired.', 'warning')
+    elif not order_item_ids:
+        flash('Select at least one item to return.', 'warning')
+    return redirect(url_for('order_details', order_id=order_id))
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+import aio
+import httpcache
+from app import (app, catalog_page_args, empty_search, render_book_detail, render_catalog_page,
+                 render_search_results, search_args)
+
+# ASGI entry point. The read-heavy catalog routes (index, search, book
+# detail) are served natively: their queries go through aio's thread pool so
+# many requests overlap on one event loop. Every other route runs the normal
+# Flask WSGI app on a separate thread pool, so behaviour is unchanged.
+#
+#   uvicorn asgi:application --port 5000
+#   python3 asgi.py --port 5000
+
+BRIDGE_WORKERS = 16
+
+bridge = ThreadPoolExecutor(max_workers=BRIDGE_WORKERS, thread_name_prefix='bookstore-wsgi')
+
+
+async def index():
+    return render_catalog_page(await aio.get_page(**catalog_page_args()))
+
+
+async def search():
+    query, page = search_args()
+    if not query:
+        return empty_search()
+    return render_search_results(query, await aio.search_books(query, page=page))
+
+
+async def book_detail(book_id):
+    return render_book_detail(await aio.get_book_by_id(book_id))
+
+
+# Flask endpoint name -> async view. Routing still comes from app.url_map.
+ASYNC_VIEWS = {
+    'index': index,
+    'search': search,
+    'book_detail': book_detail,
+}
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('127.0.0.1', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    if body and 'CONTENT_LENGTH' not in environ:
+        environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def run_wsgi(environ):
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = int(status.split(' ', 1)[0])
+        captured['headers'] = headers
+
+    result = app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return captured['status'], captured['headers'], body
+
+
+def before_async_view():
+    # The before_request hooks (load_user, the payment workers,
+    # instrumentation) and the page cache check may block on the database, so
+    # they run together on aio's pool rather than on the event loop.
+    rv = app.preprocess_request()
+    if rv is None:
+        rv = httpcache.before_view()
+    return rv
+
+
+async def dispatch_async(view, environ, view_args):
+    # Same steps as Flask.full_dispatch_request, with an awaited view wrapped
+    # like httpcache.cached_page.
+    with app.request_context(environ):
+        try:
+            try:
+                rv = await aio.run(before_async_view)
+                if rv is None:
+                    rv = httpcache.after_view(await view(**view_args))
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            response = app.finalize_request(rv)
+        except Exception as e:
+            response = app.make_response(app.handle_exception(e))
+        return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+
+def match_async_view(environ):
+    try:
+        endpoint, view_args = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None, None
+    return ASYNC_VIEWS.get(endpoint), view_args
+
+
+async def handle_http(scope, receive, send):
+    environ = build_environ(scope, await read_body(receive))
+    view, view_args = match_async_view(environ)
+    if view is not None:
+        status, headers, body = await dispatch_async(view, environ, view_args)
+    else:
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(bridge, run_wsgi, environ)
+
+    if scope['method'] == 'HEAD':
+        body = b''
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            bridge.shutdown(wait=True)
+            aio.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the bookstore through ASGI (requires uvicorn).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        parser.error('uvicorn is not installed; pip install uvicorn, or run asgi:application under another ASGI server')
+    uvicorn.run(application, host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
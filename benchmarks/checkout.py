@@ -0,0 +1,88 @@
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Throughput of Order.place_order under concurrent checkouts, against a
+# throwaway database.
+#
+#   python -m benchmarks.checkout --workers 8 --orders 250 --items 5
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark concurrent Order.place_order checkouts.')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=250, help='orders per worker')
+    parser.add_argument('--items', type=int, default=5, help='line items per order')
+    parser.add_argument('--books', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='bookstore-bench-')
+    os.environ['BOOKSTORE_DB'] = os.path.join(workdir, 'bookstore.db')
+    try:
+        import db
+        import migrations
+        from models import Book, Order
+
+        migrations.migrate()
+        with db.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO books (isbn, title, author, price) VALUES (?, ?, ?, ?)',
+                [(f'bench-{i}', f'Book {i}', f'Author {i % 97}', 10 + i % 90) for i in range(args.books)]
+            )
+        books = Book.get_books_by_ids(list(range(1, args.books + 1)))
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            local = []
+            for _ in range(args.orders):
+                items = [(book, rng.randint(1, 3)) for book in rng.sample(books, args.items)]
+                started = time.perf_counter()
+                try:
+                    Order.place_order(f'user{seed}@bench', items)
+                except Exception as e:
+                    errors.append(e)
+                local.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total = args.workers * args.orders
+        print(f"{total} orders x {args.items} items, {args.workers} workers: "
+              f"{total / elapsed:,.0f} orders/sec in {elapsed:.2f}s")
+        print(f"latency p50 {statistics.median(latencies) * 1000:.2f}ms  "
+              f"p95 {percentile(latencies, 95) * 1000:.2f}ms  "
+              f"p99 {percentile(latencies, 99) * 1000:.2f}ms")
+        print(f"errors: {len(errors)}  pool: {db.pool_stats()[0]}")
+        db.close_all()
+        return 1 if errors else 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks import datagen
+from benchmarks.routes import load_context, percentile
+
+# Compares the sync Flask views (one thread per in-flight request, as the
+# threaded dev server does) with the ASGI mode in asgi.py (one event loop,
+# queries on aio's thread pool) at increasing concurrency. --io-latency adds
+# a sleep after every statement to stand in for slow storage, which is where
+# overlapping requests on one loop pays off.
+#
+#   python -m benchmarks.concurrency --scale small --concurrency 1,8,32,64
+#   python -m benchmarks.concurrency --db bench.db --io-latency 2
+
+PATHS = {
+    'index': lambda ctx, rng: ('/', 'sort=' + rng.choice(['title', 'author', 'price'])),
+    'search': lambda ctx, rng: ('/search', 'query=' + rng.choice(datagen.WORDS)),
+    'book_detail': lambda ctx, rng: (f"/book/{rng.randint(ctx['first_book'], ctx['last_book'])}", ''),
+}
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p95_ms': percentile(latencies, 95) * 1000,
+    }
+
+
+def run_sync(app, route, ctx, concurrency, requests):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (1 if n < requests % concurrency else 0) for n in range(concurrency)]
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(n):
+        nonlocal errors
+        rng = random.Random(f"{route}-{n}")
+        client = app.test_client()
+        local, local_errors = [], 0
+        barrier.wait()
+        for _ in range(per_worker[n]):
+            path, query = PATHS[route](ctx, rng)
+            started = time.perf_counter()
+            status = client.get(path, query_string=query).status_code
+            local.append(time.perf_counter() - started)
+            local_errors += status >= 500
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def asgi_get(application, path, query):
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(),
+        'headers': [], 'http_version': '1.1', 'scheme': 'http',
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+    }
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+async def run_async(application, route, ctx, concurrency, requests):
+    latencies = []
+    errors = 0
+    per_worker = [requests // concurrency + (1 if n < requests % concurrency else 0) for n in range(concurrency)]
+
+    async def worker(n):
+        nonlocal errors
+        rng = random.Random(f"{route}-{n}")
+        for _ in range(per_worker[n]):
+            path, query = PATHS[route](ctx, rng)
+            started = time.perf_counter()
+            status = await asgi_get(application, path, query)
+            latencies.append(time.perf_counter() - started)
+            errors += status >= 500
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare sync views with the ASGI mode under concurrent load.')
+    parser.add_argument('--db', help='existing database to benchmark (default: generate one at --scale)')
+    parser.add_argument('--scale', choices=sorted(datagen.SCALES), default='small')
+    parser.add_argument('--concurrency', default='1,8,32,64', help='comma-separated in-flight request counts')
+    parser.add_argument('--requests', type=int, default=400, help='requests per route and concurrency level')
+    parser.add_argument('--routes', default=','.join(PATHS), help='comma-separated subset of %(default)s')
+    parser.add_argument('--io-latency', type=float, default=0.0, help='extra milliseconds per SQL statement')
+    args = parser.parse_args(argv)
+
+    workdir = None
+    path = args.db
+    if path is None:
+        workdir = tempfile.mkdtemp(prefix='bookstore-bench-')
+        path = os.path.join(workdir, 'bookstore.db')
+    # Must be set before db, models or app are first imported.
+    os.environ['BOOKSTORE_DB'] = os.path.abspath(path)
+    if 'db' in sys.modules and sys.modules['db'].DB_PATH != os.environ['BOOKSTORE_DB']:
+        parser.error('db was imported before BOOKSTORE_DB could be set')
+    if args.db is None:
+        datagen.generate(path, progress=sys.stderr, **datagen.SCALES[args.scale])
+
+    try:
+        import db
+        from app import app
+        from asgi import application
+
+        if args.io_latency:
+            delay = args.io_latency / 1000
+            db.listeners.append(lambda sql, parameters, elapsed: time.sleep(delay))
+
+        ctx = load_context(path)
+        levels = [int(level) for level in args.concurrency.split(',')]
+        header = f"{'route':12} {'conc':>5} {'sync rps':>9} {'p95 ms':>8} {'async rps':>10} {'p95 ms':>8} {'speedup':>8}"
+        print(header)
+        print('-' * len(header))
+        for route in args.routes.split(','):
+            for level in levels:
+                sync = run_sync(app, route, ctx, level, args.requests)
+                async_ = asyncio.run(run_async(application, route, ctx, level, args.requests))
+                speedup = async_['rps'] / sync['rps'] if sync['rps'] else 0.0
+                errors = sync['errors'] + async_['errors']
+                print(f"{route:12} {level:5} {sync['rps']:9.1f} {sync['p95_ms']:8.2f} "
+                      f"{async_['rps']:10.1f} {async_['p95_ms']:8.2f} {speedup:7.2f}x"
+                      + (f"  ({errors} errors)" if errors else ''))
+        return 0
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Synthetic bookstore.db generator for benchmarks.
+#
+#   python -m benchmarks.datagen bench.db --scale medium
+#   python -m benchmarks.datagen bench.db --books 250000 --orders 50000
+
+SCALES = {
+    'small': dict(books=1000, users=500, orders=2000, course_lists=100),
+    'medium': dict(books=100000, users=20000, orders=100000, course_lists=2000),
+    'large': dict(books=1000000, users=100000, orders=1000000, course_lists=10000),
+}
+
+BATCH_SIZE = 10000
+
+# Accounts with known roles that the route benchmark logs in as.
+FIXED_USERS = [
+    ('student@bench.edu', 'Bench Student', 'student', None, '1 Bench Way'),
+    ('faculty@bench.edu', 'Bench Faculty', 'faculty', 'ITEC', '2 Bench Way'),
+    ('staff@bench.edu', 'Bench Staff', 'staff', None, '3 Bench Way'),
+]
+
+DELIVERY_METHODS = ['Shipping', 'In-store pickup', 'Digital download']
+DEPARTMENTS = ['ITEC', 'MATH', 'PHYS', 'BIOL', 'CHEM', 'ENGL', 'HIST', 'EE', 'ME', 'PSYC']
+WORDS = ('algorithms analysis applied calculus chemistry computation data design digital discrete '
+         'dynamics economics engineering foundations fundamentals history introduction linear logic '
+         'mathematics mechanics methods modern networks organic physics principles probability '
+         'programming psychology quantum statistics structures systems theory thermodynamics').split()
+SURNAMES = ('Smith Johnson Lee Garcia Brown Davis Miller Wilson Moore Taylor Anderson Thomas Jackson '
+            'White Harris Martin Thompson Young King Wright Lopez Hill Scott Green Adams Baker').split()
+COVERS = [None, None, 'biology_cover.jpg', 'linear_algebra_cover.jpg', 'discrete_mathematics_cover.jpg',
+          'introduction_to_algorithms_cover.jpg', 'fundamentals_of_physics_cover.jpg']
+
+
+def make_isbn(n):
+    digits = '979' + str(n).zfill(9)
+    total = sum(int(ch) * (1 if i % 2 == 0 else 3) for i, ch in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+
+def _batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(path, sql, rows):
+    import db
+    count = 0
+    for batch in _batches(rows):
+        with db.transaction(path) as conn:
+            conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def generate(path, books, users, orders, course_lists, seed=1, progress=None):
+    # db and migrations read BOOKSTORE_DB at import time, so they are imported
+    # here, after callers have had the chance to point it at the new file.
+    import db
+    import migrations
+
+    rng = random.Random(seed)
+    migrations.migrate(path)
+    started = time.perf_counter()
+
+    def report(label, count):
+        if progress is not None:
+            print(f"{label}: {count:,} rows ({time.perf_counter() - started:.1f}s)", file=progress)
+
+    def book_rows():
+        for n in range(books):
+            title = ' '.join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 5)))
+            author = f"{rng.choice(SURNAMES)}, {rng.choice(SURNAMES)[0]}."
+            yield (make_isbn(n), f"{title} {n}", author, round(rng.uniform(5, 250), 2), rng.choice(COVERS))
+    report('books', _insert(path, 'INSERT INTO books (isbn, title, author, price, cover_url) VALUES (?, ?, ?, ?, ?)', book_rows()))
+
+    def user_rows():
+        yield from FIXED_USERS
+        for n in range(max(0, users - len(FIXED_USERS))):
+            status = rng.choices(['student', 'faculty', 'staff'], weights=[80, 15, 5])[0]
+            department = rng.choice(DEPARTMENTS) if status == 'faculty' else None
+            yield (f"user{n}@bench.edu", f"User {n}", status, department, f"{n} Campus Drive")
+    report('users', _insert(path, 'INSERT INTO users (email, name, status, department, address) VALUES (?, ?, ?, ?, ?)', user_rows()))
+
+    with db.get_connection(path) as conn:
+        first_book, last_book = conn.execute('SELECT min(id), max(id) FROM books').fetchone()
+        emails = [row[0] for row in conn.execute('SELECT email FROM users')]
+        faculty = [row[0] for row in conn.execute("SELECT email FROM users WHERE status = 'faculty'")]
+        next_order = (conn.execute('SELECT max(order_id) FROM orders').fetchone()[0] or 0) + 1
+
+    now = datetime.now()
+    order_rows = []
+    item_rows = []
+
+    def flush():
+        with db.transaction(path) as conn:
+            conn.executemany(
+                'INSERT INTO orders (order_id, user_email, status, total_amount, created_at, delivery_method) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                order_rows)
+            conn.executemany(
+                'INSERT INTO order_items (order_id, book_id, quantity, price, return_requested) VALUES (?, ?, ?, ?, ?)',
+                item_rows)
+        order_rows.clear()
+        item_rows.clear()
+
+    for order_id in range(next_order, next_order + orders):
+        created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 90))
+        total = 0.0
+        for _ in range(rng.randint(1, 5)):
+            price = round(rng.uniform(5, 250), 2)
+            quantity = rng.choice((1, 1, 1, 2, 3))
+            total += price * quantity
+            item_rows.append((order_id, rng.randint(first_book, last_book), quantity, price, rng.random() < 0.03))
+        order_rows.append((order_id, rng.choice(emails), rng.choice(('pending', 'paid', 'paid', 'paid')),
+                           round(total, 2), created_at.strftime('%Y-%m-%d %H:%M:%S'), rng.choice(DELIVERY_METHODS)))
+        if len(order_rows) >= BATCH_SIZE:
+            flush()
+    if order_rows:
+        flush()
+    report('orders', orders)
+
+    def course_list_rows():
+        professors = ['faculty@bench.edu'] * 5 + faculty
+        for n in range(course_lists):
+            professor = professors[n] if n < len(professors) else rng.choice(professors)
+            department = rng.choice(DEPARTMENTS)
+            yield (professor, professor.split('@')[0].title(),
+                   ' '.join(rng.choice(WORDS).capitalize() for _ in range(2)),
+                   department, str(1000 + n))
+    report('course lists', _insert(
+        path,
+        'INSERT INTO course_lists (professor, professor_name, course_title, department, course_number) VALUES (?, ?, ?, ?, ?)',
+        course_list_rows()))
+
+    with db.get_connection(path) as conn:
+        list_ids = [row[0] for row in conn.execute('SELECT id FROM course_lists')]
+
+    def adoption_rows():
+        for list_id in list_ids:
+            for book_id in rng.sample(range(first_book, last_book + 1), min(rng.randint(1, 6), books)):
+                yield (list_id, book_id)
+    report('course list books', _insert(
+        path, 'INSERT OR IGNORE INTO course_list_books (course_list_id, book_id) VALUES (?, ?)', adoption_rows()))
+
+    # Orders were written before the course lists, and with returns already
+    # flagged, so the triggers could not attribute them; recompute the rollups.
+    with db.transaction(path) as conn:
+        migrations.rebuild_sales_rollups(conn)
+        rollups = conn.execute('SELECT count(*) FROM sales_daily_books').fetchone()[0]
+    report('daily book sales', rollups)
+
+    with db.get_connection(path) as conn:
+        conn.execute('ANALYZE')
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic bookstore database for benchmarks.')
+    parser.add_argument('path', help='database file to create')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--books', type=int)
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--orders', type=int)
+    parser.add_argument('--course-lists', type=int)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help='overwrite an existing file')
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.path):
+        if not args.force:
+            parser.error(f"{args.path} exists; pass --force to overwrite it")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    generate(args.path, seed=args.seed, progress=sys.stderr, **sizes)
+    print(f"Wrote {args.path}: " + ', '.join(f"{value:,} {key.replace('_', ' ')}" for key, value in sizes.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
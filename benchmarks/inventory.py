@@ -0,0 +1,132 @@
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.checkout import percentile
+
+# Many concurrent checkouts competing for the same few books. Each attempt
+# reserves stock, waits --pay-ms for a "payment", then places and pays the
+# order or (with probability --fail-rate) releases the reservation.
+# Afterwards the books must be sold exactly down to zero with nothing left
+# reserved: any oversold copy or leaked reservation is reported as an error.
+#
+#   python -m benchmarks.inventory --workers 32 --stock 500 --hot-books 1
+#   python -m benchmarks.inventory --workers 64 --stock 2000 --hot-books 3 --pay-ms 5
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark stock reservations under contention.')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=500, help='copies of each hot book')
+    parser.add_argument('--hot-books', type=int, default=1, help='books every checkout competes for')
+    parser.add_argument('--max-quantity', type=int, default=2)
+    parser.add_argument('--fail-rate', type=float, default=0.2, help='share of payments that fail')
+    parser.add_argument('--pay-ms', type=float, default=0.0, help='simulated payment time')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='bookstore-bench-')
+    os.environ['BOOKSTORE_DB'] = os.path.join(workdir, 'bookstore.db')
+    try:
+        import db
+        import migrations
+        from models import Book, Inventory, Order, OutOfStock
+
+        migrations.migrate()
+        with db.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO books (isbn, title, author, price) VALUES (?, ?, ?, ?)',
+                [(f'hot-{i}', f'Course Text {i}', 'Author', 99.0) for i in range(args.hot_books)]
+            )
+        books = Book.get_books_by_ids(list(range(1, args.hot_books + 1)))
+        for book in books:
+            Inventory.set_stock(book.id, 'warehouse', args.stock)
+
+        reserve_latencies = []
+        counts = {'attempts': 0, 'sold': 0, 'released': 0, 'rejected': 0}
+        errors = []
+        lock = threading.Lock()
+        sold_out = threading.Event()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            local = {key: 0 for key in counts}
+            latencies = []
+            while not sold_out.is_set():
+                items = [(book, rng.randint(1, args.max_quantity))
+                         for book in rng.sample(books, rng.randint(1, len(books)))]
+                local['attempts'] += 1
+                started = time.perf_counter()
+                try:
+                    reservation_id = Inventory.reserve([(book.id, q) for book, q in items], 'warehouse')
+                except OutOfStock:
+                    latencies.append(time.perf_counter() - started)
+                    local['rejected'] += 1
+                    # Done once every copy is sold; copies still reserved
+                    # by other workers may come back if their payment fails
+                    with db.get_connection() as conn:
+                        if not conn.execute('SELECT max(on_hand) FROM inventory').fetchone()[0]:
+                            sold_out.set()
+                    continue
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                latencies.append(time.perf_counter() - started)
+                if args.pay_ms:
+                    time.sleep(args.pay_ms / 1000)
+                try:
+                    if rng.random() < args.fail_rate:
+                        Inventory.release(reservation_id)
+                        local['released'] += 1
+                    else:
+                        order = Order.place_order(f'user{seed}@bench', items, 'Shipping', reservation_id)
+                        Order.mark_paid(order.order_id)
+                        local['sold'] += sum(q for _, q in items)
+                except Exception as e:
+                    errors.append(e)
+                if len(errors) > 100:
+                    sold_out.set()
+            with lock:
+                reserve_latencies.extend(latencies)
+                for key, value in local.items():
+                    counts[key] += value
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        with db.get_connection() as conn:
+            on_hand, reserved = conn.execute('SELECT sum(on_hand), sum(reserved) FROM inventory').fetchone()
+            ordered = conn.execute('SELECT coalesce(sum(quantity), 0) FROM order_items').fetchone()[0]
+            holds = conn.execute('SELECT count(*) FROM stock_reservations').fetchone()[0]
+        expected = args.stock * args.hot_books
+        if ordered != expected or on_hand != 0:
+            errors.append(f'sold {ordered} of {expected} copies, {on_hand} left on hand')
+        if reserved or holds:
+            errors.append(f'{reserved} copies still reserved by {holds} reservations')
+
+        print(f"{args.workers} workers, {args.hot_books} hot book(s) x {args.stock} copies: "
+              f"{counts['attempts']:,} checkouts in {elapsed:.2f}s, {counts['attempts'] / elapsed:,.0f}/sec")
+        print(f"sold {counts['sold']:,} copies, {counts['released']:,} payments failed and released, "
+              f"{counts['rejected']:,} rejected as out of stock")
+        print(f"reserve latency p50 {statistics.median(reserve_latencies) * 1000:.2f}ms  "
+              f"p95 {percentile(reserve_latencies, 95) * 1000:.2f}ms  "
+              f"p99 {percentile(reserve_latencies, 99) * 1000:.2f}ms")
+        print(f"errors: {len(errors)}" + (f"  first: {errors[0]}" if errors else ''))
+        db.close_all()
+        return 1 if errors else 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import datagen
+
+# Memory and throughput of materializing the whole catalog: the old loader
+# (sqlite3.Row indexed by column name into a class with a per-instance
+# __dict__) against the slotted models fed through db.fetch_all.
+#
+#   python -m benchmarks.models --books 1000000
+#   python -m benchmarks.models --db bench.db
+
+
+class DictBook:
+    # Book as it was before __slots__, for comparison.
+    def __init__(self, id, isbn, title, author, price, cover_url=None):
+        self.id = id
+        self.isbn = isbn
+        self.title = title
+        self.author = author
+        self.price = float(price)
+        self.cover_url = cover_url or "no-cover-available.png"
+
+
+def load_dict_books(conn):
+    rows = conn.execute('SELECT * FROM books').fetchall()
+    return [
+        DictBook(row['id'], row['isbn'], row['title'], row['author'], row['price'], row['cover_url'])
+        for row in rows
+    ]
+
+
+def load_slotted_books(conn):
+    import db
+    from models import Book
+    return db.fetch_all(conn, Book, f'SELECT {Book.COLUMNS} FROM books')
+
+
+def measure(loader, conn, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        books = loader(conn)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        del books
+
+    gc.collect()
+    tracemalloc.start()
+    books = loader(conn)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'rows': len(books), 'seconds': best, 'retained': retained, 'peak': peak}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare dict-based and slotted model loading on a large catalog.')
+    parser.add_argument('--db', help='existing database to load (default: generate one with --books rows)')
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per loader; the best is reported')
+    args = parser.parse_args(argv)
+
+    workdir = None
+    path = args.db
+    if path is None:
+        workdir = tempfile.mkdtemp(prefix='bookstore-bench-')
+        path = os.path.join(workdir, 'bookstore.db')
+    # Must be set before db or models are first imported.
+    os.environ['BOOKSTORE_DB'] = os.path.abspath(path)
+    if 'db' in sys.modules and sys.modules['db'].DB_PATH != os.environ['BOOKSTORE_DB']:
+        parser.error('db was imported before BOOKSTORE_DB could be set')
+    if args.db is None:
+        datagen.generate(path, books=args.books, users=len(datagen.FIXED_USERS), orders=0, course_lists=0,
+                         progress=sys.stderr)
+
+    try:
+        import db
+        results = {}
+        with db.get_connection(path) as conn:
+            for name, loader in (('dict + sqlite3.Row', load_dict_books), ('slots + fetch_all', load_slotted_books)):
+                results[name] = measure(loader, conn, args.repeat)
+
+        header = f"{'loader':20} {'rows':>10} {'seconds':>8} {'rows/s':>11} {'retained MB':>12} {'peak MB':>9} {'B/row':>7}"
+        print(header)
+        print('-' * len(header))
+        for name, r in results.items():
+            print(f"{name:20} {r['rows']:10,} {r['seconds']:8.2f} {r['rows'] / r['seconds']:11,.0f} "
+                  f"{r['retained'] / 2**20:12.1f} {r['peak'] / 2**20:9.1f} {r['retained'] / max(r['rows'], 1):7.0f}")
+        return 0
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
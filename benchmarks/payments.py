@@ -0,0 +1,136 @@
+import argparse
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.checkout import percentile
+
+# Background payment throughput. For each --workers count, --clients threads
+# check out --orders orders through payments.checkout (which only writes the
+# pending order and its job), then a jobs.WorkerPool settles them against a
+# FakeGateway that takes --latency-ms per charge and times out --error-rate
+# of the time. Reports checkout latency, how long the pool takes to drain the
+# queue, and checks that every order ended paid or failed with no stock left
+# held.
+#
+#   python -m benchmarks.payments --workers 1,4,16 --latency-ms 200
+#   python -m benchmarks.payments --workers 8 --orders 500 --error-rate 0.2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the background payment queue.')
+    parser.add_argument('--workers', default='1,4,16', help='comma-separated worker pool sizes')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent checkouts')
+    parser.add_argument('--orders', type=int, default=200, help='orders per round')
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='gateway time per charge')
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--error-rate', type=float, default=0.05, help='share of charges that time out')
+    parser.add_argument('--decline-rate', type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='bookstore-bench-')
+    os.environ['BOOKSTORE_DB'] = os.path.join(workdir, 'bookstore.db')
+    try:
+        import db
+        import jobs
+        import migrations
+        import payments
+        from models import Book, Inventory
+
+        migrations.migrate()
+        with db.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO books (isbn, title, author, price) VALUES (?, ?, ?, ?)',
+                [(f'bench-{i}', f'Book {i}', 'Author', 20.0 + i) for i in range(50)]
+            )
+        books = Book.get_books_by_ids(list(range(1, 51)))
+        for book in books:
+            Inventory.set_stock(book.id, 'warehouse', 1_000_000)
+        # Retries come back within a fraction of a second instead of minutes
+        jobs.BACKOFF_BASE = 0.05
+        logging.getLogger('bookstore.jobs').setLevel(logging.ERROR)
+
+        failures = 0
+        for workers in [int(n) for n in args.workers.split(',')]:
+            payments.gateway = payments.FakeGateway(
+                args.latency_ms / 1000, args.jitter_ms / 1000, args.decline_rate, args.error_rate, seed=workers
+            )
+            with db.get_connection() as conn:
+                first_order = conn.execute('SELECT coalesce(max(order_id), 0) + 1 FROM orders').fetchone()[0]
+                first_job = conn.execute('SELECT coalesce(max(id), 0) + 1 FROM jobs').fetchone()[0]
+
+            latencies = []
+            errors = []
+            lock = threading.Lock()
+            per_client = max(1, args.orders // args.clients)
+
+            def client(seed):
+                rng = random.Random(seed)
+                local = []
+                for _ in range(per_client):
+                    items = [(book, rng.randint(1, 2)) for book in rng.sample(books, 3)]
+                    started = time.perf_counter()
+                    try:
+                        payments.checkout(f'user{seed}@bench', items, 'Shipping', 'Credit Card')
+                    except Exception as e:
+                        errors.append(e)
+                    local.append(time.perf_counter() - started)
+                with lock:
+                    latencies.extend(local)
+
+            # Workers run while orders arrive, as in the web process
+            pool = jobs.WorkerPool(workers=workers, poll_interval=0.05).start()
+            started = time.perf_counter()
+            threads = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            placed = time.perf_counter() - started
+            while True:
+                with db.get_connection() as conn:
+                    pending = conn.execute(
+                        "SELECT count(*) FROM orders WHERE order_id >= ? AND status = 'pending'", (first_order,)
+                    ).fetchone()[0]
+                if not pending:
+                    break
+                time.sleep(0.02)
+            drained = time.perf_counter() - started
+            pool.stop()
+
+            with db.get_connection() as conn:
+                statuses = dict(conn.execute(
+                    'SELECT status, count(*) FROM orders WHERE order_id >= ? GROUP BY status', (first_order,)
+                ).fetchall())
+                attempts = conn.execute(
+                    'SELECT coalesce(sum(attempts), 0) FROM jobs WHERE queue = ? AND id >= ?', (payments.QUEUE, first_job)
+                ).fetchone()[0]
+                reserved = conn.execute('SELECT coalesce(sum(reserved), 0) FROM inventory').fetchone()[0]
+                holds = conn.execute('SELECT count(*) FROM stock_reservations').fetchone()[0]
+            total = sum(statuses.values())
+            if reserved or holds:
+                errors.append(f'{reserved} copies still reserved by {holds} reservations')
+            failures += len(errors)
+
+            print(f"{workers} workers, {total} orders from {args.clients} clients, "
+                  f"gateway {args.latency_ms:.0f}ms: checkouts done in {placed:.2f}s, queue drained in "
+                  f"{drained:.2f}s ({total / drained:,.1f} payments/sec)")
+            print(f"  checkout latency p50 {statistics.median(latencies) * 1000:.2f}ms  "
+                  f"p99 {percentile(latencies, 99) * 1000:.2f}ms")
+            print(f"  paid {statuses.get('paid', 0)}, failed {statuses.get('failed', 0)}, "
+                  f"{attempts - total} retried gateway calls")
+            print(f"  errors: {len(errors)}" + (f"  first: {errors[0]}" if errors else ''))
+        db.close_all()
+        return 1 if failures else 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
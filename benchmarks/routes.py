@@ -0,0 +1,401 @@
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks import datagen
+
+# Load test for every route in app.py. Each route is driven by --workers
+# concurrent clients for --requests requests, in process through the Flask
+# test client (with SQL query counts) or against a running server (--url).
+#
+#   python -m benchmarks.routes --scale small --workers 8 --json results.json
+#   python -m benchmarks.routes --db bench.db --compare results.json
+#   python -m benchmarks.routes --db bench.db --url http://127.0.0.1:5000
+
+LOGINS = {
+    'guest': None,
+    'student': 'student@bench.edu',
+    'faculty': 'faculty@bench.edu',
+    'staff': 'staff@bench.edu',
+}
+
+
+# prepare runs untimed before each request; a dict it returns is added to the
+# ctx that request sees.
+class Route:
+    def __init__(self, name, role, request, prepare=None):
+        self.name = name
+        self.role = role
+        self.request = request
+        self.prepare = prepare
+
+
+REPORTS = ['books', 'course_lists', 'departments', 'daily']
+
+
+def _random_book(ctx, rng):
+    return rng.randint(ctx['first_book'], ctx['last_book'])
+
+
+def _add_random_book(client, ctx, rng):
+    book = _random_book(ctx, rng)
+    client.get(f"/add_to_cart/{book}")
+    return {'book': book}
+
+
+def _login(client, ctx, rng):
+    client.post('/login', {'email': LOGINS['student'], 'password': 'x'})
+
+
+def _course_list_book(ctx, rng):
+    return {'course_list': rng.choice(ctx['course_list_ids']), 'book': _random_book(ctx, rng)}
+
+
+def _remove_course_list_book(client, ctx, rng):
+    pick = _course_list_book(ctx, rng)
+    client.post(f"/remove_from_course_list/{pick['course_list']}/{pick['book']}", {})
+    return pick
+
+
+def _add_course_list_book(client, ctx, rng):
+    pick = _remove_course_list_book(client, ctx, rng)
+    client.post(f"/add_to_course_list/{pick['book']}", {'course_list_id': pick['course_list']})
+    return pick
+
+
+def _adoption_feed(ctx, rng):
+    rows = ['department,course_number,course_title,isbn']
+    course_number = rng.randint(1000, 1019)
+    for isbn in rng.sample(ctx['isbns'], min(5, len(ctx['isbns']))):
+        rows.append(f"BENCH,{course_number},Benchmark Course {course_number},{isbn}")
+    return '\n'.join(rows)
+
+
+def _return_order(client, ctx, rng):
+    order_id = rng.choice(list(ctx['order_items']))
+    return client.post(f"/order/{order_id}/returns", {'order_item_id': ctx['order_items'][order_id]})
+
+
+ROUTES = [
+    Route('index', 'guest', lambda c, ctx, rng: c.get('/')),
+    Route('index_sorted', 'guest', lambda c, ctx, rng: c.get('/?sort=' + rng.choice(['author', 'price']))),
+    Route('search', 'guest', lambda c, ctx, rng: c.get('/search?query=' + rng.choice(datagen.WORDS))),
+    Route('search_prefix', 'guest', lambda c, ctx, rng: c.get('/search?query=' + rng.choice(datagen.WORDS)[:3])),
+    Route('book_detail', 'guest',
+          lambda c, ctx, rng: c.get(f"/book/{rng.randint(ctx['first_book'], ctx['last_book'])}")),
+    Route('course_books', 'guest', lambda c, ctx, rng: c.get(f"/courses/{rng.choice(ctx['courses'])}")),
+    Route('course_books_student', 'student', lambda c, ctx, rng: c.get(f"/courses/{rng.choice(ctx['courses'])}")),
+    Route('login', 'guest', lambda c, ctx, rng: c.post('/login', {'email': 'student@bench.edu', 'password': 'x'})),
+    Route('add_to_cart', 'student',
+          lambda c, ctx, rng: c.get(f"/add_to_cart/{rng.randint(ctx['first_book'], ctx['last_book'])}")),
+    Route('view_cart', 'student', lambda c, ctx, rng: c.get('/cart'), prepare=_add_random_book),
+    Route('checkout_form', 'student', lambda c, ctx, rng: c.get('/checkout'), prepare=_add_random_book),
+    Route('checkout', 'student',
+          lambda c, ctx, rng: c.post('/checkout', {'delivery_method': 'Shipping', 'payment_method': 'PayPal'}),
+          prepare=_add_random_book),
+    Route('order_confirmation', 'student',
+          lambda c, ctx, rng: c.get(f"/order_confirmation/{rng.choice(ctx['order_ids'])}")),
+    Route('order_details', 'student', lambda c, ctx, rng: c.get(f"/order/{rng.choice(ctx['order_ids'])}")),
+    Route('my_orders', 'student', lambda c, ctx, rng: c.get('/my_orders')),
+    Route('profile', 'student', lambda c, ctx, rng: c.get('/profile')),
+    Route('edit_book', 'staff',
+          lambda c, ctx, rng: c.get(f"/edit_book/{rng.randint(ctx['first_book'], ctx['last_book'])}")),
+    Route('manage_courses', 'faculty', lambda c, ctx, rng: c.get('/manage_courses')),
+    Route('manage_course_list', 'faculty',
+          lambda c, ctx, rng: c.get(f"/manage_course_list/{rng.choice(ctx['course_list_ids'])}")),
+    Route('add_to_course_list_form', 'faculty',
+          lambda c, ctx, rng: c.get(f"/add_to_course_list/{rng.randint(ctx['first_book'], ctx['last_book'])}")),
+    Route('courses', 'guest',
+          lambda c, ctx, rng: c.get(rng.choice(['/courses', '/courses?department=' + rng.choice(ctx['courses']).split('/')[0]]))),
+    Route('add_course_to_cart', 'student', lambda c, ctx, rng: c.post(f"/courses/{rng.choice(ctx['courses'])}/cart", {})),
+    Route('update_cart', 'student',
+          lambda c, ctx, rng: c.post(f"/cart/update/{ctx['book']}", {'quantity': rng.randint(1, 3)}),
+          prepare=_add_random_book),
+    Route('remove_from_cart', 'student', lambda c, ctx, rng: c.post(f"/cart/remove/{ctx['book']}", {}),
+          prepare=_add_random_book),
+    Route('order_status', 'student', lambda c, ctx, rng: c.get(f"/order/{rng.choice(ctx['order_ids'])}/status")),
+    Route('return_book_form', 'student', lambda c, ctx, rng: c.get(f"/return_book/{rng.choice(ctx['order_item_ids'])}")),
+    Route('return_book', 'student', lambda c, ctx, rng: c.post(f"/return_book/{rng.choice(ctx['order_item_ids'])}", {})),
+    Route('return_books', 'student', _return_order),
+    Route('logout', 'student', lambda c, ctx, rng: c.get('/logout'), prepare=_login),
+    Route('reports', 'staff', lambda c, ctx, rng: c.get('/reports?report=' + rng.choice(REPORTS))),
+    Route('create_course_list_form', 'faculty', lambda c, ctx, rng: c.get('/create_course_list')),
+    Route('bulk_adopt_form', 'faculty', lambda c, ctx, rng: c.get('/course_lists/bulk')),
+    # Catalog writes come last: each one bumps the catalog version, which
+    # empties the page and book caches the routes above are measured with.
+    Route('edit_book_submit', 'staff',
+          lambda c, ctx, rng: c.post(f"/edit_book/{_random_book(ctx, rng)}", {
+              'title': f"Benchmark Edition {rng.randint(1, 1000)}", 'author': 'Bench Author',
+              'price': f"{rng.uniform(5, 250):.2f}"})),
+    Route('delete_book', 'staff', lambda c, ctx, rng: c.post(f"/delete_book/{next(ctx['spare_books'], 0)}", {})),
+    Route('create_course_list', 'faculty',
+          lambda c, ctx, rng: c.post('/create_course_list', {
+              'course_title': 'Benchmark Course', 'department': 'BENCH', 'course_number': str(rng.randint(2000, 2999))})),
+    Route('add_to_course_list', 'faculty',
+          lambda c, ctx, rng: c.post(f"/add_to_course_list/{ctx['book']}", {'course_list_id': ctx['course_list']}),
+          prepare=_remove_course_list_book),
+    Route('remove_from_course_list', 'faculty',
+          lambda c, ctx, rng: c.post(f"/remove_from_course_list/{ctx['course_list']}/{ctx['book']}", {}),
+          prepare=_add_course_list_book),
+    Route('add_books_to_course_list', 'faculty',
+          lambda c, ctx, rng: c.post(f"/manage_course_list/{rng.choice(ctx['course_list_ids'])}/books",
+                                     {'isbns': ' '.join(rng.sample(ctx['isbns'], min(5, len(ctx['isbns']))))})),
+    Route('bulk_adopt', 'faculty', lambda c, ctx, rng: c.post('/course_lists/bulk', {'feed_text': _adoption_feed(ctx, rng)})),
+]
+
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, data):
+        return self.client.post(path, data=data).status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def _open(self, path, body=None):
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+    def get(self, path):
+        return self._open(path)
+
+    def post(self, path, data):
+        return self._open(path, urllib.parse.urlencode(data, doseq=True).encode())
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def load_context(path):
+    import sqlite3
+    conn = sqlite3.connect(path)
+    try:
+        first_book, last_book = conn.execute('SELECT min(id), max(id) FROM books').fetchone()
+        order_ids = [row[0] for row in conn.execute(
+            "SELECT order_id FROM orders WHERE user_email = 'student@bench.edu' LIMIT 1000")]
+        if not order_ids:
+            order_ids = [row[0] for row in conn.execute('SELECT order_id FROM orders LIMIT 1000')] or [1]
+        course_list_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM course_lists WHERE professor = 'faculty@bench.edu'")] or [1]
+        courses = [f"{row[0].strip().upper()}/{row[1].strip().upper()}" for row in conn.execute(
+            'SELECT DISTINCT department, course_number FROM course_lists LIMIT 1000')] or ['ITEC/3500']
+        order_items = {}
+        for order_id, order_item_id in conn.execute(
+                "SELECT o.order_id, oi.order_item_id FROM orders o JOIN order_items oi ON oi.order_id = o.order_id "
+                "WHERE o.user_email = 'student@bench.edu' LIMIT 5000"):
+            order_items.setdefault(order_id, []).append(order_item_id)
+        isbns = [row[0] for row in conn.execute('SELECT isbn FROM books LIMIT 1000')]
+        # Books with no orders or adoptions, newest first, for delete_book
+        spare_books = [row[0] for row in conn.execute(
+            'SELECT id FROM books WHERE id NOT IN (SELECT book_id FROM order_items) '
+            'AND id NOT IN (SELECT book_id FROM course_list_books) ORDER BY id DESC LIMIT 10000')]
+    finally:
+        conn.close()
+    order_items = order_items or {order_ids[0]: [1]}
+    return {'first_book': first_book, 'last_book': last_book,
+            'order_ids': order_ids, 'course_list_ids': course_list_ids, 'courses': courses,
+            'order_items': order_items, 'order_item_ids': [i for items in order_items.values() for i in items],
+            'isbns': isbns, 'spare_books': iter(spare_books)}
+
+
+def run_route(route, make_client, ctx, workers, requests, query_counter=None):
+    latencies = []
+    queries = []
+    errors = 0
+    lock = threading.Lock()
+    per_worker = [requests // workers + (1 if n < requests % workers else 0) for n in range(workers)]
+    barrier = threading.Barrier(workers + 1)
+
+    def worker(n):
+        nonlocal errors
+        rng = random.Random(f"{route.name}-{n}")
+        client = make_client()
+        if LOGINS[route.role]:
+            client.post('/login', {'email': LOGINS[route.role], 'password': 'x'})
+        local_latencies, local_queries, local_errors = [], [], 0
+        barrier.wait()
+        for _ in range(per_worker[n]):
+            request_ctx = ctx
+            if route.prepare:
+                request_ctx = dict(ctx, **(route.prepare(client, ctx, rng) or {}))
+            if query_counter is not None:
+                query_counter.reset()
+            started = time.perf_counter()
+            status = route.request(client, request_ctx, rng)
+            local_latencies.append(time.perf_counter() - started)
+            if query_counter is not None:
+                local_queries.append(query_counter.count)
+            if status >= 500:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            errors += local_errors
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+    if queries:
+        result['queries_mean'] = statistics.mean(queries)
+        result['queries_max'] = max(queries)
+    return result
+
+
+class QueryCounter:
+    def __init__(self):
+        self._local = threading.local()
+
+    def __call__(self, sql, parameters, elapsed):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def print_results(results, baseline=None, threshold=10.0):
+    header = f"{'route':26} {'reqs':>6} {'err':>4} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+    print(header)
+    print('-' * len(header))
+    regressions = []
+    for name, r in results.items():
+        queries = f"{r['queries_mean']:.1f}" if 'queries_mean' in r else '-'
+        line = (f"{name:26} {r['requests']:6} {r['errors']:4} {r['rps']:9.1f} "
+                f"{r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} {queries:>8}")
+        base = (baseline or {}).get(name)
+        if base and base['p95_ms']:
+            change = (r['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100
+            line += f"  p95 {change:+.0f}%"
+            if change > threshold:
+                regressions.append(name)
+                line += ' REGRESSION'
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark latency, throughput and query counts for every route.')
+    parser.add_argument('--db', help='existing database to benchmark (default: generate one at --scale)')
+    parser.add_argument('--scale', choices=sorted(datagen.SCALES), default='small')
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process test client')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400, help='requests per route')
+    parser.add_argument('--routes', help='comma-separated subset of routes')
+    parser.add_argument('--json', help='write machine-readable results to this file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=10.0, help='p95 regression threshold in percent')
+    args = parser.parse_args(argv)
+
+    workdir = None
+    path = args.db
+    if path is None:
+        workdir = tempfile.mkdtemp(prefix='bookstore-bench-')
+        path = os.path.join(workdir, 'bookstore.db')
+    # Must be set before db, models or app are first imported.
+    os.environ['BOOKSTORE_DB'] = os.path.abspath(path)
+    if 'db' in sys.modules and sys.modules['db'].DB_PATH != os.environ['BOOKSTORE_DB']:
+        parser.error('db was imported before BOOKSTORE_DB could be set')
+    if args.db is None:
+        datagen.generate(path, progress=sys.stderr, **datagen.SCALES[args.scale])
+
+    try:
+        ctx = load_context(path)
+        query_counter = None
+        if args.url:
+            make_client = lambda: HTTPClient(args.url)  # noqa: E731
+        else:
+            import db
+            from app import app
+            query_counter = QueryCounter()
+            db.listeners.append(query_counter)
+            make_client = lambda: TestClient(app)  # noqa: E731
+
+        routes = ROUTES
+        if args.routes:
+            wanted = set(args.routes.split(','))
+            routes = [route for route in ROUTES if route.name in wanted]
+
+        results = {}
+        for route in routes:
+            results[route.name] = run_route(route, make_client, ctx, args.workers, args.requests, query_counter)
+
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)['routes']
+        regressions = print_results(results, baseline, args.threshold)
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({
+                    'meta': {
+                        'db': path if args.db else f"generated:{args.scale}",
+                        'mode': 'http' if args.url else 'test_client',
+                        'workers': args.workers,
+                        'requests': args.requests,
+                        'python': platform.python_version(),
+                        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    },
+                    'routes': results,
+                }, f, indent=2)
+        return 1 if regressions else 0
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from flask import request, url_for
+
+# Cover image pipeline. Source covers live in static/images/; `build` writes
+# fingerprinted copies to static/covers/ (name.<hash>.jpg), plus a thumbnail
+# and WebP variants of both when Pillow is installed, and records them in
+# static/covers/manifest.json. Templates ask for cover_url(book, 'thumb') or
+# cover_url(book, 'full'); fingerprinted files never change, so they are
+# served with a one year, immutable Cache-Control. Covers without a manifest
+# entry fall back to the original file.
+#
+#   python3 covers.py            build variants for new or changed covers
+#   python3 covers.py --force    rebuild everything
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails and WebP need Pillow; without it only fingerprinted copies are made
+    Image = None
+
+# Raised for a cover that cannot be read or decoded; build() reports the cover
+# and moves on to the next one
+COVER_ERRORS = (OSError, ValueError) + ((Image.DecompressionBombError,) if Image is not None else ())
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+SOURCE_DIR = os.path.join(STATIC_DIR, 'images')
+OUTPUT_DIR = os.path.join(STATIC_DIR, 'covers')
+MANIFEST = os.path.join(OUTPUT_DIR, 'manifest.json')
+
+THUMB_SIZE = (240, 320)  # catalog cards are ~230px wide
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+MAX_AGE = 365 * 24 * 3600
+RELOAD_INTERVAL = 5  # seconds between manifest mtime checks
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+
+def fingerprint(data):
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def _save(image, path, fmt, quality):
+    if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    tmp = path + '.tmp'
+    image.save(tmp, fmt, quality=quality, optimize=fmt == 'JPEG')
+    os.replace(tmp, path)
+
+
+def _write(path, data):
+    if not os.path.exists(path):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+def source_path(name, source_dir=SOURCE_DIR):
+    # Cover names come from feeds and the books table: only plain file names
+    # in source_dir are accepted, never a path that could point outside it.
+    if not name or name in ('.', '..') or os.path.basename(name) != name or (os.altsep and os.altsep in name):
+        raise ValueError(f"invalid cover name {name!r}")
+    return os.path.join(source_dir, name)
+
+
+def build_cover(name, source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR):
+    # Returns the manifest entry: variant -> file name under output_dir.
+    source = source_path(name, source_dir)
+    with open(source, 'rb') as f:
+        data = f.read()
+    digest = fingerprint(data)
+    stem, ext = os.path.splitext(name)
+    ext = ext.lower()
+    stat = os.stat(source)
+    entry = {'hash': digest, 'mtime': stat.st_mtime, 'size': stat.st_size}
+
+    full = f"{stem}.{digest}{ext}"
+    _write(os.path.join(output_dir, full), data)
+    entry['full'] = full
+    entry['thumb'] = full
+
+    if Image is not None:
+        entry['resized'] = True
+        with Image.open(source) as image:
+            image.load()
+            thumb = image.copy()
+            thumb.thumbnail(THUMB_SIZE)
+            thumb_fmt, thumb_ext = ('PNG', '.png') if ext == '.png' else ('JPEG', '.jpg')
+            entry['thumb'] = f"{stem}.thumb.{digest}{thumb_ext}"
+            _save(thumb, os.path.join(output_dir, entry['thumb']), thumb_fmt, JPEG_QUALITY)
+            # WebP variants are only kept when they beat the JPEG/PNG
+            for variant, img in (('thumb', thumb), ('full', image)):
+                webp = f"{os.path.splitext(entry[variant])[0]}.webp"
+                webp_path = os.path.join(output_dir, webp)
+                _save(img, webp_path, 'WEBP', WEBP_QUALITY)
+                if os.path.getsize(webp_path) < os.path.getsize(os.path.join(output_dir, entry[variant])):
+                    entry[f"{variant}_webp"] = webp
+                else:
+                    os.remove(webp_path)
+    return entry
+
+
+def load_manifest(path=MANIFEST):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(entries, path=MANIFEST):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(entries, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def build(names=None, force=False, source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR, progress=None, errors=None):
+    # Builds variants for the given cover file names (default: every image in
+    # source_dir). Unchanged covers (same size and mtime) are skipped; old
+    # fingerprinted files are kept so pages cached elsewhere still resolve.
+    # Invalid names and unreadable images are reported on errors and counted
+    # as failed. Returns (built, skipped, missing, failed).
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    entries = load_manifest(manifest_path)
+    if names is None:
+        names = [name for name in sorted(os.listdir(source_dir)) if name.lower().endswith(IMAGE_EXTENSIONS)]
+    built = skipped = missing = failed = 0
+    for name in names:
+        try:
+            source = source_path(name, source_dir)
+        except ValueError as e:
+            failed += 1
+            if errors is not None:
+                print(e, file=errors)
+            continue
+        if not os.path.isfile(source):
+            missing += 1
+            continue
+        stat = os.stat(source)
+        entry = entries.get(name)
+        if (not force and entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size
+                and os.path.exists(os.path.join(output_dir, entry['full']))
+                and (Image is None or entry.get('resized'))):
+            skipped += 1
+            continue
+        try:
+            entries[name] = build_cover(name, source_dir, output_dir)
+        except COVER_ERRORS as e:
+            failed += 1
+            if errors is not None:
+                print(f"{name}: {e}", file=errors)
+            continue
+        built += 1
+        if progress is not None:
+            print(f"{name} -> {entries[name]['thumb']}", file=progress)
+    if built:
+        save_manifest(entries, manifest_path)
+    return built, skipped, missing, failed
+
+
+class Manifest:
+    # Read-only view of manifest.json for the web process; reloaded when the
+    # file changes (importer.py and `covers.py` run in other processes).
+    def __init__(self, path=MANIFEST):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def get(self, name):
+        now = time.monotonic()
+        if now - self._checked_at > RELOAD_INTERVAL:
+            with self._lock:
+                self._checked_at = now
+                try:
+                    mtime = os.stat(self.path).st_mtime
+                except OSError:
+                    mtime = None
+                if mtime != self._mtime:
+                    self._entries = load_manifest(self.path)
+                    self._mtime = mtime
+        return self._entries.get(name)
+
+
+manifest = Manifest()
+
+
+def cover_url(book, size='thumb', fmt=None):
+    # URL of a cover variant: size is 'thumb' or 'full', fmt 'webp' or None
+    # for the original format. Returns None for a WebP that was not built.
+    name = book.cover_url
+    entry = manifest.get(name)
+    if entry is None:
+        return None if fmt else url_for('static', filename='images/' + name)
+    variant = entry.get(f"{size}_{fmt}" if fmt else size)
+    if variant is None:
+        return None
+    return url_for('static', filename='covers/' + variant)
+
+
+def init_app(app):
+    app.jinja_env.globals['cover_url'] = cover_url
+
+    @app.after_request
+    def cache_fingerprinted_covers(response):
+        if (request.endpoint == 'static' and response.status_code in (200, 304)
+                and (request.view_args or {}).get('filename', '').startswith('covers/')
+                and not request.view_args['filename'].endswith('manifest.json')):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build fingerprinted cover images, thumbnails and WebP variants.')
+    parser.add_argument('names', nargs='*', help='cover files in static/images (default: all)')
+    parser.add_argument('--force', action='store_true', help='rebuild covers that have not changed')
+    args = parser.parse_args(argv)
+    if Image is None:
+        print('Pillow is not installed: writing fingerprinted copies only, no thumbnails or WebP.', file=sys.stderr)
+    started = time.perf_counter()
+    built, skipped, missing, failed = build(args.names or None, args.force, progress=sys.stderr, errors=sys.stderr)
+    print(f"Built {built} covers, {skipped} unchanged, {missing} missing, {failed} failed "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
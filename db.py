@@ -0,0 +1,246 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DB_PATH = os.environ.get('BOOKSTORE_DB', 'bookstore.db')
+
+POOL_SIZE = 8
+CHECKOUT_TIMEOUT = 10
+CACHED_STATEMENTS = 256
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',  # ~16MB page cache per connection
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+
+
+# Callables invoked as listener(sql, parameters, elapsed_seconds) after every
+# statement run through a pooled connection; used for query counting and
+# profiling. Timings cover execution up to the first row, not later fetches.
+listeners = []
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class Connection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        if not listeners:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _notify(sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not listeners:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _notify(sql, None, time.perf_counter() - started)
+
+
+def _notify(sql, parameters, elapsed):
+    for listener in list(listeners):
+        listener(sql, parameters, elapsed)
+
+
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=CHECKOUT_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Held by db.transaction around every write transaction in this
+        # process; reentrant so nested transactions can join.
+        self.write_lock = threading.RLock()
+        self._open = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._reuses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            cached_statements=CACHED_STATEMENTS,
+            check_same_thread=False,
+            factory=Connection,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._open < self.size
+            if can_open:
+                self._open += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolExhausted(f"No connection to {self.path} available after {self.timeout}s")
+        finally:
+            with self._lock:
+                self._waits += 1
+                self._wait_time += time.perf_counter() - started
+        return conn
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        # Nested use on the same thread shares one connection; the outermost
+        # block owns the transaction and returns the connection to the pool.
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.depth += 1
+            with self._lock:
+                self._reuses += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._checkout()
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            with self._lock:
+                self._in_use -= 1
+            self._release(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'reuses': self._reuses,
+                'waits': self._waits,
+                'wait_time': self._wait_time,
+            }
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=DB_PATH):
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = ConnectionPool(path)
+    return pool
+
+
+def get_connection(path=DB_PATH):
+    return get_pool(path).connection()
+
+
+@contextmanager
+def transaction(path=DB_PATH, immediate=True):
+    # Explicit write transaction. BEGIN IMMEDIATE takes the write lock up
+    # front so concurrent writers queue on busy_timeout instead of failing
+    # with SQLITE_BUSY when upgrading a read lock. Nested use joins the
+    # enclosing transaction.
+    #
+    # SQLite has a single writer, so writers in this process first queue on
+    # the pool's write lock before taking a connection. Otherwise they would
+    # each hold a pooled connection while sleeping in SQLite's busy handler,
+    # starving readers and stretching tail latency under contention.
+    # busy_timeout still arbitrates between processes.
+    pool = get_pool(path)
+    with pool.write_lock:
+        with pool.connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            yield conn
+
+
+# Positional fast path for loaders that build model objects: rows come back
+# as plain tuples instead of sqlite3.Row and go straight to factory(*row), so
+# the SELECT column order must match the factory's parameters.
+def fetch_all(conn, factory, sql, parameters=()):
+    cursor = conn.execute(sql, parameters)
+    cursor.row_factory = None
+    return [factory(*row) for row in cursor]
+
+
+def fetch_one(conn, factory, sql, parameters=()):
+    cursor = conn.execute(sql, parameters)
+    cursor.row_factory = None
+    row = cursor.fetchone()
+    return factory(*row) if row is not None else None
+
+
+def pool_stats():
+    return [pool.stats() for pool in list(_pools.values())]
+
+
+def close_all():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,109 @@
+import functools
+import hashlib
+
+from flask import current_app, g, make_response, request, session
+
+import instrumentation
+from cache import LRUCache
+from models import Catalog
+
+# Conditional GETs and a rendered page cache for the catalog pages.
+#
+# Guest pages depend only on the URL, the templates and the catalog version
+# (bumped by triggers on every book or course list write, migration 7), so
+# their strong ETag is derived from those without rendering, a matching
+# If-None-Match gets a 304, and the rendered HTML is kept in `pages` keyed by
+# version. Signed-in pages are rendered as usual and get a private ETag hashed
+# from the body. Caching is skipped while the SQL debug panel is on, since it
+# changes every response.
+
+pages = LRUCache(max_entries=2048, max_bytes=64 * 1024 * 1024, ttl=3600)
+
+GUEST_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+USER_CACHE_CONTROL = 'private, no-cache'
+
+_build = None
+
+
+def build_id():
+    # Hash of every template source, so a deploy with changed templates
+    # changes the ETags; identical across pre-forked workers.
+    global _build
+    if _build is None:
+        digest = hashlib.sha1()
+        loader = current_app.jinja_env.loader
+        for name in sorted(loader.list_templates()):
+            source = loader.get_source(current_app.jinja_env, name)[0]
+            digest.update(name.encode() + b'\0' + source.encode())
+        _build = digest.hexdigest()[:12]
+    return _build
+
+
+def enabled():
+    return (current_app.config.get('HTTP_CACHE', True)
+            and not instrumentation.debug_panel_enabled(current_app)
+            and request.method in ('GET', 'HEAD'))
+
+
+def is_guest():
+    return 'user_email' not in session and '_flashes' not in session
+
+
+def _guest_headers(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = GUEST_CACHE_CONTROL
+    return response
+
+
+def before_view():
+    # Returns a finished response (304 or a cached page) for guests, or None
+    # to render normally. The in-process catalog caches are synced first
+    # (app.sync_catalog has usually done it for this request already), so
+    # neither a cached body nor a freshly rendered one is built from books
+    # cached before the current version.
+    version, last_modified = g.get('catalog_state') or Catalog.state()
+    Catalog.sync(version)
+    if not enabled() or not is_guest():
+        return None
+    path = request.full_path
+    digest = hashlib.sha1(f"{build_id()}\0{path}".encode()).hexdigest()[:20]
+    etag = f"{version}-{digest}"
+    g.page_cache = (version, path, etag, last_modified)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = (last_modified is not None and request.if_modified_since is not None
+                        and request.if_modified_since >= last_modified)
+    if not_modified:
+        return _guest_headers(make_response('', 304), etag, last_modified)
+    body = pages.get((version, path))
+    if body is not None:
+        return _guest_headers(make_response(body), etag, last_modified)
+    return None
+
+
+def after_view(rv):
+    response = make_response(rv)
+    if not enabled() or response.status_code != 200:
+        return response
+    cached = g.pop('page_cache', None)
+    if cached is not None:
+        version, path, etag, last_modified = cached
+        pages.set((version, path), response.get_data())
+        return _guest_headers(response, etag, last_modified)
+    response.headers['Cache-Control'] = USER_CACHE_CONTROL
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def cached_page(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        response = before_view()
+        if response is not None:
+            return response
+        return after_view(view(*args, **kwargs))
+    return wrapper
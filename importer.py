@@ -0,0 +1,211 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import sys
+import time
+
+import covers
+import db
+import migrations
+from models import Book, Catalog
+
+BATCH_SIZE = 5000
+REPORT_EVERY = 50000
+
+FIELDS = ('isbn', 'title', 'author', 'price', 'cover_url')
+
+# New books store the ISBN without hyphens or spaces. A book already stored
+# in another form (978-0-...) is matched on its key through
+# idx_books_isbn_key and updated in place rather than duplicated.
+UPSERT = f'''
+    INSERT INTO books (isbn, title, author, price, cover_url)
+    VALUES (coalesce((SELECT isbn FROM books WHERE {Book.ISBN_KEY} = ?1), ?1), ?2, ?3, ?4, ?5)
+    ON CONFLICT (isbn) DO UPDATE SET
+        title = excluded.title,
+        author = excluded.author,
+        price = excluded.price,
+        cover_url = coalesce(excluded.cover_url, books.cover_url)
+'''
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+        self.rejected = 0
+        self.batches = 0
+        self.covers_built = 0
+        self.covers_failed = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_sec(self):
+        return self.written / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (f"{self.read} read, {self.written} written, {self.rejected} rejected "
+                f"in {self.batches} batches, {self.elapsed:.2f}s ({self.rows_per_sec:,.0f} rows/sec), "
+                f"{self.covers_built} covers built, {self.covers_failed} failed")
+
+
+def isbn_digits(isbn):
+    return ''.join(ch for ch in isbn if ch.isdigit() or ch in 'xX').upper()
+
+
+def is_valid_isbn(isbn, check_digit=True):
+    digits = isbn_digits(isbn)
+    if len(digits) == 10:
+        if not digits[:9].isdigit() or not (digits[9].isdigit() or digits[9] == 'X'):
+            return False
+        if not check_digit:
+            return True
+        total = sum((10 - i) * (10 if ch == 'X' else int(ch)) for i, ch in enumerate(digits))
+        return total % 11 == 0
+    if len(digits) == 13:
+        if not digits.isdigit():
+            return False
+        if not check_digit:
+            return True
+        total = sum(int(ch) * (1 if i % 2 == 0 else 3) for i, ch in enumerate(digits))
+        return total % 10 == 0
+    return False
+
+
+class BadRecord:
+    # A record that could not be parsed; clean_records rejects it with reason
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def read_records(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield BadRecord(f'invalid JSON ({e.msg} at column {e.colno})')
+
+
+def _clean(record, check_digit):
+    # (row, None) for a valid record, or (None, reason)
+    if isinstance(record, BadRecord):
+        return None, record.reason
+    try:
+        isbn = (record.get('isbn') or '').strip()
+        title = (record.get('title') or '').strip()
+        author = (record.get('author') or '').strip()
+        price = float(record.get('price'))
+        cover_url = (record.get('cover_url') or '').strip() or None
+    except (TypeError, ValueError, AttributeError):
+        isbn = title = author = None
+        price = -1
+    if not title or not author or not math.isfinite(price) or price < 0:
+        return None, 'missing title, author or price'
+    if not is_valid_isbn(isbn, check_digit):
+        return None, f'invalid ISBN {isbn!r}'
+    return (Book.isbn_key(isbn), title, author, price, cover_url), None
+
+
+def clean_records(records, stats, check_digit=True, errors=None):
+    for number, record in enumerate(records, 1):
+        stats.read += 1
+        row, reason = _clean(record, check_digit)
+        if row is not None:
+            yield row
+            continue
+        stats.rejected += 1
+        if errors is not None:
+            print(f"record {number}: {reason}", file=errors)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_batches(batches, stats, path=db.DB_PATH, progress=None):
+    next_report = REPORT_EVERY
+    for batch in batches:
+        with db.get_connection(path) as conn:
+            conn.executemany(UPSERT, batch)
+        stats.batches += 1
+        stats.written += len(batch)
+        if progress is not None and stats.written >= next_report:
+            print(f"{stats.written:,} rows, {stats.rows_per_sec:,.0f} rows/sec", file=progress)
+            next_report += REPORT_EVERY
+    return stats
+
+
+def _collect_covers(rows, names):
+    for row in rows:
+        if row[4]:
+            names.add(row[4])
+        yield row
+
+
+def import_stream(stream, fmt='csv', path=db.DB_PATH, batch_size=BATCH_SIZE, check_digit=True,
+                  errors=None, progress=None, build_covers=True):
+    migrations.migrate(path)
+    stats = ImportStats()
+    rows = clean_records(read_records(stream, fmt), stats, check_digit, errors)
+    cover_names = set()
+    if build_covers:
+        rows = _collect_covers(rows, cover_names)
+    write_batches(batched(rows, batch_size), stats, path, progress)
+    if cover_names:
+        built, _, _, failed = covers.build(sorted(cover_names), errors=errors)
+        stats.covers_built = built
+        stats.covers_failed = failed
+
+    # Drop this process's cached catalog; the books triggers bumped the catalog
+    # version, so app processes drop theirs on their next request
+    # (Catalog.sync).
+    Catalog.invalidate()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import books from a CSV or JSON Lines ISBN feed.')
+    parser.add_argument('feed', help="feed file, or '-' for stdin")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help='feed format (default: from the file extension)')
+    parser.add_argument('--db', default=db.DB_PATH, help='database file (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--skip-check-digit', action='store_true',
+                        help='only check ISBN length/format, not the check digit')
+    parser.add_argument('--skip-covers', action='store_true',
+                        help='do not build thumbnails for the imported covers (see covers.py)')
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None:
+        fmt = 'jsonl' if os.path.splitext(args.feed)[1].lower() in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+    if args.feed == '-':
+        stats = import_stream(sys.stdin, fmt, args.db, args.batch_size, not args.skip_check_digit,
+                              errors=sys.stderr, progress=sys.stderr, build_covers=not args.skip_covers)
+    else:
+        with open(args.feed, newline='', encoding='utf-8') as stream:
+            stats = import_stream(stream, fmt, args.db, args.batch_size, not args.skip_check_digit,
+                                  errors=sys.stderr, progress=sys.stderr, build_covers=not args.skip_covers)
+    print(stats.summary())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
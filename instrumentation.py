@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+
+from flask import Response, g, has_request_context, render_template, request
+
+import db
+
+logger = logging.getLogger('bookstore.sql')
+
+SLOW_QUERY_MS = 100
+MAX_STATEMENTS = 200  # per request, kept for the debug panel
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}       # (endpoint, method, status) -> count
+        self.durations = {}      # endpoint -> [bucket counts..., sum, count]
+        self.db_queries = {}     # endpoint -> statements
+        self.db_seconds = {}     # endpoint -> seconds
+        self.slow_queries = 0
+
+    def observe_request(self, endpoint, method, status, duration, queries, db_time):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault(endpoint, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    histogram[i] += 1
+            histogram[-2] += duration
+            histogram[-1] += 1
+            self.db_queries[endpoint] = self.db_queries.get(endpoint, 0) + queries
+            self.db_seconds[endpoint] = self.db_seconds.get(endpoint, 0.0) + db_time
+
+    def observe_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += ['# HELP bookstore_http_requests_total HTTP requests by endpoint, method and status.',
+                      '# TYPE bookstore_http_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'bookstore_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            lines += ['# HELP bookstore_http_request_duration_seconds Request latency by endpoint.',
+                      '# TYPE bookstore_http_request_duration_seconds histogram']
+            for endpoint, histogram in sorted(self.durations.items()):
+                for bound, count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(f'bookstore_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'bookstore_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {histogram[-1]}')
+                lines.append(f'bookstore_http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {histogram[-2]:.6f}')
+                lines.append(f'bookstore_http_request_duration_seconds_count{{endpoint="{endpoint}"}} {histogram[-1]}')
+
+            lines += ['# HELP bookstore_db_queries_total SQL statements executed, by endpoint.',
+                      '# TYPE bookstore_db_queries_total counter']
+            for endpoint, count in sorted(self.db_queries.items()):
+                lines.append(f'bookstore_db_queries_total{{endpoint="{endpoint}"}} {count}')
+
+            lines += ['# HELP bookstore_db_query_seconds_total Time spent executing SQL, by endpoint.',
+                      '# TYPE bookstore_db_query_seconds_total counter']
+            for endpoint, seconds in sorted(self.db_seconds.items()):
+                lines.append(f'bookstore_db_query_seconds_total{{endpoint="{endpoint}"}} {seconds:.6f}')
+
+            lines += ['# HELP bookstore_db_slow_queries_total Statements slower than the slow query threshold.',
+                      '# TYPE bookstore_db_slow_queries_total counter',
+                      f'bookstore_db_slow_queries_total {self.slow_queries}']
+
+        pool_gauges = ('open', 'in_use', 'idle', 'size')
+        pool_counters = ('checkouts', 'reuses', 'waits', 'wait_time')
+        stats = db.pool_stats()
+        for name in pool_gauges:
+            lines += [f'# TYPE bookstore_db_pool_{name} gauge']
+            lines += [f'bookstore_db_pool_{name}{{path="{s["path"]}"}} {s[name]}' for s in stats]
+        for name in pool_counters:
+            suffix = '_seconds_total' if name == 'wait_time' else '_total'
+            lines += [f'# TYPE bookstore_db_pool_{name}{suffix} counter']
+            lines += [f'bookstore_db_pool_{name}{suffix}{{path="{s["path"]}"}} {s[name]}' for s in stats]
+
+        from models import Book, User
+        caches = Book.cache_stats()
+        caches['users'] = User.cache.stats()
+        for cache_name, cache_stats in caches.items():
+            for field in ('hits', 'misses', 'evictions', 'entries', 'bytes'):
+                lines.append(f'bookstore_cache_{field}{{cache="{cache_name}"}} {cache_stats[field]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+_local = threading.local()
+_slow_query_ms = SLOW_QUERY_MS
+
+
+def _explain(sql, parameters):
+    if parameters is None or not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return []
+    _local.explaining = True
+    try:
+        with db.get_connection() as conn:
+            return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+    finally:
+        _local.explaining = False
+
+
+def record_statement(sql, parameters, elapsed):
+    if getattr(_local, 'explaining', False):
+        return
+    if has_request_context():
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.sql_time = g.get('sql_time', 0.0) + elapsed
+        statements = g.setdefault('sql_statements', [])
+        if len(statements) < MAX_STATEMENTS:
+            statements.append((' '.join(sql.split()), elapsed))
+
+    if _slow_query_ms is not None and elapsed * 1000 >= _slow_query_ms:
+        metrics.observe_slow_query()
+        plan = _explain(sql, parameters)
+        logger.warning('slow query (%.1f ms): %s\n  plan: %s', elapsed * 1000, ' '.join(sql.split()),
+                       '; '.join(plan) or 'n/a')
+
+
+def debug_panel_enabled(app):
+    # SQL_DEBUG_PANEL left unset follows app.debug, read per request: init_app
+    # runs at import, before app.run(debug=True) or flask run --debug sets it
+    enabled = app.config.get('SQL_DEBUG_PANEL')
+    return app.debug if enabled is None else enabled
+
+
+def init_app(app):
+    global _slow_query_ms
+    app.config.setdefault('SLOW_QUERY_MS', SLOW_QUERY_MS)
+    _slow_query_ms = app.config['SLOW_QUERY_MS']
+    if record_statement not in db.listeners:
+        db.listeners.append(record_statement)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def add_sql_stats(response):
+        if request.endpoint == 'metrics_endpoint':
+            return response
+        count = g.get('sql_count', 0)
+        db_time = g.get('sql_time', 0.0)
+        duration = time.perf_counter() - g.get('request_started', time.perf_counter())
+        response.headers['X-DB-Queries'] = str(count)
+        response.headers['X-DB-Time-ms'] = f'{db_time * 1000:.2f}'
+        response.headers['Server-Timing'] = (
+            f'db;dur={db_time * 1000:.2f};desc="{count} queries", app;dur={duration * 1000:.2f}'
+        )
+        metrics.observe_request(request.endpoint or 'unknown', request.method, response.status_code,
+                                duration, count, db_time)
+
+        if (debug_panel_enabled(app) and response.mimetype == 'text/html'
+                and not response.direct_passthrough and response.status_code == 200):
+            panel = render_template('sql_panel.html', statements=g.get('sql_statements', []),
+                                    count=count, db_time=db_time, duration=duration)
+            body = response.get_data(as_text=True)
+            if '</body>' in body:
+                response.set_data(body.replace('</body>', panel + '</body>', 1))
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,234 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+import db
+
+# Durable background jobs in SQLite (the jobs table, migration 13) with a
+# local pool of worker threads. enqueue() can join the caller's transaction,
+# so a job exists exactly when the write that needs it commits. Workers claim
+# jobs in short BEGIN IMMEDIATE transactions and hold them for LEASE seconds;
+# a job whose worker died is claimed again once its lease runs out. A handler
+# that raises is retried with exponential backoff and jitter, up to
+# max_attempts, after which its on_failure callback runs.
+#
+#   python3 jobs.py --workers 4     run a worker pool in its own process
+#   python3 jobs.py status          job counts per queue and status
+
+WORKERS = 4
+POLL_INTERVAL = 0.5
+LEASE = 60.0
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 300.0
+
+logger = logging.getLogger('bookstore.jobs')
+
+# queue -> (handler(payload), on_failure(payload, error) or None)
+handlers = {}
+
+# Set by enqueue so idle workers in this process pick new jobs up at once
+_wakeup = threading.Event()
+
+
+class Job:
+    __slots__ = ('id', 'queue', 'payload', 'attempts', 'max_attempts')
+
+    def __init__(self, id, queue, payload, attempts, max_attempts):
+        self.id = id
+        self.queue = queue
+        self.payload = json.loads(payload)
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+
+def handler(queue, on_failure=None):
+    def register(func):
+        handlers[queue] = (func, on_failure)
+        return func
+    return register
+
+
+def enqueue(queue, payload, delay=0.0, max_attempts=MAX_ATTEMPTS, path=db.DB_PATH):
+    now = time.time()
+    with db.transaction(path) as conn:
+        job_id = conn.execute(
+            'INSERT INTO jobs (queue, payload, max_attempts, run_at, created_at) VALUES (?, ?, ?, ?, ?) RETURNING id',
+            (queue, json.dumps(payload), max_attempts, now + delay, now)
+        ).fetchone()[0]
+    _wakeup.set()
+    return job_id
+
+
+# Due jobs and jobs whose lease ran out; {} takes the queue placeholders
+NEXT_DUE = "SELECT id FROM jobs WHERE queue IN ({}) AND status = 'queued' AND run_at <= ? ORDER BY run_at LIMIT 1"
+NEXT_EXPIRED = "SELECT id FROM jobs WHERE queue IN ({}) AND status = 'running' AND locked_until < ? LIMIT 1"
+
+
+def claim(queues, path=db.DB_PATH, lease=LEASE):
+    # Next due job from any of the queues, or None
+    now = time.time()
+    placeholders = ','.join('?' * len(queues))
+    with db.transaction(path) as conn:
+        row = conn.execute(NEXT_DUE.format(placeholders), (*queues, now)).fetchone()
+        if row is None:
+            row = conn.execute(NEXT_EXPIRED.format(placeholders), (*queues, now)).fetchone()
+        if row is None:
+            return None
+        return db.fetch_one(
+            conn, Job,
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ? WHERE id = ? "
+            'RETURNING id, queue, payload, attempts, max_attempts',
+            (now + lease, row[0])
+        )
+
+
+def complete(job, path=db.DB_PATH):
+    with db.transaction(path) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'done', locked_until = NULL, finished_at = ? WHERE id = ?",
+            (time.time(), job.id)
+        )
+
+
+def backoff(attempts):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+
+
+def fail(job, error, path=db.DB_PATH):
+    # Schedules a retry; returns True once the job has used all its attempts
+    now = time.time()
+    final = job.attempts >= job.max_attempts
+    with db.transaction(path) as conn:
+        if final:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', locked_until = NULL, last_error = ?, finished_at = ? WHERE id = ?",
+                (error, now, job.id)
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', locked_until = NULL, last_error = ?, run_at = ? WHERE id = ?",
+                (error, now + backoff(job.attempts), job.id)
+            )
+    return final
+
+
+def run_job(job, path=db.DB_PATH):
+    func, on_failure = handlers[job.queue]
+    try:
+        func(job.payload)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if fail(job, error, path):
+            logger.error('job %s (%s) failed after %d attempts: %s', job.id, job.queue, job.attempts, error)
+            if on_failure is not None:
+                try:
+                    on_failure(job.payload, error)
+                except Exception:
+                    logger.exception('on_failure for job %s (%s) raised', job.id, job.queue)
+        else:
+            logger.warning('job %s (%s) attempt %d failed, will retry: %s', job.id, job.queue, job.attempts, error)
+        return False
+    complete(job, path)
+    return True
+
+
+def counts(path=db.DB_PATH):
+    # {(queue, status): count}
+    with db.get_connection(path) as conn:
+        rows = conn.execute('SELECT queue, status, count(*) FROM jobs GROUP BY queue, status').fetchall()
+    return {(queue, status): count for queue, status, count in rows}
+
+
+class WorkerPool:
+    def __init__(self, queues=None, workers=WORKERS, path=db.DB_PATH, poll_interval=POLL_INTERVAL):
+        self.queues = list(queues or handlers)
+        self.workers = workers
+        self.path = path
+        self.poll_interval = poll_interval
+        self.threads = []
+        self.stopping = threading.Event()
+
+    def start(self):
+        for n in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f'bookstore-jobs-{n}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                job = claim(self.queues, self.path)
+            except Exception:
+                logger.exception('could not claim a job')
+                job = None
+            if job is None:
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+                continue
+            try:
+                run_job(job, self.path)
+            except Exception:
+                # The job stays claimed and is retried when its lease expires
+                logger.exception('job %s crashed', job.id)
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        _wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def ensure_workers(workers=WORKERS, path=db.DB_PATH):
+    # Starts this process's pool once; a forked child starts its own
+    global _pool, _pool_pid
+    if workers <= 0 or (_pool is not None and _pool_pid == os.getpid()):
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = WorkerPool(workers=workers, path=path).start()
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run background job workers, or show the job queue.')
+    parser.add_argument('command', nargs='?', default='work', choices=['work', 'status'])
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--db', default=db.DB_PATH, help='database file (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    import migrations
+    import payments  # noqa: F401 - registers the payments handler
+    migrations.migrate(args.db)
+
+    if args.command == 'status':
+        for (queue, status), count in sorted(counts(args.db).items()):
+            print(f"{queue:12} {status:8} {count:8,}")
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    pool = WorkerPool(workers=args.workers, path=args.db).start()
+    print(f"{args.workers} workers on {', '.join(pool.queues)}", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop(timeout=LEASE)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
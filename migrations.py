@@ -0,0 +1,745 @@
+import argparse
+import sys
+
+import db
+
+# Numbered schema migrations. Each step is either an SQL statement or a
+# callable taking the connection. Migrations run in order inside their own
+# transaction and are recorded in schema_migrations, so they can be applied
+# online to an existing bookstore.db. Never edit a released migration; add a
+# new one instead.
+
+MAX_REPORTED = 50  # duplicate values listed by a failed uniqueness preflight
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _require_unique(table, column):
+    # Preflight for a UNIQUE index: lists the duplicated values and their row
+    # ids rather than failing with a bare "UNIQUE constraint failed". Which
+    # row to keep is left to a person.
+    def step(conn):
+        rows = conn.execute(f'''
+            SELECT {column}, group_concat(rowid, ', ') FROM {table}
+            WHERE {column} IS NOT NULL
+            GROUP BY {column} HAVING count(*) > 1
+            ORDER BY {column}
+        ''').fetchall()
+        if rows:
+            lines = [f"  {value!r}: ids {ids}" for value, ids in rows[:MAX_REPORTED]]
+            if len(rows) > MAX_REPORTED:
+                lines.append(f"  ... and {len(rows) - MAX_REPORTED} more")
+            raise MigrationError(f"cannot add a unique index on {table}.{column}; "
+                                 f"remove or merge these duplicate rows first:\n" + '\n'.join(lines))
+    return step
+
+
+def _rebuild_search_index(conn):
+    conn.execute('DELETE FROM books_fts')
+    conn.execute('''
+        INSERT INTO books_fts (rowid, title, author, isbn)
+        SELECT id, title, author, coalesce(isbn, '') || ' ' || replace(coalesce(isbn, ''), '-', '')
+        FROM books
+    ''')
+
+
+# One row per sale and per return of an order line, dated by order day and
+# return day respectively. Used to backfill the daily sales rollups. Orders
+# whose payment failed (migration 13) are not sales.
+SALES_EVENTS = '''
+    SELECT date(o.created_at) AS day, oi.book_id, oi.quantity AS units, oi.price * oi.quantity AS revenue,
+           0 AS returned_units, 0 AS returned_revenue
+    FROM order_items oi JOIN orders o ON o.order_id = oi.order_id
+    WHERE o.status IS NOT 'failed'
+    UNION ALL
+    SELECT date(coalesce(oi.return_date, o.created_at)), oi.book_id, 0, 0, oi.quantity, oi.price * oi.quantity
+    FROM order_items oi JOIN orders o ON o.order_id = oi.order_id
+    WHERE oi.return_requested AND o.status IS NOT 'failed'
+'''
+
+ROLLUP_SUMS = '''sum(e.units), round(sum(e.revenue), 2), sum(e.returned_units), round(sum(e.returned_revenue), 2)'''
+
+
+def rebuild_sales_rollups(conn):
+    for table in ('sales_daily_books', 'sales_daily_course_lists', 'sales_daily_departments'):
+        conn.execute(f'DELETE FROM {table}')
+    conn.execute(f'''
+        INSERT INTO sales_daily_books (day, book_id, units, revenue, returned_units, returned_revenue)
+        SELECT e.day, e.book_id, {ROLLUP_SUMS}
+        FROM ({SALES_EVENTS}) e
+        GROUP BY e.day, e.book_id
+    ''')
+    conn.execute(f'''
+        INSERT INTO sales_daily_course_lists (day, course_list_id, units, revenue, returned_units, returned_revenue)
+        SELECT e.day, clb.course_list_id, {ROLLUP_SUMS}
+        FROM ({SALES_EVENTS}) e JOIN course_list_books clb ON clb.book_id = e.book_id
+        GROUP BY e.day, clb.course_list_id
+    ''')
+    conn.execute(f'''
+        INSERT INTO sales_daily_departments (day, department, units, revenue, returned_units, returned_revenue)
+        SELECT e.day, d.department, {ROLLUP_SUMS}
+        FROM ({SALES_EVENTS}) e
+        JOIN (SELECT DISTINCT clb.book_id, cl.department
+              FROM course_list_books clb JOIN course_lists cl ON cl.id = clb.course_list_id) d
+          ON d.book_id = e.book_id
+        GROUP BY e.day, d.department
+    ''')
+
+
+# Course -> books read model for the public course pages (migration 15):
+# one row per adopted book with everything the page shows, keyed so a course
+# lookup is a single range scan. Departments and course numbers are stored
+# upper-cased and trimmed, as CourseBooks.normalize looks them up.
+COURSE_BOOKS = '''
+    SELECT upper(trim(cl.department)), upper(trim(cl.course_number)), cl.id, b.id,
+           cl.course_title, cl.professor_name, b.isbn, b.title, b.author, b.price, b.cover_url
+    FROM course_list_books clb
+    JOIN course_lists cl ON cl.id = clb.course_list_id
+    JOIN books b ON b.id = clb.book_id
+'''
+
+
+def rebuild_course_books(conn):
+    conn.execute('DELETE FROM course_books')
+    conn.execute(f'''
+        INSERT INTO course_books (department, course_number, course_list_id, book_id, course_title,
+                                  professor_name, isbn, title, author, price, cover_url)
+        {COURSE_BOOKS}
+    ''')
+
+
+def _sales_rollup_trigger(name, event, when, day, units, revenue):
+    # One trigger keeps all three rollups in step with order_items. units and
+    # revenue are the (column, value) pairs to add; the course list and
+    # department rows follow the book's course lists at the time of the event.
+    column_u, value_u = units
+    column_r, value_r = revenue
+    upsert = f'''ON CONFLICT DO UPDATE SET
+                {column_u} = {column_u} + excluded.{column_u},
+                {column_r} = round({column_r} + excluded.{column_r}, 2)'''
+    return f'''
+        CREATE TRIGGER IF NOT EXISTS {name} {event} {when} BEGIN
+            INSERT INTO sales_daily_books (day, book_id, {column_u}, {column_r})
+            VALUES ({day}, new.book_id, {value_u}, {value_r})
+            {upsert};
+            INSERT INTO sales_daily_course_lists (day, course_list_id, {column_u}, {column_r})
+            SELECT {day}, clb.course_list_id, {value_u}, {value_r}
+            FROM course_list_books clb WHERE clb.book_id = new.book_id
+            {upsert};
+            INSERT INTO sales_daily_departments (day, department, {column_u}, {column_r})
+            SELECT DISTINCT {day}, cl.department, {value_u}, {value_r}
+            FROM course_list_books clb JOIN course_lists cl ON cl.id = clb.course_list_id
+            WHERE clb.book_id = new.book_id
+            {upsert};
+        END
+    '''
+
+
+MIGRATIONS = [
+    (1, 'base tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            isbn TEXT NOT NULL,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            price REAL NOT NULL,
+            cover_url TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            department TEXT,
+            address TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            total_amount REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            return_requested BOOLEAN DEFAULT 0,
+            return_date DATETIME,
+            FOREIGN KEY (order_id) REFERENCES orders (order_id),
+            FOREIGN KEY (book_id) REFERENCES books (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS course_lists (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            professor TEXT NOT NULL,
+            professor_name TEXT NOT NULL,
+            course_title TEXT NOT NULL,
+            department TEXT NOT NULL,
+            course_number TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS course_list_books (
+            course_list_id INTEGER,
+            book_id INTEGER,
+            PRIMARY KEY (course_list_id, book_id),
+            FOREIGN KEY (course_list_id) REFERENCES course_lists(id),
+            FOREIGN KEY (book_id) REFERENCES books(id)
+        )
+        ''',
+    ]),
+    (2, 'full text search over books', [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, isbn,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3 4'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author, isbn)
+            VALUES (new.id, new.title, new.author,
+                    coalesce(new.isbn, '') || ' ' || replace(coalesce(new.isbn, ''), '-', ''));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            DELETE FROM books_fts WHERE rowid = old.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE ON books BEGIN
+            DELETE FROM books_fts WHERE rowid = old.id;
+            INSERT INTO books_fts (rowid, title, author, isbn)
+            VALUES (new.id, new.title, new.author,
+                    coalesce(new.isbn, '') || ' ' || replace(coalesce(new.isbn, ''), '-', ''));
+        END
+        ''',
+        _rebuild_search_index,
+    ]),
+    (3, 'catalog sort indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_books_title ON books (title, id)',
+        'CREATE INDEX IF NOT EXISTS idx_books_author ON books (author, id)',
+        'CREATE INDEX IF NOT EXISTS idx_books_price ON books (price, id)',
+    ]),
+    (4, 'course list indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_course_list_books_book ON course_list_books (book_id)',
+        'CREATE INDEX IF NOT EXISTS idx_course_lists_professor ON course_lists (professor)',
+    ]),
+    (5, 'order, user and isbn indexes and constraints', [
+        'CREATE INDEX IF NOT EXISTS idx_orders_user_email ON orders (user_email)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_book ON order_items (book_id)',
+        _require_unique('users', 'email'),
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)',
+        _require_unique('books', 'isbn'),
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_books_isbn ON books (isbn)',
+    ]),
+    (6, 'server-side carts', [
+        '''
+        CREATE TABLE IF NOT EXISTS carts (
+            token TEXT PRIMARY KEY,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS cart_items (
+            token TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL CHECK (quantity > 0),
+            PRIMARY KEY (token, book_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_carts_updated_at ON carts (updated_at)',
+    ]),
+    (7, 'catalog version counter', [
+        '''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        ''',
+        'INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 1)',
+    ] + [
+        # Any write to the books or course list tables bumps the version, so
+        # other processes can tell when their cached catalog data is stale.
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+            UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        END
+        '''
+        for table in ('books', 'course_lists', 'course_list_books')
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (8, 'catalog last modified time', [
+        'ALTER TABLE catalog_version ADD COLUMN updated_at TIMESTAMP',
+        'UPDATE catalog_version SET updated_at = CURRENT_TIMESTAMP',
+    ] + [
+        step
+        for table in ('books', 'course_lists', 'course_list_books')
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+        for step in (
+            f'DROP TRIGGER IF EXISTS {table}_version_{event.lower()}',
+            f'''
+            CREATE TRIGGER {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+            END
+            ''',
+        )
+    ]),
+    (9, 'order history index and per-user order summaries', [
+        'CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_email, created_at)',
+        # Covered by the new index's leading column
+        'DROP INDEX IF EXISTS idx_orders_user_email',
+        '''
+        CREATE TABLE IF NOT EXISTS user_order_summaries (
+            user_email TEXT PRIMARY KEY,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            lifetime_spend REAL NOT NULL DEFAULT 0,
+            open_returns INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT OR REPLACE INTO user_order_summaries (user_email, order_count, lifetime_spend, open_returns)
+        SELECT o.user_email, count(*), round(sum(o.total_amount), 2),
+               coalesce(sum((SELECT count(*) FROM order_items oi
+                             WHERE oi.order_id = o.order_id AND oi.return_requested)), 0)
+        FROM orders o
+        GROUP BY o.user_email
+        ''',
+        # Kept current by triggers, so every writer (checkout, returns, bulk
+        # loads) updates the summary in the same transaction.
+        '''
+        CREATE TRIGGER IF NOT EXISTS orders_summary_insert AFTER INSERT ON orders BEGIN
+            INSERT INTO user_order_summaries (user_email, order_count, lifetime_spend)
+            VALUES (new.user_email, 1, new.total_amount)
+            ON CONFLICT (user_email) DO UPDATE SET
+                order_count = order_count + 1,
+                lifetime_spend = round(lifetime_spend + excluded.lifetime_spend, 2);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS order_items_summary_return AFTER UPDATE OF return_requested ON order_items
+        WHEN coalesce(new.return_requested, 0) != coalesce(old.return_requested, 0) BEGIN
+            UPDATE user_order_summaries
+            SET open_returns = open_returns + (CASE WHEN new.return_requested THEN 1 ELSE -1 END)
+            WHERE user_email = (SELECT user_email FROM orders WHERE order_id = new.order_id);
+        END
+        ''',
+    ]),
+    (10, 'order delivery method for return windows', [
+        # NULL for orders placed before delivery methods were recorded; those
+        # fall under the return policy's catch-all window.
+        'ALTER TABLE orders ADD COLUMN delivery_method TEXT',
+    ]),
+    (11, 'daily sales rollups', [
+        *(
+            f'''
+            CREATE TABLE IF NOT EXISTS sales_daily_{table} (
+                day TEXT NOT NULL,
+                {column} {column_type} NOT NULL,
+                units INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0,
+                returned_units INTEGER NOT NULL DEFAULT 0,
+                returned_revenue REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, {column})
+            ) WITHOUT ROWID
+            '''
+            for table, column, column_type in (('books', 'book_id', 'INTEGER'),
+                                               ('course_lists', 'course_list_id', 'INTEGER'),
+                                               ('departments', 'department', 'TEXT'))
+        ),
+        rebuild_sales_rollups,
+        # Sales count on the order's day, returns on the day they were requested
+        _sales_rollup_trigger(
+            'order_items_sales_insert', 'AFTER INSERT ON order_items', '',
+            "(SELECT date(created_at) FROM orders WHERE order_id = new.order_id)",
+            ('units', 'new.quantity'), ('revenue', 'round(new.price * new.quantity, 2)'),
+        ),
+        _sales_rollup_trigger(
+            'order_items_sales_return', 'AFTER UPDATE OF return_requested ON order_items',
+            'WHEN coalesce(new.return_requested, 0) != coalesce(old.return_requested, 0)',
+            "date(coalesce(new.return_date, 'now'))",
+            ('returned_units', '(CASE WHEN new.return_requested THEN new.quantity ELSE -new.quantity END)'),
+            ('returned_revenue', '(CASE WHEN new.return_requested THEN 1 ELSE -1 END) * round(new.price * new.quantity, 2)'),
+        ),
+    ]),
+    (12, 'stock per book and channel with checkout reservations', [
+        # Books without a row in a channel are not stock-tracked there
+        '''
+        CREATE TABLE IF NOT EXISTS inventory (
+            book_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            on_hand INTEGER NOT NULL DEFAULT 0,
+            reserved INTEGER NOT NULL DEFAULT 0 CHECK (reserved >= 0),
+            PRIMARY KEY (book_id, channel),
+            FOREIGN KEY (book_id) REFERENCES books (id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stock_reservations (
+            reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            expires_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stock_reservation_items (
+            reservation_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (reservation_id, book_id, channel),
+            FOREIGN KEY (reservation_id) REFERENCES stock_reservations (reservation_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_stock_reservations_expires ON stock_reservations (expires_at)',
+    ]),
+    (13, 'background payment jobs and failed orders', [
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            queue TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_at REAL NOT NULL,
+            locked_until REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (queue, status, run_at)',
+        # Stock held for a pending order does not expire; it is fulfilled or
+        # released when the payment settles.
+        'ALTER TABLE stock_reservations ADD COLUMN order_id INTEGER',
+        'CREATE INDEX IF NOT EXISTS idx_stock_reservations_order ON stock_reservations (order_id)',
+        # A failed payment undoes what the insert triggers counted
+        '''
+        CREATE TRIGGER IF NOT EXISTS orders_summary_failed AFTER UPDATE OF status ON orders
+        WHEN new.status = 'failed' AND old.status IS NOT 'failed' BEGIN
+            UPDATE user_order_summaries
+            SET order_count = order_count - 1,
+                lifetime_spend = round(lifetime_spend - old.total_amount, 2)
+            WHERE user_email = old.user_email;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS orders_sales_failed AFTER UPDATE OF status ON orders
+        WHEN new.status = 'failed' AND old.status IS NOT 'failed' BEGIN
+            UPDATE sales_daily_books
+            SET units = sales_daily_books.units - s.units,
+                revenue = round(sales_daily_books.revenue - s.revenue, 2)
+            FROM (SELECT oi.book_id, sum(oi.quantity) AS units, sum(round(oi.price * oi.quantity, 2)) AS revenue
+                  FROM order_items oi WHERE oi.order_id = new.order_id
+                  GROUP BY oi.book_id) s
+            WHERE sales_daily_books.day = date(new.created_at) AND sales_daily_books.book_id = s.book_id;
+            UPDATE sales_daily_course_lists
+            SET units = sales_daily_course_lists.units - s.units,
+                revenue = round(sales_daily_course_lists.revenue - s.revenue, 2)
+            FROM (SELECT clb.course_list_id, sum(oi.quantity) AS units,
+                         sum(round(oi.price * oi.quantity, 2)) AS revenue
+                  FROM order_items oi JOIN course_list_books clb ON clb.book_id = oi.book_id
+                  WHERE oi.order_id = new.order_id
+                  GROUP BY clb.course_list_id) s
+            WHERE sales_daily_course_lists.day = date(new.created_at)
+              AND sales_daily_course_lists.course_list_id = s.course_list_id;
+            UPDATE sales_daily_departments
+            SET units = sales_daily_departments.units - s.units,
+                revenue = round(sales_daily_departments.revenue - s.revenue, 2)
+            FROM (SELECT d.department, sum(oi.quantity) AS units,
+                         sum(round(oi.price * oi.quantity, 2)) AS revenue
+                  FROM order_items oi
+                  JOIN (SELECT DISTINCT clb.book_id, cl.department
+                        FROM course_list_books clb JOIN course_lists cl ON cl.id = clb.course_list_id) d
+                    ON d.book_id = oi.book_id
+                  WHERE oi.order_id = new.order_id
+                  GROUP BY d.department) s
+            WHERE sales_daily_departments.day = date(new.created_at)
+              AND sales_daily_departments.department = s.department;
+        END
+        ''',
+    ]),
+    (14, 'isbn and course number lookups for bulk adoptions', [
+        # ISBNs are matched with or without hyphens (Book.ISBN_KEY)
+        "CREATE INDEX IF NOT EXISTS idx_books_isbn_key ON books (replace(replace(upper(isbn), '-', ''), ' ', ''))",
+        'CREATE INDEX IF NOT EXISTS idx_course_lists_course ON course_lists (department, course_number)',
+    ]),
+    (15, 'course to books read model for the public course pages', [
+        '''
+        CREATE TABLE IF NOT EXISTS course_books (
+            department TEXT NOT NULL,
+            course_number TEXT NOT NULL,
+            course_list_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            course_title TEXT,
+            professor_name TEXT,
+            isbn TEXT,
+            title TEXT,
+            author TEXT,
+            price REAL,
+            cover_url TEXT,
+            PRIMARY KEY (department, course_number, course_list_id, book_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_course_books_list ON course_books (course_list_id, book_id)',
+        'CREATE INDEX IF NOT EXISTS idx_course_books_book ON course_books (book_id)',
+        rebuild_course_books,
+        # Adoptions, book edits and course list edits keep it current
+        f'''
+        CREATE TRIGGER IF NOT EXISTS course_books_adopt AFTER INSERT ON course_list_books BEGIN
+            INSERT OR REPLACE INTO course_books (department, course_number, course_list_id, book_id, course_title,
+                                                 professor_name, isbn, title, author, price, cover_url)
+            {COURSE_BOOKS}
+            WHERE clb.course_list_id = new.course_list_id AND clb.book_id = new.book_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_books_drop AFTER DELETE ON course_list_books BEGIN
+            DELETE FROM course_books WHERE course_list_id = old.course_list_id AND book_id = old.book_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_books_book_update
+        AFTER UPDATE OF isbn, title, author, price, cover_url ON books BEGIN
+            UPDATE course_books
+            SET isbn = new.isbn, title = new.title, author = new.author, price = new.price, cover_url = new.cover_url
+            WHERE book_id = new.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_books_book_delete AFTER DELETE ON books BEGIN
+            DELETE FROM course_books WHERE book_id = old.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_books_list_update
+        AFTER UPDATE OF department, course_number, course_title, professor_name ON course_lists BEGIN
+            UPDATE course_books
+            SET department = upper(trim(new.department)), course_number = upper(trim(new.course_number)),
+                course_title = new.course_title, professor_name = new.professor_name
+            WHERE course_list_id = new.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_books_list_delete AFTER DELETE ON course_lists BEGIN
+            DELETE FROM course_books WHERE course_list_id = old.id;
+        END
+        ''',
+    ]),
+    (16, 'orders placed before background payments were paid', [
+        # Until migration 13 an order was only written once its payment went
+        # through, so every order without a payment job is paid. Only paid
+        # orders can be returned (ReturnPolicy.RETURNABLE).
+        '''
+        UPDATE orders SET status = 'paid'
+        WHERE lower(status) = 'pending'
+          AND order_id NOT IN (SELECT json_extract(payload, '$.order_id') FROM jobs WHERE queue = 'payments')
+        ''',
+    ]),
+]
+
+def hot_queries():
+    # (name, sql, sample params, expected scans) for the hot statements, taken
+    # from the modules that run them; each must be served by an index (or the
+    # FTS index), as checked with EXPLAIN QUERY PLAN by `python migrations.py
+    # check`. Imported here because those modules import this one.
+    import importer
+    import jobs
+    import reports
+    import search
+    from models import Book, CourseBooks, CourseList, Inventory, Order, OrderItem, ReturnPolicy, User
+
+    queries = [('Book.get_book_by_id', Book.BY_ID, (1,))]
+    for sort, column in Book.SORTS.items():
+        queries += [
+            (f'Book.get_page({sort})', Book.page_query(column), (25,)),
+            (f'Book.get_page({sort}, after)', Book.page_query(column, after=True), ('', 0, 25)),
+            (f'Book.get_page({sort}, before)', Book.page_query(column, before=True), ('', 0, 25)),
+        ]
+    order_items, policy = Order.with_items_query()
+    queries += [
+        ('Book.ids_by_isbn', Book.BY_ISBN_KEYS.format('?, ?'), ('x', 'y')),
+        ('importer.UPSERT', importer.UPSERT, ('x', 't', 'a', 1.0, None)),
+        ('search.search_books(count)', search.COUNT, ('"physics"*',)),
+        ('search.search_books', search.RESULTS, ('"physics"*', 20, 0)),
+        ('User.find_by_email', User.BY_EMAIL, ('x',)),
+        ('Order.get_order_with_items', order_items, policy + [1]),
+        ('Order.get_orders_by_user_email', Order.BY_USER, ('x',)),
+        ('Order.get_order_history', Order.history_query(), ('x', 21)),
+        ('Order.get_order_history(after)', Order.history_query(after=True), ('x', '', 0, 21)),
+        ('Order.get_order_history(before)', Order.history_query(before=True), ('x', '', 0, 21)),
+        ('Order.get_user_summary', Order.SUMMARY, ('x',)),
+        ('OrderItem.get_order_items_by_order_id', OrderItem.BY_ORDER, (1,)),
+    ]
+    for name, where, params in (('evaluate_order', ReturnPolicy.ORDER, [1]),
+                                ('evaluate_user', ReturnPolicy.USER, ['x']),
+                                ('evaluate_items', ReturnPolicy.ITEMS.format('?, ?'), [1, 2])):
+        sql, policy = ReturnPolicy.query(where)
+        queries.append((f'ReturnPolicy.{name}', sql, policy + params))
+    for name, sql in reports.QUERIES.items():
+        queries.append((f'reports.{name}', sql, ('2024-01-01', '2024-12-31', 20)))
+    queries += [
+        ('Inventory.reserve', Inventory.RESERVE, (1, 1, 'warehouse', 1)),
+        ('Inventory.reserve(shortage)', Inventory.AVAILABLE, (1, 'warehouse')),
+        ('Inventory.fulfil', Inventory.FULFIL.format(where=Inventory.ORDER), (1,)),
+        ('Inventory.fulfil(forget items)', Inventory.FORGET_ITEMS.format(where=Inventory.ORDER), (1,)),
+        ('Inventory.fulfil(forget)', Inventory.FORGET.format(where=Inventory.ORDER), (1,)),
+        ('Inventory.release', Inventory.RELEASE.format(where=Inventory.RESERVATION), (1,)),
+        ('Inventory.release_expired', Inventory.RELEASE.format(where=Inventory.EXPIRED), (0,)),
+        ('Inventory.release_expired(forget)', Inventory.FORGET.format(where=Inventory.EXPIRED), (0,)),
+        ('jobs.claim', jobs.NEXT_DUE.format('?'), ('payments', 0)),
+        ('jobs.claim(expired lease)', jobs.NEXT_EXPIRED.format('?'), ('payments', 0)),
+        ('CourseList.get_course_lists_by_professor', CourseList.BY_PROFESSOR, ('x',)),
+        ('CourseList.get_course_list_books', CourseList.BOOKS, (1,)),
+        ('CourseList.create_course_lists', CourseList.FIND_COURSE, ('x', '1', 'x')),
+        ('CourseBooks.lookup', CourseBooks.SECTIONS, ('ITEC', '3500')),
+        # Trigger bodies only run inside their triggering statement, so their
+        # lookups are listed here as written in migrations 11 and 15
+        ('sales rollup triggers', 'SELECT course_list_id FROM course_list_books WHERE book_id = ?', (1,)),
+        ('course_books_book_update', 'SELECT department FROM course_books WHERE book_id = ?', (1,)),
+        ('course_books_drop',
+         'SELECT department FROM course_books WHERE course_list_id = ? AND book_id = ?', (1, 1)),
+    ]
+    # Scans that are fine: a first catalog page walks its sort index until
+    # LIMIT, the return policy CTE (p) has a handful of rows, and held and r
+    # are subqueries already narrowed by an index.
+    scans = {f'Book.get_page({sort})': ('books',) for sort in Book.SORTS}
+    scans.update({name: ('p', 'CONSTANT') for name, _, _ in queries
+                  if name.startswith('ReturnPolicy.') or name == 'Order.get_order_with_items'})
+    scans.update({name: ('held',) for name in ('Inventory.fulfil', 'Inventory.release', 'Inventory.release_expired')})
+    scans.update({name: ('r',) for name in ('reports.books', 'reports.course_lists')})
+    return [(name, sql, params, scans.get(name, ())) for name, sql, params in queries]
+
+
+def _ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    if conn.in_transaction:
+        conn.commit()
+
+
+def applied_versions(path=db.DB_PATH):
+    with db.get_connection(path) as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute('SELECT version FROM schema_migrations')}
+
+
+def pending_migrations(path=db.DB_PATH):
+    applied = applied_versions(path)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def migrate(path=db.DB_PATH, target=None, verbose=False):
+    applied = []
+    with db.get_connection(path) as conn:
+        _ensure_version_table(conn)
+        for version, name, steps in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            # BEGIN IMMEDIATE takes the write lock up front so two processes
+            # starting together cannot both apply the same migration.
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                done = conn.execute(
+                    'SELECT 1 FROM schema_migrations WHERE version = ?', (version,)
+                ).fetchone()
+                if not done:
+                    for step in steps:
+                        if callable(step):
+                            step(conn)
+                        else:
+                            conn.execute(step)
+                    conn.execute(
+                        'INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name)
+                    )
+                    applied.append(version)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            if verbose and not done:
+                print(f"Applied migration {version}: {name}")
+    return applied
+
+
+def explain(conn, sql, params):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def check_query_plans(path=db.DB_PATH):
+    # Returns (name, plan, ok) for every hot query. A query fails the check if
+    # any step is a full scan other than the expected ones.
+    results = []
+    with db.get_connection(path) as conn:
+        for name, sql, params, scans in hot_queries():
+            plan = explain(conn, sql, params)
+            ok = not any(
+                detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail and detail.split()[1] not in scans
+                for detail in plan
+            )
+            results.append((name, plan, ok))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply and inspect bookstore.db schema migrations.')
+    parser.add_argument('command', nargs='?', default='upgrade', choices=['upgrade', 'status', 'check'])
+    parser.add_argument('--db', default=db.DB_PATH, help='database file (default: %(default)s)')
+    parser.add_argument('--target', type=int, help='stop after this migration version')
+    args = parser.parse_args(argv)
+
+    if args.command == 'upgrade':
+        try:
+            applied = migrate(args.db, target=args.target, verbose=True)
+        except MigrationError as e:
+            print(e, file=sys.stderr)
+            return 1
+        if not applied:
+            print("Database is up to date.")
+        return 0
+
+    if args.command == 'status':
+        done = applied_versions(args.db)
+        for version, name, _ in MIGRATIONS:
+            print(f"{'applied' if version in done else 'pending':8} {version:3} {name}")
+        return 0
+
+    pending = pending_migrations(args.db)
+    if pending:
+        for version, name, _ in pending:
+            print(f"pending  {version:3} {name}")
+        print(f"{len(pending)} migrations are not applied; run `python migrations.py upgrade --db {args.db}` first.")
+        return 1
+
+    failures = 0
+    for name, plan, ok in check_query_plans(args.db):
+        failures += not ok
+        print(f"{'ok' if ok else 'SCAN':5} {name}")
+        for detail in plan:
+            print(f"      {detail}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,82 @@
-import sqlite3
+import base64
+import json
+import re
+import secrets
+import threading
+import time
 from flask import session
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+
+import db
+from cache import LRUCache
+
+
+def encode_cursor(value, row_id):
+    raw = json.dumps([value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, row_id = json.loads(raw)
+        if not isinstance(value, (str, int, float)) or not isinstance(row_id, (int, float)):
+            return None
+        return value, int(row_id)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+class CatalogPage:
+    def __init__(self, books, sort, per_page, next_cursor=None, prev_cursor=None):
+        self.books = books
+        self.sort = sort
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+class OrderHistoryPage:
+    def __init__(self, orders, per_page, next_cursor=None, prev_cursor=None):
+        self.orders = orders
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+class CourseSection:
+    # One course list of a course, as shown on the public course page
+    def __init__(self, course_list_id, course_title, professor_name, books):
+        self.course_list_id = course_list_id
+        self.course_title = course_title
+        self.professor_name = professor_name
+        self.books = books
+
+    @property
+    def total(self):
+        return round(sum(book.price for book in self.books), 2)
 
 
 class Book:
-    DB_PATH = 'bookstore.db'
+    DB_PATH = db.DB_PATH
+    PAGE_SIZE = 24
+    MAX_PAGE_SIZE = 100
+    # Each sort key is backed by a (column, id) index, see migration 3
+    SORTS = {'title': 'title', 'author': 'author', 'price': 'price'}
+
+    # Read-through caches, invalidated by Book.invalidate on every catalog write
+    cache = LRUCache(max_entries=20000, max_bytes=32 * 1024 * 1024, ttl=600)
+    page_cache = LRUCache(max_entries=512, max_bytes=16 * 1024 * 1024, ttl=120)
+
+    # Loaders select COLUMNS, in __init__ order, for db.fetch_all/fetch_one
+    COLUMNS = 'id, isbn, title, author, price, cover_url'
+    __slots__ = ('id', 'isbn', 'title', 'author', 'price', 'cover_url')
+    # Indexed expression (migration 14) matching ISBNs with or without hyphens
+    ISBN_KEY = "replace(replace(upper(isbn), '-', ''), ' ', '')"
+
+    # SQL shared with `python migrations.py check`, which explains it
+    BY_ID = f'SELECT {COLUMNS} FROM books WHERE id = ?'
+    BY_ISBN_KEYS = f'SELECT {ISBN_KEY}, id FROM books WHERE {ISBN_KEY} IN ({{}})'
 
     def __init__(self, id, isbn, title, author, price, cover_url=None):
         self.id = id
@@ -16,101 +88,284 @@ class Book:
 
     @classmethod
     def get_connection(cls):
-        return sqlite3.connect(cls.DB_PATH)
+        return db.get_connection(cls.DB_PATH)
 
     @classmethod
     def get_all_books(cls):
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            rows = conn.execute('SELECT * FROM books').fetchall()
-            return [
-                cls(row['id'], row['isbn'], row['title'], row['author'], row['price'], row['cover_url'])
-                for row in rows
-            ]
+            return db.fetch_all(conn, cls, f'SELECT {cls.COLUMNS} FROM books')
+
+    @classmethod
+    def invalidate(cls, book_id=None):
+        # Catalog pages can contain any book, so every write drops them; a
+        # single book entry only goes when that book changed.
+        if book_id is not None:
+            cls.cache.invalidate(int(book_id))
+        cls.page_cache.clear()
+
+    @classmethod
+    def cache_stats(cls):
+        return {'books': cls.cache.stats(), 'pages': cls.page_cache.stats()}
+
+    @classmethod
+    def get_page(cls, sort='title', after=None, before=None, per_page=None):
+        column = cls.SORTS.get(sort, 'title')
+        per_page = max(1, min(per_page or cls.PAGE_SIZE, cls.MAX_PAGE_SIZE))
+        key = (column, after, None if after else before, per_page)
+        return cls.page_cache.get_or_load(key, lambda: cls._load_page(column, after, before, per_page))
+
+    @classmethod
+    def _load_page(cls, column, after, before, per_page):
+        after = decode_cursor(after) if after else None
+        before = decode_cursor(before) if before and not after else None
+        params = list(after or before or ()) + [per_page + 1]
+
+        with cls.get_connection() as conn:
+            books = db.fetch_all(conn, cls, cls.page_query(column, bool(after), bool(before)), params)
+        has_more = len(books) > per_page
+        books = books[:per_page]
+        if before:
+            books.reverse()
+
+        next_cursor = prev_cursor = None
+        if books:
+            first, last = books[0], books[-1]
+            if before or has_more:
+                next_cursor = encode_cursor(getattr(last, column), last.id)
+            if after or (before and has_more):
+                prev_cursor = encode_cursor(getattr(first, column), first.id)
+        return CatalogPage(books, column, per_page, next_cursor, prev_cursor)
+
+    @classmethod
+    def page_query(cls, column, after=False, before=False):
+        # Keyset page on (column, id); takes the cursor (if any) and LIMIT
+        query = f'SELECT {cls.COLUMNS} FROM books'
+        if after:
+            query += f' WHERE ({column}, id) > (?, ?) ORDER BY {column}, id'
+        elif before:
+            query += f' WHERE ({column}, id) < (?, ?) ORDER BY {column} DESC, id DESC'
+        else:
+            query += f' ORDER BY {column}, id'
+        return query + ' LIMIT ?'
 
     @classmethod
     def get_book_by_id(cls, book_id):
+        return cls.cache.get_or_load(int(book_id), lambda: cls._load_book(book_id))
+
+    @classmethod
+    def _load_book(cls, book_id):
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            row = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-            if row:
-                return cls(row['id'], row['isbn'], row['title'], row['author'], row['price'], row['cover_url'])
-        return None
+            return db.fetch_one(conn, cls, cls.BY_ID, (book_id,))
 
     @classmethod
     def get_books_by_ids(cls, book_ids):
         if not book_ids:
             return []
-        with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            query = 'SELECT * FROM books WHERE id IN ({})'.format(','.join('?' * len(book_ids)))
-            rows = conn.execute(query, book_ids).fetchall()
-            return [
-                cls(row['id'], row['isbn'], row['title'], row['author'], row['price'], row['cover_url'])
-                for row in rows
-            ]
+        book_ids = list(dict.fromkeys(int(book_id) for book_id in book_ids))
+        found = {}
+        missing = []
+        for book_id in book_ids:
+            book = cls.cache.get(book_id)
+            if book is None:
+                missing.append(book_id)
+            else:
+                found[book_id] = book
+        if missing:
+            with cls.get_connection() as conn:
+                query = f'SELECT {cls.COLUMNS} FROM books WHERE id IN ({",".join("?" * len(missing))})'
+                books = db.fetch_all(conn, cls, query, missing)
+            for book in books:
+                cls.cache.set(book.id, book)
+                found[book.id] = book
+        return [found[book_id] for book_id in book_ids if book_id in found]
+
+    @staticmethod
+    def isbn_key(isbn):
+        # Python side of ISBN_KEY
+        return str(isbn).strip().replace('-', '').replace(' ', '').upper()
 
     @classmethod
-    def search_all_books(cls):
+    def ids_by_isbn(cls, isbns):
+        # {isbn_key: book id} for the ISBNs in the catalog, hyphenated or not
+        keys = list(dict.fromkeys(cls.isbn_key(isbn) for isbn in isbns if isbn))
+        if not keys:
+            return {}
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            rows = conn.execute("SELECT * FROM books").fetchall()
-            return [
-                cls(row['id'], row['isbn'], row['title'], row['author'], row['price'], row['cover_url'])
-                for row in rows
-            ]
+            rows = conn.execute(cls.BY_ISBN_KEYS.format(','.join('?' * len(keys))), keys).fetchall()
+        return {key: book_id for key, book_id in rows}
 
     def is_on_course_list(self):
-        with self.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            row = conn.execute('SELECT 1 FROM course_list_books WHERE book_id = ?', (self.id,)).fetchone()
-            return row is not None
+        return CourseList.membership.has_course_list(self.id)
 
     def get_course_lists(self):
-        with CourseList.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            rows = conn.execute("""
-                SELECT cl.id, cl.department || ' ' || cl.course_number AS name, cl.course_title, 
-                cl.professor, cl.professor_name 
-                FROM course_lists cl
-                JOIN course_list_books clb ON cl.id = clb.course_list_id
-                WHERE clb.book_id = ?
-            """, (self.id,)).fetchall()
-            return [
-                {
-                    "id": row["id"],
-                    "name": row["name"],
-                    "course_title": row["course_title"],
-                    "professor": row["professor"],
-                    "professor_name": row["professor_name"]
-                }
-                for row in rows
-            ]
+        return CourseList.membership.course_lists_for(self.id)
 
 
-class Cart:
+class SQLiteCartStore:
+    # Cart contents keyed by an opaque session token; one row per
+    # (token, book_id) so adds and updates are single-row upserts.
+    def __init__(self, path=db.DB_PATH):
+        self.path = path
+
+    def get(self, token):
+        with db.get_connection(self.path) as conn:
+            rows = conn.execute(
+                'SELECT book_id, quantity FROM cart_items WHERE token = ?', (token,)
+            ).fetchall()
+        return {book_id: quantity for book_id, quantity in rows}
+
+    def _touch(self, conn, token):
+        conn.execute(
+            'INSERT INTO carts (token, updated_at) VALUES (?, ?) '
+            'ON CONFLICT (token) DO UPDATE SET updated_at = excluded.updated_at',
+            (token, time.time())
+        )
+
+    def add(self, token, book_id, quantity=1):
+        with db.get_connection(self.path) as conn:
+            self._touch(conn, token)
+            conn.execute(
+                'INSERT INTO cart_items (token, book_id, quantity) VALUES (?, ?, ?) '
+                'ON CONFLICT (token, book_id) DO UPDATE SET quantity = quantity + excluded.quantity',
+                (token, book_id, quantity)
+            )
+
+    def set(self, token, book_id, quantity):
+        with db.get_connection(self.path) as conn:
+            self._touch(conn, token)
+            conn.execute(
+                'INSERT INTO cart_items (token, book_id, quantity) VALUES (?, ?, ?) '
+                'ON CONFLICT (token, book_id) DO UPDATE SET quantity = excluded.quantity',
+                (token, book_id, quantity)
+            )
+
+    def remove(self, token, book_id):
+        with db.get_connection(self.path) as conn:
+            self._touch(conn, token)
+            conn.execute('DELETE FROM cart_items WHERE token = ? AND book_id = ?', (token, book_id))
+
+    def clear(self, token):
+        with db.get_connection(self.path) as conn:
+            conn.execute('DELETE FROM cart_items WHERE token = ?', (token,))
+            conn.execute('DELETE FROM carts WHERE token = ?', (token,))
+
+    def sweep(self, max_age):
+        cutoff = time.time() - max_age
+        with db.get_connection(self.path) as conn:
+            conn.execute(
+                'DELETE FROM cart_items WHERE token IN (SELECT token FROM carts WHERE updated_at < ?)',
+                (cutoff,)
+            )
+            return conn.execute('DELETE FROM carts WHERE updated_at < ?', (cutoff,)).rowcount
+
+
+class MemoryCartStore:
+    # Same interface as SQLiteCartStore, for single-process deployments and
+    # benchmarks. Contents are lost on restart.
     def __init__(self):
-        if 'cart' not in session:
-            session['cart'] = []
+        self._carts = {}
+        self._updated = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            return dict(self._carts.get(token, {}))
+
+    def add(self, token, book_id, quantity=1):
+        with self._lock:
+            items = self._carts.setdefault(token, {})
+            items[book_id] = items.get(book_id, 0) + quantity
+            self._updated[token] = time.time()
+
+    def set(self, token, book_id, quantity):
+        with self._lock:
+            self._carts.setdefault(token, {})[book_id] = quantity
+            self._updated[token] = time.time()
+
+    def remove(self, token, book_id):
+        with self._lock:
+            self._carts.get(token, {}).pop(book_id, None)
+            self._updated[token] = time.time()
+
+    def clear(self, token):
+        with self._lock:
+            self._carts.pop(token, None)
+            self._updated.pop(token, None)
+
+    def sweep(self, max_age):
+        cutoff = time.time() - max_age
+        with self._lock:
+            expired = [token for token, updated in self._updated.items() if updated < cutoff]
+            for token in expired:
+                self._carts.pop(token, None)
+                del self._updated[token]
+        return len(expired)
 
-    def add_item(self, book_id):
-        session['cart'].append(book_id)
-        session.modified = True
+
+class Cart:
+    # The session cookie only carries a short token; contents live in the store.
+    store = SQLiteCartStore()
+    MAX_AGE = 30 * 24 * 3600
+    SWEEP_INTERVAL = 3600
+    _last_sweep = 0.0
+
+    def __init__(self):
+        self.token = session.get('cart_token')
+        legacy = session.pop('cart', None)
+        if legacy:
+            for book_id in legacy:
+                self.add_item(book_id)
+        self.maybe_sweep()
+
+    def _ensure_token(self):
+        if self.token is None:
+            self.token = secrets.token_urlsafe(16)
+            session['cart_token'] = self.token
+        return self.token
+
+    def add_item(self, book_id, quantity=1):
+        self.store.add(self._ensure_token(), int(book_id), quantity)
+
+    def update_item(self, book_id, quantity):
+        if quantity <= 0:
+            self.remove_item(book_id)
+        else:
+            self.store.set(self._ensure_token(), int(book_id), quantity)
+
+    def remove_item(self, book_id):
+        if self.token is not None:
+            self.store.remove(self.token, int(book_id))
 
     def get_items(self):
-        return session.get('cart', [])
+        # {book_id: quantity}
+        if self.token is None:
+            return {}
+        return self.store.get(self.token)
 
     def clear(self):
-        session['cart'] = []
-        session.modified = True
+        if self.token is not None:
+            self.store.clear(self.token)
+
+    @classmethod
+    def maybe_sweep(cls):
+        now = time.monotonic()
+        if now - cls._last_sweep >= cls.SWEEP_INTERVAL:
+            Cart._last_sweep = now
+            cls.store.sweep(cls.MAX_AGE)
 
 
 class User:
-    DB_PATH = 'bookstore.db'
+    DB_PATH = db.DB_PATH
+    COLUMNS = 'email, name, status, department, address'
+    __slots__ = ('email', 'name', 'status', 'department', 'address')
+    # Identity cache by email, dropped on profile writes in this process; the
+    # TTL bounds staleness from writes made by other processes.
+    cache = LRUCache(max_entries=10000, max_bytes=8 * 1024 * 1024, ttl=300)
+    BY_EMAIL = f'SELECT {COLUMNS} FROM users WHERE email = ?'
 
     @classmethod
     def get_connection(cls):
-        return sqlite3.connect(cls.DB_PATH)
+        return db.get_connection(cls.DB_PATH)
 
     def __init__(self, email, name, status=None, department=None, address=None):
         self.email = email
@@ -129,29 +384,36 @@ class User:
         return self.status == 'faculty'
 
     def update_profile(self, new_name, new_address, new_department):
-        self.name = new_name
-        self.address = new_address
-        self.department = new_department
         with self.get_connection() as conn:
             conn.execute(
                 "UPDATE users SET name = ?, address = ?, department = ? WHERE email = ?",
                 (new_name, new_address, new_department, self.email)
             )
+        self.name = new_name
+        self.address = new_address
+        self.department = new_department
+        User.invalidate(self.email)
+
+    @classmethod
+    def invalidate(cls, email):
+        User.cache.invalidate(email)
 
     @classmethod
     def find_by_email(cls, email):
+        # Unknown emails are not cached, so a new account is found at once.
+        # Callers get their own copy: the cached instance is shared by every
+        # request and is never mutated.
+        if not email:
+            return None
+        user = User.cache.get_or_load(email, lambda: cls._load_user(email))
+        if user is None:
+            return None
+        return cls(user.email, user.name, user.status, user.department, user.address)
+
+    @classmethod
+    def _load_user(cls, email):
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            row = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
-            if row:
-                return cls(
-                    email=row['email'],
-                    name=row['name'],
-                    status=row['status'],
-                    department=row['department'],
-                    address=row['address']
-                )
-        return None
+            return db.fetch_one(conn, User, User.BY_EMAIL, (email,))
 
     @classmethod
     def authenticate(cls, email):
@@ -167,11 +429,15 @@ class User:
 
 
 class Student(User):
+    __slots__ = ()
+
     def __init__(self, email, name, status='student', department=None, address=None):
         super().__init__(email, name, status, department, address)
 
 
 class Staff(User):
+    __slots__ = ()
+
     def __init__(self, email, name, status='staff', department=None, address=None):
         super().__init__(email, name, status, department, address)
 
@@ -179,11 +445,13 @@ class Staff(User):
     def add_book(title, author, price):
         with Book.get_connection() as conn:
             conn.execute('INSERT INTO books (title, author, price) VALUES (?, ?, ?)', (title, author, price))
+        Book.invalidate()
 
     @staticmethod
     def delete_book(book_id):
         with Book.get_connection() as conn:
             conn.execute('DELETE FROM books WHERE id = ?', (book_id,))
+        Book.invalidate(book_id)
 
     @staticmethod
     def update_book(book_id, title, author, price):
@@ -192,9 +460,12 @@ class Staff(User):
                 'UPDATE books SET title = ?, author = ?, price = ? WHERE id = ?',
                 (title, author, price, book_id)
             )
+        Book.invalidate(book_id)
 
 
 class Faculty(User):
+    __slots__ = ()
+
     def __init__(self, email, name, status='faculty', department=None, address=None):
         super().__init__(email, name, status, department, address)
 
@@ -205,23 +476,147 @@ class Faculty(User):
     def _update_database(self, field, value):
         with self.get_connection() as conn:
             conn.execute(f"UPDATE users SET {field} = ? WHERE email = ?", (value, self.email))
+        User.invalidate(self.email)
 
     @staticmethod
     def add_book(title, author, price):
         with Book.get_connection() as conn:
             conn.execute('INSERT INTO books (title, author, price) VALUES (?, ?, ?)', (title, author, price))
+        Book.invalidate()
 
     @staticmethod
     def add_book_to_course_list(course_list_id, book_id):
         CourseList.add_book_to_course_list(course_list_id, book_id)
 
+    @staticmethod
+    def add_books_to_course_list(course_list_id, isbns):
+        return CourseList.add_books_by_isbn([(course_list_id, isbn) for isbn in isbns])
+
     @staticmethod
     def remove_book_from_course_list(course_list_id, book_id):
         CourseList.remove_book_from_course_list(course_list_id, book_id)
 
 
+class CourseListIndex:
+    # In-memory book_id -> course list summaries, loaded once with two queries
+    # and then kept current by the CourseList write methods. The refresh
+    # interval bounds staleness from writes made by other processes.
+    REFRESH_INTERVAL = 300
+
+    def __init__(self, path=db.DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._summaries = None
+        self._by_book = None
+        self._loaded_at = 0.0
+
+    def load(self):
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        with db.get_connection(self.path) as conn:
+            lists = conn.execute(
+                "SELECT id, department || ' ' || course_number AS name, course_title, "
+                "professor, professor_name FROM course_lists"
+            ).fetchall()
+            memberships = conn.execute(
+                "SELECT course_list_id, book_id FROM course_list_books ORDER BY course_list_id"
+            ).fetchall()
+        summaries = {
+            row['id']: {
+                "id": row["id"],
+                "name": row["name"],
+                "course_title": row["course_title"],
+                "professor": row["professor"],
+                "professor_name": row["professor_name"]
+            }
+            for row in lists
+        }
+        by_book = {}
+        for course_list_id, book_id in memberships:
+            if course_list_id in summaries:
+                by_book.setdefault(book_id, []).append(course_list_id)
+        self._summaries = summaries
+        self._by_book = by_book
+        self._loaded_at = time.monotonic()
+
+    def _loaded(self):
+        # (summaries, by_book), loading them first if needed. Readers use
+        # these references only: invalidate() may reset the attributes as soon
+        # as the lock is released.
+        with self._lock:
+            if self._summaries is None or time.monotonic() - self._loaded_at > self.REFRESH_INTERVAL:
+                self._load()
+            return self._summaries, self._by_book
+
+    def invalidate(self):
+        with self._lock:
+            self._summaries = None
+            self._by_book = None
+
+    def __len__(self):
+        summaries, by_book = self._loaded()
+        return len(summaries)
+
+    def course_lists_for(self, book_id):
+        with self._lock:
+            summaries, by_book = self._loaded()
+            return [summaries[list_id] for list_id in by_book.get(int(book_id), ())]
+
+    def has_course_list(self, book_id):
+        summaries, by_book = self._loaded()
+        return bool(by_book.get(int(book_id)))
+
+    def add_course_list(self, course_list_id, professor, professor_name, course_title, department, course_number):
+        with self._lock:
+            if self._summaries is None:
+                return
+            self._summaries[course_list_id] = {
+                "id": course_list_id,
+                "name": f"{department} {course_number}",
+                "course_title": course_title,
+                "professor": professor,
+                "professor_name": professor_name
+            }
+
+    def add_membership(self, course_list_id, book_id):
+        with self._lock:
+            if self._by_book is None:
+                return
+            if int(course_list_id) not in self._summaries:
+                self._summaries = self._by_book = None
+                return
+            list_ids = self._by_book.setdefault(int(book_id), [])
+            if int(course_list_id) not in list_ids:
+                list_ids.append(int(course_list_id))
+                list_ids.sort()
+
+    def remove_membership(self, course_list_id, book_id):
+        with self._lock:
+            if self._by_book is None:
+                return
+            list_ids = self._by_book.get(int(book_id))
+            if list_ids and int(course_list_id) in list_ids:
+                list_ids.remove(int(course_list_id))
+                if not list_ids:
+                    del self._by_book[int(book_id)]
+
+
 class CourseList:
-    DB_PATH = 'bookstore.db'
+    DB_PATH = db.DB_PATH
+    membership = CourseListIndex(DB_PATH)
+    COLUMNS = "id, professor, course_title, department, course_number, department || ' ' || course_number"
+    __slots__ = ('id', 'professor', 'course_title', 'department', 'course_number', 'name')
+    BY_PROFESSOR = f'SELECT {COLUMNS} FROM course_lists WHERE professor = ?'
+    BOOKS = ('SELECT b.id, b.isbn, b.title, b.author, b.price, b.cover_url '
+             'FROM books b '
+             'JOIN course_list_books clb ON b.id = clb.book_id '
+             'WHERE clb.course_list_id = ?')
+    # Lists created through the form may hold "itec" or " 3500", so stored
+    # values are compared normalized (the professor index narrows the scan)
+    FIND_COURSE = ('SELECT id FROM course_lists WHERE upper(trim(department)) = ? '
+                   'AND upper(trim(course_number)) = ? AND professor = ? ORDER BY id LIMIT 1')
 
     def __init__(self, id, professor, course_title, department, course_number, name=None):
         self.id = id
@@ -233,17 +628,17 @@ class CourseList:
 
     @classmethod
     def get_connection(cls):
-        return sqlite3.connect(cls.DB_PATH)
+        return db.get_connection(cls.DB_PATH)
 
     @classmethod
     def create_course_list(cls, professor, professor_name, course_title, department, course_number):
         with cls.get_connection() as conn:
-            name = f"{department} {course_number}"
-            conn.execute(
+            cursor = conn.execute(
                 "INSERT INTO course_lists (professor, professor_name, course_title, department, course_number) VALUES (?, ?, ?, ?, ?)",
                 (professor, professor_name, course_title, department, course_number)
             )
-
+        cls.membership.add_course_list(cursor.lastrowid, professor, professor_name, course_title, department, course_number)
+        return cursor.lastrowid
 
     @classmethod
     def add_book_to_course_list(cls, course_list_id, book_id):
@@ -252,6 +647,7 @@ class CourseList:
                 "INSERT INTO course_list_books (course_list_id, book_id) VALUES (?, ?)",
                 (course_list_id, book_id)
             )
+        cls.membership.add_membership(course_list_id, book_id)
 
     @classmethod
     def remove_book_from_course_list(cls, course_list_id, book_id):
@@ -260,71 +656,239 @@ class CourseList:
                 "DELETE FROM course_list_books WHERE course_list_id = ? AND book_id = ?",
                 (course_list_id, book_id)
             )
+        cls.membership.remove_membership(course_list_id, book_id)
 
     @classmethod
     def get_all_course_lists(cls):
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            rows = conn.execute('SELECT * FROM course_lists').fetchall()
-            return [
-                cls(row['id'], row['professor'], row['course_title'], row['department'], row['course_number'], row['department'] + ' ' + row['course_number'])
-                for row in rows
-            ]
+            return db.fetch_all(conn, cls, f'SELECT {cls.COLUMNS} FROM course_lists')
 
     @classmethod
     def get_course_list_by_id(cls, course_list_id):
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            row = conn.execute('SELECT * FROM course_lists WHERE id = ?', (course_list_id,)).fetchone()
-            if row:
-                return cls(row['id'], row['professor'], row['course_title'], row['department'], row['course_number'], row['department'] + ' ' + row['course_number'])
-        return None
+            return db.fetch_one(conn, cls, f'SELECT {cls.COLUMNS} FROM course_lists WHERE id = ?', (course_list_id,))
 
     @classmethod
     def get_course_lists_by_professor(cls, professor_name):
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            rows = conn.execute(
-                "SELECT * FROM course_lists WHERE professor = ?",
-                (professor_name,)
-            ).fetchall()
-            return [
-                cls(row['id'], row['professor'], row['course_title'], row['department'], row['course_number'], row['department'] + ' ' + row['course_number'])
-                for row in rows
-            ]
+            return db.fetch_all(conn, cls, cls.BY_PROFESSOR, (professor_name,))
         
     @classmethod
     def get_course_list_books(cls, course_list_id):
-        conn = cls.get_connection()
-        conn.row_factory = sqlite3.Row
-        rows = conn.execute(
-            "SELECT b.id, b.isbn, b.title, b.author, b.price, b.cover_url "
-            "FROM books b "
-            "JOIN course_list_books clb ON b.id = clb.book_id "
-            "WHERE clb.course_list_id = ?",
-            (course_list_id,)
-        ).fetchall()
-        conn.close()
-        return [
-            Book(row['id'], row['isbn'], row['title'], row['author'], row['price'], row['cover_url'])
-            for row in rows
-        ]
+        with cls.get_connection() as conn:
+            return db.fetch_all(conn, Book, cls.BOOKS, (course_list_id,))
 
+    @classmethod
+    def create_course_lists(cls, professor, professor_name, courses):
+        # courses: [(course_title, department, course_number)], in one
+        # transaction. Returns (ids in the same order, number created); the
+        # professor's existing list for a department and course number is
+        # reused (case and surrounding spaces aside), so submitting the same
+        # courses again creates nothing.
+        ids = []
+        created = []
+        with db.transaction(cls.DB_PATH) as conn:
+            for course_title, department, course_number in courses:
+                department, course_number = CourseBooks.normalize(department, course_number)
+                row = conn.execute(cls.FIND_COURSE, (department, course_number, professor)).fetchone()
+                if row is None:
+                    row = conn.execute(
+                        'INSERT INTO course_lists (professor, professor_name, course_title, department, course_number) '
+                        'VALUES (?, ?, ?, ?, ?) RETURNING id',
+                        (professor, professor_name, course_title, department, course_number)
+                    ).fetchone()
+                    created.append((row[0], course_title, department, course_number))
+                ids.append(row[0])
+        for course_list_id, course_title, department, course_number in created:
+            cls.membership.add_course_list(course_list_id, professor, professor_name, course_title,
+                                           department, course_number)
+        return ids, len(created)
 
+    @classmethod
+    def add_books_by_isbn(cls, adoptions):
+        # adoptions: [(course_list_id, isbn)], in one transaction. Returns
+        # (books added, ISBNs not in the catalog). Books already on a list are
+        # skipped by the (course_list_id, book_id) primary key.
+        book_ids = Book.ids_by_isbn([isbn for _, isbn in adoptions])
+        pairs = []
+        unknown = []
+        for course_list_id, isbn in adoptions:
+            book_id = book_ids.get(Book.isbn_key(isbn))
+            if book_id is None:
+                unknown.append(isbn)
+            else:
+                pairs.append((int(course_list_id), book_id))
+        with db.transaction(cls.DB_PATH) as conn:
+            added = conn.executemany(
+                'INSERT INTO course_list_books (course_list_id, book_id) VALUES (?, ?) ON CONFLICT DO NOTHING',
+                pairs
+            ).rowcount
+        for course_list_id, book_id in pairs:
+            cls.membership.add_membership(course_list_id, book_id)
+        return added, unknown
 
-class Order:
-    DB_PATH = 'bookstore.db'
+    @classmethod
+    def adopt(cls, professor, professor_name, courses):
+        # courses: [(course_title, department, course_number, isbns)]. Creates
+        # or reuses the lists and attaches their books in one transaction.
+        # Returns (lists created, books added, unknown ISBNs).
+        with db.transaction(cls.DB_PATH):
+            ids, created = cls.create_course_lists(professor, professor_name, [course[:3] for course in courses])
+            added, unknown = cls.add_books_by_isbn(
+                [(course_list_id, isbn) for course_list_id, course in zip(ids, courses) for isbn in course[3]]
+            )
+        return created, added, unknown
+
+
+
+class CourseBooks:
+    # Public "what books do I need for ITEC 3500" pages. They read the
+    # course_books table (migration 15), which triggers keep in step with
+    # adoptions and with book and course list edits, so a lookup is one range
+    # scan without joins. Results are cached per catalog version, which the
+    # same writes bump (migration 7), so writes from other processes show up
+    # on the next request.
+    DB_PATH = db.DB_PATH
+    cache = LRUCache(max_entries=4096, max_bytes=16 * 1024 * 1024, ttl=3600)
+    QUERY = re.compile(r'^\s*([A-Za-z]+)[\s_-]*([0-9][0-9A-Za-z]*)\s*$')
+    SECTIONS = ('SELECT course_list_id, course_title, professor_name, book_id, isbn, title, author, price, cover_url '
+                'FROM course_books WHERE department = ? AND course_number = ?')
+
+    @staticmethod
+    def normalize(department, course_number):
+        return (department or '').strip().upper(), (course_number or '').strip().upper()
+
+    @classmethod
+    def parse(cls, query):
+        # "ITEC 3500", "itec3500" or "ITEC-3500" -> ('ITEC', '3500'), else None
+        match = cls.QUERY.match(query or '')
+        return cls.normalize(*match.groups()) if match else None
+
+    @classmethod
+    def lookup(cls, department, course_number):
+        # [CourseSection], one per course list teaching the course; empty when
+        # no books are adopted for it
+        department, course_number = cls.normalize(department, course_number)
+        key = ('course', Catalog.version(), department, course_number)
+        return cls.cache.get_or_load(key, lambda: cls._load(department, course_number))
+
+    @classmethod
+    def _load(cls, department, course_number):
+        with db.get_connection(cls.DB_PATH) as conn:
+            rows = conn.execute(cls.SECTIONS, (department, course_number)).fetchall()
+        sections = {}
+        for row in rows:
+            section = sections.get(row[0])
+            if section is None:
+                section = sections[row[0]] = CourseSection(row[0], row[1], row[2], [])
+            section.books.append(Book(*row[3:]))
+        for section in sections.values():
+            section.books.sort(key=lambda book: book.title)
+        return list(sections.values())
+
+    @classmethod
+    def courses(cls, department=None):
+        # [(department, course_number, course_title, number of books)] for
+        # every course with adopted books, optionally for one department
+        department = (department or '').strip().upper() or None
+        key = ('courses', Catalog.version(), department)
+        return cls.cache.get_or_load(key, lambda: cls._load_courses(department))
+
+    @classmethod
+    def _load_courses(cls, department):
+        query = ('SELECT department, course_number, min(course_title), count(DISTINCT book_id) '
+                 'FROM course_books')
+        params = ()
+        if department:
+            query += ' WHERE department = ?'
+            params = (department,)
+        query += ' GROUP BY department, course_number'
+        with db.get_connection(cls.DB_PATH) as conn:
+            return [tuple(row) for row in conn.execute(query, params)]
+
+
+class Catalog:
+    # Books and course lists as a whole. The version counter is bumped by
+    # triggers on every write (migration 7), so it also sees writes made by
+    # other processes and by importer.py.
+    DB_PATH = db.DB_PATH
+    WARM_PAGES = 1
+    # Version the in-process caches were filled at, see sync
+    seen_version = None
+
+    @classmethod
+    def version(cls):
+        return cls.state()[0]
+
+    @classmethod
+    def state(cls):
+        # (version, last modified datetime in UTC)
+        with db.get_connection(cls.DB_PATH) as conn:
+            row = conn.execute('SELECT version, updated_at FROM catalog_version WHERE id = 1').fetchone()
+        if not row:
+            return 0, None
+        updated_at = datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc) if row[1] else None
+        return row[0], updated_at
+
+    @classmethod
+    def invalidate(cls):
+        Book.cache.clear()
+        Book.page_cache.clear()
+        CourseList.membership.invalidate()
+        CourseBooks.cache.clear()
 
-    def __init__(self, order_id, user_email, status='pending', total_amount=0, created_at=None):
+    @classmethod
+    def sync(cls, version):
+        # Drops the in-process caches when the catalog moved past the version
+        # they were filled at, so writes from other processes (importer.py,
+        # other workers) show up at once rather than when entries expire.
+        if version != cls.seen_version:
+            cls.invalidate()
+            cls.seen_version = version
+
+    @classmethod
+    def warm(cls, max_books=None):
+        # Fill the in-process caches up front: the first catalog pages for
+        # every sort, up to max_books books by id and the course list index.
+        # Returns the number of books loaded.
+        max_books = Book.cache.max_entries if max_books is None else max_books
+        cls.seen_version = cls.version()
+        for sort in Book.SORTS:
+            after = None
+            for _ in range(cls.WARM_PAGES):
+                page = Book.get_page(sort, after=after)
+                after = page.next_cursor
+                if not after:
+                    break
+        with db.get_connection(cls.DB_PATH) as conn:
+            books = db.fetch_all(conn, Book, f'SELECT {Book.COLUMNS} FROM books ORDER BY id LIMIT ?', (max_books,))
+        for book in books:
+            Book.cache.set(book.id, book)
+        CourseList.membership.load()
+        return len(books)
+
+
+class Order:
+    DB_PATH = db.DB_PATH
+    HISTORY_PAGE_SIZE = 20
+    MAX_HISTORY_PAGE_SIZE = 100
+    COLUMNS = 'order_id, user_email, status, total_amount, created_at, delivery_method'
+    # items is only set by the loaders that fetch order lines
+    __slots__ = ('order_id', 'user_email', 'status', 'total_amount', 'created_at', 'delivery_method', 'items')
+    BY_USER = f'SELECT {COLUMNS} FROM orders WHERE user_email = ?'
+    SUMMARY = 'SELECT order_count, lifetime_spend, open_returns FROM user_order_summaries WHERE user_email = ?'
+
+    def __init__(self, order_id, user_email, status='pending', total_amount=0, created_at=None, delivery_method=None):
         self.order_id = order_id
         self.user_email = user_email
         self.status = status
         self.total_amount = total_amount
         self.created_at = created_at or datetime.now()
+        self.delivery_method = delivery_method
 
     @classmethod
     def get_connection(cls):
-        return sqlite3.connect(cls.DB_PATH)
+        return db.get_connection(cls.DB_PATH)
 
     @classmethod
     def create_order(cls, user_email, total_amount):
@@ -336,28 +900,201 @@ class Order:
             order_id = cursor.lastrowid
             return cls(order_id, user_email, status='Pending', total_amount=total_amount)
 
+    @classmethod
+    def place_order(cls, user_email, items, delivery_method=None, reservation_id=None):
+        # items: [(book, quantity)]. The order, all of its lines and the stock
+        # it holds until payment (see Inventory.hold) are written in one
+        # transaction, so a failure, including OutOfStock, leaves nothing
+        # behind. The order stays pending until mark_paid or mark_failed.
+        # Prices are read from books inside the transaction, not from the
+        # (possibly cached) book objects; books deleted since are left out.
+        items = [(book, quantity) for book, quantity in items if quantity > 0]
+        with db.transaction(cls.DB_PATH) as conn:
+            prices = dict(conn.execute(
+                f"SELECT id, price FROM books WHERE id IN ({','.join('?' * len(items))})",
+                [book.id for book, quantity in items]
+            ).fetchall())
+            items = [(book, quantity) for book, quantity in items if book.id in prices]
+            total_amount = round(sum(prices[book.id] * quantity for book, quantity in items), 2)
+            order_id, created_at = conn.execute(
+                "INSERT INTO orders (user_email, total_amount, status, delivery_method) VALUES (?, ?, ?, ?) "
+                "RETURNING order_id, created_at",
+                (user_email, total_amount, 'pending', delivery_method)
+            ).fetchone()
+            conn.executemany(
+                "INSERT INTO order_items (order_id, book_id, quantity, price) VALUES (?, ?, ?, ?)",
+                [(order_id, book.id, quantity, prices[book.id]) for book, quantity in items]
+            )
+            first_item_id = conn.execute(
+                "SELECT min(order_item_id) FROM order_items WHERE order_id = ?", (order_id,)
+            ).fetchone()[0]
+            Inventory.hold(
+                order_id,
+                reservation_id,
+                [(book.id, quantity) for book, quantity in items],
+                Inventory.channel_for(delivery_method),
+            )
+        order = cls(order_id, user_email, 'pending', total_amount, created_at, delivery_method)
+        order.items = [
+            {
+                'order_item_id': first_item_id + offset,
+                'book_id': book.id,
+                'title': book.title,
+                'author': book.author,
+                'price': prices[book.id],
+                'quantity': quantity,
+                'returnable': True,
+                'return_requested': False,
+            }
+            for offset, (book, quantity) in enumerate(items)
+        ]
+        return order
+
+    @classmethod
+    def mark_paid(cls, order_id):
+        # Pending -> paid, and the held stock becomes a sale. Returns False if
+        # the order was no longer pending, so repeated calls are harmless.
+        with db.transaction(cls.DB_PATH) as conn:
+            updated = conn.execute(
+                "UPDATE orders SET status = 'paid' WHERE order_id = ? AND status = 'pending'", (order_id,)
+            ).rowcount
+            if updated:
+                Inventory.fulfil(order_id)
+        return bool(updated)
+
+    @classmethod
+    def mark_failed(cls, order_id):
+        # Pending -> failed: held stock is released, and triggers (migration
+        # 13) take the order out of the user's summary and the sales rollups.
+        with db.transaction(cls.DB_PATH) as conn:
+            updated = conn.execute(
+                "UPDATE orders SET status = 'failed' WHERE order_id = ? AND status = 'pending'", (order_id,)
+            ).rowcount
+            if updated:
+                Inventory.release_order(order_id)
+        return bool(updated)
+
+    @classmethod
+    def get_status(cls, order_id):
+        # (user_email, status), or (None, None) for an unknown order
+        with cls.get_connection() as conn:
+            row = conn.execute(
+                'SELECT user_email, status FROM orders WHERE order_id = ?', (order_id,)
+            ).fetchone()
+        return (row['user_email'], row['status']) if row else (None, None)
+
     @classmethod
     def get_order_by_id(cls, order_id):
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            row = conn.execute('SELECT * FROM orders WHERE order_id = ?', (order_id,)).fetchone()
-            if row:
-                return cls(row['order_id'], row['user_email'], row['status'], row['total_amount'], row['created_at'])
-        return None
+            return db.fetch_one(conn, cls, f'SELECT {cls.COLUMNS} FROM orders WHERE order_id = ?', (order_id,))
     
+    @classmethod
+    def with_items_query(cls):
+        # (sql, return policy params); the order id goes last
+        policy, params = ReturnPolicy.cte()
+        return f"""
+            WITH {policy}
+            SELECT o.order_id, o.user_email, o.status, o.total_amount, o.created_at, o.delivery_method,
+                   oi.order_item_id, oi.book_id, oi.quantity, oi.price, oi.return_requested,
+                   b.title, b.author,
+                   {ReturnPolicy.RETURNABLE} AS returnable, {ReturnPolicy.DEADLINE} AS return_deadline
+            FROM orders o
+            LEFT JOIN users u ON u.email = o.user_email
+            LEFT JOIN order_items oi ON oi.order_id = o.order_id
+            LEFT JOIN books b ON b.id = oi.book_id
+            WHERE o.order_id = ?
+            ORDER BY oi.order_item_id
+        """, params
+
+    @classmethod
+    def get_order_with_items(cls, order_id):
+        # Loads the order, its line items with book data and return eligibility
+        # (see ReturnPolicy) in a single joined query. Items whose book was
+        # deleted are skipped.
+        query, params = cls.with_items_query()
+        with cls.get_connection() as conn:
+            rows = conn.execute(query, params + [order_id]).fetchall()
+        if not rows:
+            return None
+        first = rows[0]
+        order = cls(first['order_id'], first['user_email'], first['status'], first['total_amount'],
+                    first['created_at'], first['delivery_method'])
+        order.items = [
+            {
+                'order_item_id': row['order_item_id'],
+                'book_id': row['book_id'],
+                'title': row['title'],
+                'author': row['author'],
+                'price': row['price'],
+                'quantity': row['quantity'],
+                'returnable': bool(row['returnable']),
+                'return_requested': bool(row['return_requested']),
+                'return_deadline': row['return_deadline'],
+            }
+            for row in rows
+            if row['order_item_id'] is not None and row['title'] is not None
+        ]
+        return order
+
+    @classmethod
+    def get_order_history(cls, user_email, after=None, before=None, per_page=None):
+        # Newest first, keyset paginated on (created_at, order_id) using
+        # idx_orders_user_created (migration 9). `after` pages to older
+        # orders, `before` back to newer ones.
+        per_page = max(1, min(per_page or cls.HISTORY_PAGE_SIZE, cls.MAX_HISTORY_PAGE_SIZE))
+        after = decode_cursor(after) if after else None
+        before = decode_cursor(before) if before and not after else None
+
+        params = [user_email] + list(after or before or ()) + [per_page + 1]
+
+        with cls.get_connection() as conn:
+            orders = db.fetch_all(conn, cls, cls.history_query(bool(after), bool(before)), params)
+        has_more = len(orders) > per_page
+        orders = orders[:per_page]
+        if before:
+            orders.reverse()
+
+        next_cursor = prev_cursor = None
+        if orders:
+            first, last = orders[0], orders[-1]
+            if before or has_more:
+                next_cursor = encode_cursor(last.created_at, last.order_id)
+            if after or (before and has_more):
+                prev_cursor = encode_cursor(first.created_at, first.order_id)
+        return OrderHistoryPage(orders, per_page, next_cursor, prev_cursor)
+
+    @classmethod
+    def history_query(cls, after=False, before=False):
+        # Takes the user, the cursor (if any) and LIMIT
+        query = cls.BY_USER
+        if after:
+            query += ' AND (created_at, order_id) < (?, ?) ORDER BY created_at DESC, order_id DESC'
+        elif before:
+            query += ' AND (created_at, order_id) > (?, ?) ORDER BY created_at, order_id'
+        else:
+            query += ' ORDER BY created_at DESC, order_id DESC'
+        return query + ' LIMIT ?'
+
+    @classmethod
+    def get_user_summary(cls, user_email):
+        # Maintained by triggers on orders and order_items (migration 9)
+        with cls.get_connection() as conn:
+            row = conn.execute(cls.SUMMARY, (user_email,)).fetchone()
+        if row:
+            return {'order_count': row[0], 'lifetime_spend': row[1], 'open_returns': row[2]}
+        return {'order_count': 0, 'lifetime_spend': 0.0, 'open_returns': 0}
+
     @classmethod
     def get_orders_by_user_email(cls, user_email):
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            rows = conn.execute('SELECT * FROM orders WHERE user_email = ?', (user_email,)).fetchall()
-            return [
-                cls(row['order_id'], row['user_email'], row['status'], row['total_amount'], row['created_at'])
-                for row in rows
-            ]
+            return db.fetch_all(conn, cls, cls.BY_USER, (user_email,))
 
 
 class OrderItem:
-    DB_PATH = 'bookstore.db'
+    DB_PATH = db.DB_PATH
+    COLUMNS = 'order_item_id, order_id, book_id, quantity, price'
+    __slots__ = ('order_item_id', 'order_id', 'book_id', 'quantity', 'price')
+    BY_ORDER = f'SELECT {COLUMNS} FROM order_items WHERE order_id = ?'
 
     def __init__(self, order_item_id, order_id, book_id, quantity, price):
         self.order_item_id = order_item_id
@@ -368,7 +1105,7 @@ class OrderItem:
 
     @classmethod
     def get_connection(cls):
-        return sqlite3.connect(cls.DB_PATH)
+        return db.get_connection(cls.DB_PATH)
 
     @classmethod
     def create_order_item(cls, order_id, book_id, quantity, price):
@@ -381,34 +1118,331 @@ class OrderItem:
     @classmethod
     def get_order_items_by_order_id(cls, order_id):
         with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            rows = conn.execute('SELECT * FROM order_items WHERE order_id = ?', (order_id,)).fetchall()
-            return [
-                cls(row['order_item_id'], row['order_id'], row['book_id'], row['quantity'], row['price'])
-                for row in rows
-            ]
+            return db.fetch_all(conn, cls, cls.BY_ORDER, (order_id,))
         
     @classmethod
-    def request_return(cls, order_item_id):
+    def request_return(cls, order_item_id, user_email=None):
+        return bool(cls.request_returns([order_item_id], user_email))
+
+    @classmethod
+    def request_returns(cls, order_item_ids, user_email=None):
+        # Marks every eligible item in one transaction; eligibility is checked
+        # inside it, so two concurrent requests cannot both return an item.
+        # With user_email, only that user's items are touched. Returns the ids
+        # that were marked.
+        order_item_ids = list(dict.fromkeys(int(order_item_id) for order_item_id in order_item_ids))
+        if not order_item_ids:
+            return []
+        with db.transaction(cls.DB_PATH) as conn:
+            eligible = [
+                item['order_item_id']
+                for item in ReturnPolicy.evaluate_items(order_item_ids, user_email)
+                if item['returnable']
+            ]
+            if eligible:
+                conn.execute(
+                    "UPDATE order_items SET return_requested = 1, return_date = CURRENT_TIMESTAMP "
+                    f"WHERE order_item_id IN ({','.join('?' * len(eligible))})",
+                    eligible
+                )
+        return eligible
+
+    @classmethod
+    def is_returnable(cls, order_item_id):
+        items = ReturnPolicy.evaluate_items([order_item_id])
+        return bool(items and items[0]['returnable'])
+
+
+class ReturnPolicy:
+    # Return windows in days by (delivery method, user role). None matches
+    # anything; the most specific matching rule wins, then the earliest.
+    # Eligibility is computed in SQL with date arithmetic, so a whole order
+    # or a user's entire history is evaluated in one query. For example
+    # ('Digital download', None, 14) or (None, 'faculty', 60).
+    RULES = [
+        (None, None, 30),
+    ]
+
+    # Expressions over orders o, order_items oi and users u
+    WINDOW = '''(
+        SELECT p.days FROM return_policy p
+        WHERE (p.delivery_method IS NULL OR p.delivery_method = o.delivery_method)
+          AND (p.role IS NULL OR p.role = u.status)
+        ORDER BY (p.delivery_method IS NOT NULL) + (p.role IS NOT NULL) DESC, p.rank
+        LIMIT 1
+    )'''
+    DEADLINE = f"datetime(o.created_at, '+' || {WINDOW} || ' days')"
+    RETURNABLE = (f"(o.status = 'paid' AND NOT coalesce(oi.return_requested, 0) "
+                  f"AND datetime('now') <= {DEADLINE})")
+
+    @classmethod
+    def cte(cls):
+        rows = ', '.join('(?, ?, ?, ?)' for _ in cls.RULES)
+        params = [value for rank, (method, role, days) in enumerate(cls.RULES) for value in (method, role, days, rank)]
+        return f'return_policy (delivery_method, role, days, rank) AS (VALUES {rows})', params
+
+    # Filters for query(); ITEMS takes the placeholders for the item ids
+    ORDER = 'oi.order_id = ?'
+    USER = 'o.user_email = ?'
+    ITEMS = 'oi.order_item_id IN ({})'
+
+    @classmethod
+    def query(cls, where):
+        # (sql, policy params); the params of `where` go last
+        policy, params = cls.cte()
+        return f'''
+            WITH {policy}
+            SELECT oi.order_item_id, oi.order_id, o.user_email, oi.book_id, b.title,
+                   oi.return_requested, {cls.DEADLINE} AS return_deadline, {cls.RETURNABLE} AS returnable
+            FROM order_items oi
+            JOIN orders o ON o.order_id = oi.order_id
+            LEFT JOIN users u ON u.email = o.user_email
+            LEFT JOIN books b ON b.id = oi.book_id
+            WHERE {where}
+            ORDER BY oi.order_item_id
+        ''', params
+
+    @classmethod
+    def _evaluate(cls, where, params):
+        query, policy_params = cls.query(where)
+        # Inside db.transaction this reuses the transaction's connection
+        with db.get_connection(OrderItem.DB_PATH) as conn:
+            rows = conn.execute(query, policy_params + params).fetchall()
+        return [
+            {
+                'order_item_id': row['order_item_id'],
+                'order_id': row['order_id'],
+                'user_email': row['user_email'],
+                'book_id': row['book_id'],
+                'title': row['title'],
+                'return_requested': bool(row['return_requested']),
+                'return_deadline': row['return_deadline'],
+                'returnable': bool(row['returnable']),
+            }
+            for row in rows
+        ]
+
+    @classmethod
+    def evaluate_order(cls, order_id):
+        return cls._evaluate(cls.ORDER, [order_id])
+
+    @classmethod
+    def evaluate_user(cls, user_email):
+        return cls._evaluate(cls.USER, [user_email])
+
+    @classmethod
+    def evaluate_items(cls, order_item_ids, user_email=None):
+        where = cls.ITEMS.format(','.join('?' * len(order_item_ids)))
+        params = list(order_item_ids)
+        if user_email is not None:
+            where += ' AND o.user_email = ?'
+            params.append(user_email)
+        return cls._evaluate(where, params)
+
+
+class OutOfStock(Exception):
+    def __init__(self, shortages):
+        # shortages: [(book_id, requested, available)]
+        self.shortages = shortages
+        super().__init__('; '.join(
+            f"book {book_id}: {requested} requested, {available} available"
+            for book_id, requested, available in shortages
+        ))
+
+
+class Inventory:
+    DB_PATH = db.DB_PATH
+    # Delivery method -> stock channel. A book is only tracked in a channel
+    # once it has an inventory row there; untracked stock never runs out
+    # (digital downloads, and books staff have not counted yet).
+    CHANNELS = {
+        'Shipping': 'warehouse',
+        'In-store pickup': 'store',
+        'Digital download': 'digital',
+    }
+    DEFAULT_CHANNEL = 'warehouse'
+    RESERVATION_TTL = 15 * 60  # seconds a reservation without an order is kept
+    SWEEP_INTERVAL = 60
+    _last_sweep = 0.0
+
+    # Conditional update: stock is only claimed if enough is available, so
+    # concurrent checkouts of the same book can never oversell it.
+    RESERVE = (
+        'UPDATE inventory SET reserved = reserved + ? '
+        'WHERE book_id = ? AND channel = ? AND on_hand - reserved >= ? RETURNING book_id'
+    )
+    AVAILABLE = 'SELECT on_hand - reserved FROM inventory WHERE book_id = ? AND channel = ?'
+    # Releasing and forgetting the reservations r matching {where}
+    RELEASE = '''
+        UPDATE inventory SET reserved = max(0, inventory.reserved - held.quantity)
+        FROM (
+            SELECT ri.book_id, ri.channel, sum(ri.quantity) AS quantity
+            FROM stock_reservation_items ri
+            JOIN stock_reservations r ON r.reservation_id = ri.reservation_id
+            WHERE {where}
+            GROUP BY ri.book_id, ri.channel
+        ) held
+        WHERE inventory.book_id = held.book_id AND inventory.channel = held.channel
+    '''
+    FORGET_ITEMS = ('DELETE FROM stock_reservation_items WHERE reservation_id IN '
+                    '(SELECT r.reservation_id FROM stock_reservations r WHERE {where})')
+    FORGET = 'DELETE FROM stock_reservations AS r WHERE {where}'
+    FULFIL = '''
+        UPDATE inventory SET on_hand = on_hand - held.quantity, reserved = max(0, reserved - held.quantity)
+        FROM (
+            SELECT ri.book_id, ri.channel, sum(ri.quantity) AS quantity
+            FROM stock_reservation_items ri
+            JOIN stock_reservations r ON r.reservation_id = ri.reservation_id
+            WHERE {where}
+            GROUP BY ri.book_id, ri.channel
+        ) held
+        WHERE inventory.book_id = held.book_id AND inventory.channel = held.channel
+    '''
+    RESERVATION = 'r.reservation_id = ?'
+    ORDER = 'r.order_id = ?'
+    # Reservations left behind by requests that died mid-checkout
+    EXPIRED = 'r.expires_at < ? AND r.order_id IS NULL'
+
+    @classmethod
+    def get_connection(cls):
+        return db.get_connection(cls.DB_PATH)
+
+    @classmethod
+    def channel_for(cls, delivery_method):
+        return cls.CHANNELS.get(delivery_method, cls.DEFAULT_CHANNEL)
+
+    @classmethod
+    def channels(cls):
+        return list(dict.fromkeys(cls.CHANNELS.values()))
+
+    @classmethod
+    def get_stock(cls, book_id):
+        # {channel: {'on_hand', 'reserved', 'available'}} for tracked channels
         with cls.get_connection() as conn:
-            conn.execute(
-                "UPDATE order_items SET return_requested = ?, return_date = ? WHERE order_item_id = ?",
-                (True, datetime.now(), order_item_id)
+            rows = conn.execute(
+                'SELECT channel, on_hand, reserved FROM inventory WHERE book_id = ?', (book_id,)
+            ).fetchall()
+        return {
+            row['channel']: {
+                'on_hand': row['on_hand'],
+                'reserved': row['reserved'],
+                'available': max(0, row['on_hand'] - row['reserved']),
+            }
+            for row in rows
+        }
+
+    @classmethod
+    def set_stock(cls, book_id, channel, on_hand):
+        # on_hand=None stops tracking the book in that channel
+        with db.transaction(cls.DB_PATH) as conn:
+            if on_hand is None:
+                conn.execute('DELETE FROM inventory WHERE book_id = ? AND channel = ?', (book_id, channel))
+            else:
+                conn.execute(
+                    'INSERT INTO inventory (book_id, channel, on_hand) VALUES (?, ?, ?) '
+                    'ON CONFLICT (book_id, channel) DO UPDATE SET on_hand = excluded.on_hand',
+                    (book_id, channel, on_hand)
+                )
+
+    @classmethod
+    def _claim(cls, conn, sql, items, channel):
+        # Runs sql for every (book_id, quantity); raises OutOfStock
+        # (rolling back the caller's transaction) if any tracked book is short.
+        claimed = []
+        shortages = []
+        for book_id, quantity in items:
+            if conn.execute(sql, (quantity, book_id, channel, quantity)).fetchall():
+                claimed.append((book_id, quantity))
+                continue
+            row = conn.execute(cls.AVAILABLE, (book_id, channel)).fetchone()
+            if row is not None:
+                shortages.append((book_id, quantity, max(0, row[0])))
+        if shortages:
+            raise OutOfStock(shortages)
+        return claimed
+
+    @staticmethod
+    def _merge(items):
+        quantities = {}
+        for book_id, quantity in items:
+            if quantity > 0:
+                quantities[book_id] = quantities.get(book_id, 0) + quantity
+        # A fixed order keeps lock acquisition uniform across checkouts
+        return sorted(quantities.items())
+
+    @classmethod
+    def reserve(cls, items, channel, ttl=None, order_id=None):
+        # Holds stock for items [(book_id, quantity)], all or nothing, in one
+        # short BEGIN IMMEDIATE transaction. Returns a reservation id, or None
+        # when nothing is tracked. Reservations without an order expire after
+        # ttl seconds; those held for an order last until it is paid or fails.
+        cls.maybe_sweep()
+        items = cls._merge(items)
+        with db.transaction(cls.DB_PATH) as conn:
+            claimed = cls._claim(conn, cls.RESERVE, items, channel)
+            if not claimed:
+                return None
+            reservation_id = conn.execute(
+                'INSERT INTO stock_reservations (expires_at, order_id) VALUES (?, ?) RETURNING reservation_id',
+                (time.time() + (ttl or cls.RESERVATION_TTL), order_id)
+            ).fetchone()[0]
+            conn.executemany(
+                'INSERT INTO stock_reservation_items (reservation_id, book_id, channel, quantity) VALUES (?, ?, ?, ?)',
+                [(reservation_id, book_id, channel, quantity) for book_id, quantity in claimed]
             )
+        return reservation_id
 
     @classmethod
-    def is_returnable(cls, order_item_id): #Return window is 30 days
-        with cls.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            row = conn.execute(
-                "SELECT o.created_at, oi.return_requested FROM order_items oi "
-                "JOIN orders o ON oi.order_id = o.order_id WHERE oi.order_item_id = ?",
-                (order_item_id,)
-            ).fetchone()
-            if row:
-                order_date = datetime.strptime(row['created_at'], '%Y-%m-%d %H:%M:%S')
-                return_requested = row['return_requested']
-                if return_requested:
-                    return False
-                return datetime.now() - order_date <= timedelta(days=30)
-        return False
+    def hold(cls, order_id, reservation_id, items, channel):
+        # Ties stock to a pending order; used inside Order.place_order's
+        # transaction. An earlier reservation is adopted; without one, or if
+        # it expired meanwhile, the stock is reserved now.
+        with db.transaction(cls.DB_PATH) as conn:
+            if reservation_id is not None and conn.execute(
+                'UPDATE stock_reservations SET order_id = ? WHERE reservation_id = ? AND order_id IS NULL '
+                'RETURNING reservation_id', (order_id, reservation_id)
+            ).fetchall():
+                return reservation_id
+            return cls.reserve(items, channel, order_id=order_id)
+
+    @classmethod
+    def fulfil(cls, order_id):
+        # Turns the order's reserved stock into a sale once it is paid
+        with db.transaction(cls.DB_PATH) as conn:
+            conn.execute(cls.FULFIL.format(where=cls.ORDER), (order_id,))
+            cls._forget(conn, cls.ORDER, (order_id,))
+
+    @classmethod
+    def _release(cls, conn, where, params):
+        conn.execute(cls.RELEASE.format(where=where), params)
+        return cls._forget(conn, where, params)
+
+    @classmethod
+    def _forget(cls, conn, where, params):
+        conn.execute(cls.FORGET_ITEMS.format(where=where), params)
+        return conn.execute(cls.FORGET.format(where=where), params).rowcount
+
+    @classmethod
+    def release(cls, reservation_id):
+        # Returns stock held by a reservation that never became an order
+        if reservation_id is None:
+            return False
+        with db.transaction(cls.DB_PATH) as conn:
+            return cls._release(conn, cls.RESERVATION, (reservation_id,)) > 0
+
+    @classmethod
+    def release_order(cls, order_id):
+        with db.transaction(cls.DB_PATH) as conn:
+            return cls._release(conn, cls.ORDER, (order_id,)) > 0
+
+    @classmethod
+    def release_expired(cls):
+        with db.transaction(cls.DB_PATH) as conn:
+            return cls._release(conn, cls.EXPIRED, (time.time(),))
+
+    @classmethod
+    def maybe_sweep(cls):
+        now = time.monotonic()
+        if now - cls._last_sweep >= cls.SWEEP_INTERVAL:
+            Inventory._last_sweep = now
+            cls.release_expired()
@@ -0,0 +1,84 @@
+import random
+import threading
+import time
+
+import db
+import jobs
+from models import Order
+
+# Payments run in the background instead of inside the checkout request.
+# checkout() writes the pending order, holds its stock and queues a payment
+# job in one transaction; a worker from jobs.py charges the gateway and
+# moves the order to paid or failed. The order confirmation page polls
+# order_status until the order settles. Gateway errors (timeouts, outages)
+# are retried with backoff; a declined card fails the order at once.
+
+QUEUE = 'payments'
+MAX_ATTEMPTS = 5
+
+
+class GatewayError(Exception):
+    pass
+
+
+class FakeGateway:
+    # Stand-in for a card processor: every charge takes `latency` seconds
+    # (plus up to `jitter`), `error_rate` of calls time out, and approved
+    # charges are decided like the old synchronous process_payment. Charges
+    # are idempotent per key, as with real gateways, so a retried job never
+    # charges twice.
+    METHODS = ('Credit Card', 'PayPal', 'University Account')
+
+    def __init__(self, latency=0.2, jitter=0.1, decline_rate=0.5, error_rate=0.05, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.decline_rate = decline_rate
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def charge(self, idempotency_key, amount, payment_method):
+        time.sleep(self.latency + self.rng.uniform(0, self.jitter))
+        with self.lock:
+            if idempotency_key in self.results:
+                return self.results[idempotency_key]
+            if self.rng.random() < self.error_rate:
+                raise GatewayError('gateway timed out')
+            approved = payment_method in self.METHODS and self.rng.random() >= self.decline_rate
+            self.results[idempotency_key] = approved
+            return approved
+
+
+gateway = FakeGateway()
+
+
+def checkout(user_email, items, delivery_method, payment_method, reservation_id=None):
+    # The order and its payment job commit together: no order is left
+    # pending without a job to settle it. Raises OutOfStock like place_order.
+    with db.transaction(Order.DB_PATH):
+        order = Order.place_order(user_email, items, delivery_method, reservation_id)
+        jobs.enqueue(QUEUE, {'order_id': order.order_id, 'payment_method': payment_method},
+                     max_attempts=MAX_ATTEMPTS, path=Order.DB_PATH)
+    return order
+
+
+@jobs.handler(QUEUE, on_failure=lambda payload, error: Order.mark_failed(payload['order_id']))
+def process_payment(payload):
+    order = Order.get_order_by_id(payload['order_id'])
+    if order is None or order.status != 'pending':
+        return
+    if gateway.charge(f"order-{order.order_id}", order.total_amount, payload['payment_method']):
+        Order.mark_paid(order.order_id)
+    else:
+        Order.mark_failed(order.order_id)
+
+
+def init_app(app):
+    # PAYMENT_WORKERS threads per process settle payments; set it to 0 when
+    # `python3 jobs.py` runs the workers in a separate process instead.
+    app.config.setdefault('PAYMENT_WORKERS', jobs.WORKERS)
+
+    @app.before_request
+    def start_payment_workers():
+        jobs.ensure_workers(app.config['PAYMENT_WORKERS'], Order.DB_PATH)
@@ -0,0 +1,185 @@
+import argparse
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import db
+import migrations
+
+# Staff sales reports. They read the daily rollup tables from migration 11
+# (sales_daily_books, sales_daily_course_lists, sales_daily_departments),
+# which triggers on order_items keep current on every checkout and return,
+# so a report sums one row per day and key instead of scanning the order
+# history. A sale counts towards every course list that held the book when
+# it was sold, and towards each of their departments once.
+#
+#   python3 reports.py books --days 90
+#   python3 reports.py course_lists --start 2024-08-15 --end 2024-12-20
+
+DEFAULT_DAYS = 30
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 500
+
+TOTALS = '''sum(r.units) AS units, round(sum(r.revenue), 2) AS revenue,
+            sum(r.returned_units) AS returned_units, round(sum(r.returned_revenue), 2) AS returned_revenue,
+            round(sum(r.revenue) - sum(r.returned_revenue), 2) AS net_revenue'''
+
+QUERIES = {
+    # Totals are ranked first and only the top rows are joined to their names
+    'books': f'''
+        SELECT r.book_id, b.title, b.author, b.isbn, r.units, r.revenue,
+               r.returned_units, r.returned_revenue, r.net_revenue
+        FROM (
+            SELECT r.book_id, {TOTALS}
+            FROM sales_daily_books r
+            WHERE r.day BETWEEN ? AND ?
+            GROUP BY r.book_id
+            ORDER BY net_revenue DESC, units DESC
+            LIMIT ?
+        ) r
+        LEFT JOIN books b ON b.id = r.book_id
+        ORDER BY r.net_revenue DESC, r.units DESC
+    ''',
+    'course_lists': f'''
+        SELECT r.course_list_id, cl.department || ' ' || cl.course_number AS course,
+               cl.course_title, cl.professor_name, r.units, r.revenue,
+               r.returned_units, r.returned_revenue, r.net_revenue
+        FROM (
+            SELECT r.course_list_id, {TOTALS}
+            FROM sales_daily_course_lists r
+            WHERE r.day BETWEEN ? AND ?
+            GROUP BY r.course_list_id
+            ORDER BY net_revenue DESC, units DESC
+            LIMIT ?
+        ) r
+        LEFT JOIN course_lists cl ON cl.id = r.course_list_id
+        ORDER BY r.net_revenue DESC, r.units DESC
+    ''',
+    'departments': f'''
+        SELECT r.department, {TOTALS}
+        FROM sales_daily_departments r
+        WHERE r.day BETWEEN ? AND ?
+        GROUP BY r.department
+        ORDER BY net_revenue DESC, units DESC
+        LIMIT ?
+    ''',
+    'daily': f'''
+        SELECT r.day, {TOTALS}
+        FROM sales_daily_books r
+        WHERE r.day BETWEEN ? AND ?
+        GROUP BY r.day
+        ORDER BY r.day DESC
+        LIMIT ?
+    ''',
+}
+
+TITLES = {
+    'books': 'Top selling books',
+    'course_lists': 'Revenue by course list',
+    'departments': 'Revenue by department',
+    'daily': 'Daily sales',
+}
+
+# Leading columns of each report; the totals columns follow
+KEY_COLUMNS = {
+    'books': ('title', 'author', 'isbn'),
+    'course_lists': ('course', 'course_title', 'professor_name'),
+    'departments': ('department',),
+    'daily': ('day',),
+}
+TOTAL_COLUMNS = ('units', 'revenue', 'returned_units', 'returned_revenue', 'net_revenue')
+
+
+class Report:
+    def __init__(self, name, start, end, rows, elapsed):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.rows = rows
+        self.elapsed = elapsed
+
+    @property
+    def title(self):
+        return TITLES[self.name]
+
+    @property
+    def columns(self):
+        return KEY_COLUMNS[self.name] + TOTAL_COLUMNS
+
+    @property
+    def totals(self):
+        return {column: round(sum(row[column] or 0 for row in self.rows), 2) for column in TOTAL_COLUMNS}
+
+
+def parse_day(value, default):
+    # Accepts YYYY-MM-DD; anything else falls back to the default
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return default
+
+
+def date_range(start=None, end=None, days=DEFAULT_DAYS):
+    # Inclusive (start, end) dates; defaults to the last `days` days. Days
+    # are UTC, like the CURRENT_TIMESTAMP the order times are stored in.
+    end = parse_day(end, datetime.now(timezone.utc).date())
+    start = parse_day(start, end - timedelta(days=days - 1))
+    if start > end:
+        start, end = end, start
+    return start, end
+
+
+def run(name, start=None, end=None, limit=DEFAULT_LIMIT, days=DEFAULT_DAYS, path=db.DB_PATH):
+    if name not in QUERIES:
+        raise ValueError(f"Unknown report {name!r}; choose from {', '.join(QUERIES)}")
+    start, end = date_range(start, end, days)
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    started = time.perf_counter()
+    with db.get_connection(path) as conn:
+        rows = [dict(row) for row in conn.execute(QUERIES[name], (start.isoformat(), end.isoformat(), limit))]
+    return Report(name, start, end, rows, time.perf_counter() - started)
+
+
+def format_table(report):
+    columns = report.columns
+    cells = [[('' if row[column] is None else str(row[column])) for column in columns] for row in report.rows]
+    widths = [max([len(column)] + [len(cell[i]) for cell in cells]) for i, column in enumerate(columns)]
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines.append('  '.join('-' * width for width in widths))
+    for cell in cells:
+        lines.append('  '.join(value.ljust(width) for value, width in zip(cell, widths)))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print sales reports from the daily rollup tables.')
+    parser.add_argument('report', choices=list(QUERIES))
+    parser.add_argument('--start', help='first day, YYYY-MM-DD (default: --days before --end)')
+    parser.add_argument('--end', help='last day, YYYY-MM-DD (default: today)')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='length of the default range')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help=f'rows to show (max {MAX_LIMIT})')
+    parser.add_argument('--db', default=db.DB_PATH, help='database file (default: %(default)s)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='recompute the rollups from the order history first (after bulk loads or '
+                             'course list changes that should be attributed retroactively)')
+    args = parser.parse_args(argv)
+
+    migrations.migrate(args.db)
+    if args.rebuild:
+        started = time.perf_counter()
+        with db.transaction(args.db) as conn:
+            migrations.rebuild_sales_rollups(conn)
+        print(f"Rebuilt sales rollups in {(time.perf_counter() - started) * 1000:.0f} ms", file=sys.stderr)
+    report = run(args.report, args.start, args.end, args.limit, args.days, args.db)
+    print(f"{report.title}, {report.start} to {report.end}")
+    print(format_table(report))
+    totals = report.totals
+    print(f"\n{len(report.rows)} rows, {totals['units']} units, net revenue ${totals['net_revenue']:.2f} "
+          f"({report.elapsed * 1000:.1f} ms)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import math
+import re
+
+import db
+from models import Book
+
+PAGE_SIZE = 20
+
+# bm25 column weights for (title, author, isbn)
+RANK = 'bm25(books_fts, 10.0, 4.0, 1.0)'
+
+COUNT = 'SELECT count(*) FROM books_fts WHERE books_fts MATCH ?'
+RESULTS = f'''
+    SELECT b.id, b.isbn, b.title, b.author, b.price, b.cover_url
+    FROM books_fts
+    JOIN books b ON b.id = books_fts.rowid
+    WHERE books_fts MATCH ?
+    ORDER BY {RANK}, b.id
+    LIMIT ? OFFSET ?
+'''
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+_ISBN_QUERY = re.compile(r'[\dXx][\dXx\-\s]*')
+
+
+def build_match(query):
+    query = query.strip()
+    if not query:
+        return None
+    tokens = _TOKEN.findall(query.lower())
+    if not tokens:
+        return None
+    # Every term must match as a word prefix, so "intro prob" finds
+    # "Introduction to Probability" while the user is still typing.
+    terms = ' AND '.join('"{}"*'.format(token) for token in tokens)
+    # Digits may also be the start of an ISBN typed with or without hyphens
+    # ("978-0-07"), but "1984" or "101" can just as well be in a title
+    digits = re.sub(r'[\-\s]', '', query)
+    if _ISBN_QUERY.fullmatch(query) and len(digits) >= 3:
+        return 'isbn : "{}"* OR ({})'.format(digits.upper(), terms)
+    return terms
+
+
+class SearchResults:
+    def __init__(self, query, books, total, page, per_page):
+        self.query = query
+        self.books = books
+        self.total = total
+        self.page = page
+        self.per_page = per_page
+
+    @property
+    def pages(self):
+        return max(1, math.ceil(self.total / self.per_page))
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+
+def search_books(query, page=1, per_page=PAGE_SIZE):
+    page = max(1, page)
+    match = build_match(query)
+    if match is None:
+        return SearchResults(query, [], 0, page, per_page)
+
+    with Book.get_connection() as conn:
+        total = conn.execute(COUNT, (match,)).fetchone()[0]
+        # Past the last page shows the last page, and a huge ?page= cannot
+        # overflow OFFSET
+        page = min(page, max(1, math.ceil(total / per_page)))
+        books = db.fetch_all(conn, Book, RESULTS, (match, per_page, (page - 1) * per_page))
+    return SearchResults(query, books, total, page, per_page)
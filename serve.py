@@ -0,0 +1,228 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import db
+
+# Pre-forking production launcher. The parent imports the app, compiles every
+# template and fills the catalog caches once, then forks the workers so they
+# start warm and share those pages copy-on-write. All workers accept on one
+# listening socket.
+#
+# The parent polls the catalog version (migration 7); when books or course
+# lists change, or on SIGHUP, it re-warms and replaces the workers one
+# generation at a time, letting the old ones finish in-flight requests.
+#
+#   python3 serve.py --port 8000 --workers 4
+
+WORKERS = os.cpu_count() or 1
+POLL_INTERVAL = 2.0
+RELOAD_MIN_INTERVAL = 30.0  # at most one catalog reload per this many seconds
+GRACEFUL_TIMEOUT = 30.0
+
+
+class Launcher:
+    def __init__(self, host='127.0.0.1', port=8000, workers=WORKERS, max_books=None,
+                 poll_interval=POLL_INTERVAL, reload_interval=RELOAD_MIN_INTERVAL):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_books = max_books
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval
+        self.app = None
+        self.sock = None
+        self.children = {}  # pid -> generation
+        self.generation = 0
+        self.version = None
+        self.last_reload = 0.0
+        self.reload_requested = False
+        self.stopping = False
+
+    def log(self, message):
+        print(f"[serve {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+    def preload(self):
+        started = time.perf_counter()
+        from app import app
+        self.app = app
+        imported = time.perf_counter()
+
+        templates = app.jinja_env.list_templates()
+        for name in templates:
+            app.jinja_env.get_template(name)
+        compiled = time.perf_counter()
+
+        books, course_lists = self.warm()
+        warmed = time.perf_counter()
+
+        self.log(f"preloaded in {(warmed - started) * 1000:.0f} ms: "
+                 f"import {(imported - started) * 1000:.0f} ms, "
+                 f"{len(templates)} templates {(compiled - imported) * 1000:.0f} ms, "
+                 f"{books} books and {course_lists} course lists {(warmed - compiled) * 1000:.0f} ms")
+
+    def warm(self):
+        from models import Catalog, CourseList
+        books = Catalog.warm(self.max_books)
+        course_lists = len(CourseList.membership)
+        self.version = Catalog.version()
+        self.last_reload = time.monotonic()
+        # SQLite connections must never cross a fork; workers open their own.
+        db.close_all()
+        # Keep the preloaded objects out of the collector so its bookkeeping
+        # does not dirty (and un-share) their pages in the workers.
+        gc.collect()
+        gc.freeze()
+        return books, course_lists
+
+    def catalog_version(self):
+        from models import Catalog
+        try:
+            return Catalog.version()
+        finally:
+            db.close_all()
+
+    def listen(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(1024)
+        self.sock.set_inheritable(True)
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = self.generation
+            return pid
+        code = 1
+        try:
+            code = self.run_worker()
+        finally:
+            os._exit(code)
+
+    def run_worker(self):
+        from werkzeug.serving import make_server
+
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        server = make_server(self.host, self.port, self.app, threaded=True, fd=self.sock.fileno())
+
+        def stop(signum, frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+        signal.signal(signal.SIGTERM, stop)
+
+        server.serve_forever()
+        server.server_close()
+        # Request threads are daemons; give the in-flight ones time to finish.
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while threading.active_count() > 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return 0
+
+    def spawn_generation(self):
+        started = time.perf_counter()
+        self.generation += 1
+        for _ in range(self.workers):
+            self.spawn()
+        self.log(f"started {self.workers} workers (generation {self.generation}) "
+                 f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def stop_workers(self, generation=None):
+        for pid, gen in list(self.children.items()):
+            if generation is None or gen == generation:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            generation = self.children.pop(pid, None)
+            if generation == self.generation and not self.stopping:
+                self.log(f"worker {pid} exited with status {status}; restarting")
+                self.spawn()
+
+    def reload(self, reason):
+        from models import Catalog
+        started = time.perf_counter()
+        old_generation = self.generation
+        Catalog.invalidate()
+        books, course_lists = self.warm()
+        self.log(f"{reason}: re-warmed catalog version {self.version} "
+                 f"({books} books) in {(time.perf_counter() - started) * 1000:.0f} ms")
+        self.spawn_generation()
+        self.stop_workers(old_generation)
+
+    def run(self):
+        started = time.perf_counter()
+        self.preload()
+        self.listen()
+        self.spawn_generation()
+        self.log(f"listening on http://{self.host}:{self.port}, "
+                 f"ready in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        while not self.stopping:
+            time.sleep(self.poll_interval)
+            self.reap()
+            if self.stopping:
+                break
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload('SIGHUP')
+            elif time.monotonic() - self.last_reload >= self.reload_interval:
+                version = self.catalog_version()
+                if version != self.version:
+                    self.reload(f"catalog changed ({self.version} -> {version})")
+
+        self.log('shutting down')
+        self.stop_workers()
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            os.kill(pid, signal.SIGKILL)
+        self.sock.close()
+        return 0
+
+    def _on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the bookstore on several pre-forked, pre-warmed workers.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='default: one per CPU (%(default)s)')
+    parser.add_argument('--max-books', type=int, help='books to preload (default: the book cache size)')
+    parser.add_argument('--reload-interval', type=float, default=RELOAD_MIN_INTERVAL,
+                        help='minimum seconds between catalog reloads')
+    args = parser.parse_args(argv)
+    if not hasattr(os, 'fork'):
+        parser.error('serve.py needs os.fork; use app.py or asgi.py on this platform')
+    launcher = Launcher(args.host, args.port, args.workers, args.max_books,
+                        reload_interval=args.reload_interval)
+    return launcher.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,21 +1,18 @@
 import sqlite3
 
+import db
+import migrations
+
 def create_database():
+    conn = None
     try:
-        conn = sqlite3.connect('bookstore.db')
-        cursor = conn.cursor()
+        # Tables, indexes and the search index are created by the numbered
+        # migrations in migrations.py; this script only seeds sample data.
+        # Both use db.DB_PATH, which honours BOOKSTORE_DB.
+        migrations.migrate()
 
-        # Create the books table if it does not exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                isbn TEXT NOT NULL,
-                title TEXT NOT NULL,
-                author TEXT NOT NULL,
-                price REAL NOT NULL,
-                cover_url TEXT
-            )
-        ''')
+        conn = sqlite3.connect(db.DB_PATH)
+        cursor = conn.cursor()
 
         # Sample books
         sample_books = [
@@ -36,23 +33,10 @@ def create_database():
             ['978-0-674-53099-2', 'The Feynman Lectures on Physics, Vol 3', 'Richard P. Feynman', 55.00, 'feynman_lectures_cover_992.jpg'],
         ]
 
-        for sample in sample_books:
-            cursor.execute("INSERT OR IGNORE INTO books (isbn, title, author, price, cover_url) VALUES (?,?,?,?,?)", sample)
+        cursor.executemany("INSERT OR IGNORE INTO books (isbn, title, author, price, cover_url) VALUES (?,?,?,?,?)", sample_books)
 
         conn.commit()
 
-        # Create the users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT NOT NULL,
-                name TEXT NOT NULL,
-                status TEXT NOT NULL,
-                department TEXT,
-                address TEXT
-            )
-        ''')
-
         # Sample users
         sample_users = [
             ['soudea.forbes@mga.edu', 'Soudea', 'student', None, "123 Lane Lane, Dublin GA 31021"],
@@ -60,60 +44,10 @@ def create_database():
             ['joobum.kim@mga.edu', 'Dr. Kim', 'faculty', 'ITEC', "MGA Campus, Macon, GA, 31201"],
             ['aloethecat@bookstore.com', 'Aloe', 'staff', None, None]
         ]
-        for sample in sample_users:
-            cursor.execute("INSERT OR IGNORE INTO users (email, name, status, department,address) VALUES (?,?,?,?,?)", sample)
+        cursor.executemany("INSERT OR IGNORE INTO users (email, name, status, department,address) VALUES (?,?,?,?,?)", sample_users)
 
         conn.commit()
 
-        # Create the orders table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                order_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_email TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'pending',
-                total_amount REAL NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        ''')
-
-        # Create the order_items table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS order_items (
-                order_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id INTEGER NOT NULL,
-                book_id INTEGER NOT NULL,
-                quantity INTEGER NOT NULL,
-                price REAL NOT NULL,
-                return_requested BOOLEAN DEFAULT 0,
-                return_date DATETIME,
-                FOREIGN KEY (order_id) REFERENCES orders (order_id),
-                FOREIGN KEY (book_id) REFERENCES books (id)
-            );
-        ''')
-
-        # Create course reading list table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS course_lists (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                professor TEXT NOT NULL,
-                professor_name TEXT NOT NULL,
-                course_title TEXT NOT NULL,
-                department TEXT NOT NULL,
-                course_number TEXT NOT NULL
-            )
-        ''')
-
-        # Create course list books table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS course_list_books (
-                course_list_id INTEGER,
-                book_id INTEGER,
-                PRIMARY KEY (course_list_id, book_id),
-                FOREIGN KEY (course_list_id) REFERENCES course_lists(id),
-                FOREIGN KEY (book_id) REFERENCES books(id)
-            )
-        ''')
-
         # Sample course lists
         sample_course_lists = [
             ['joobum.kim@mga.edu', 'Dr. Kim', 'Data Structures', 'ITEC', 3500],
@@ -121,8 +55,7 @@ def create_database():
             ['alice.jones@mga.edu', 'Dr. Alice Jones', 'Calculus I', 'MATH', 1101]
         ]
 
-        for sample in sample_course_lists:
-            cursor.execute("INSERT OR IGNORE INTO course_lists (professor, professor_name, course_title, department, course_number) VALUES (?,?,?,?,?)", sample)
+        cursor.executemany("INSERT OR IGNORE INTO course_lists (professor, professor_name, course_title, department, course_number) VALUES (?,?,?,?,?)", sample_course_lists)
 
         sample_course_list_books = [
             [1, 1], 
@@ -130,8 +63,7 @@ def create_database():
             [2, 1], 
         ]
 
-        for sample in sample_course_list_books:
-            cursor.execute("INSERT OR IGNORE INTO course_list_books (course_list_id, book_id) VALUES (?, ?)", sample)
+        cursor.executemany("INSERT OR IGNORE INTO course_list_books (course_list_id, book_id) VALUES (?, ?)", sample_course_list_books)
 
         conn.commit()
 
@@ -139,7 +71,8 @@ def create_database():
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 if __name__ == "__main__":
     create_database()
@@ -0,0 +1,34 @@
+import atexit
+import itertools
+import os
+import shutil
+import tempfile
+
+# The app migrates its database on import, so every test module runs against
+# one scratch database set up before db is first imported
+workdir = tempfile.mkdtemp(prefix='bookstore-test-')
+os.environ['BOOKSTORE_DB'] = os.path.join(workdir, 'bookstore.db')
+atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+
+import db  # noqa: E402
+from app import app  # noqa: E402
+
+# Payment jobs are run by the tests themselves, not by background workers
+app.config['PAYMENT_WORKERS'] = 0
+
+_isbns = itertools.count(1)
+
+
+def add_book(title='Test Book', price=10.0):
+    with db.transaction() as conn:
+        return conn.execute(
+            'INSERT INTO books (title, author, isbn, price, cover_url) VALUES (?, ?, ?, ?, ?) RETURNING id',
+            (title, 'Tester', f"979{next(_isbns):010d}", price, 'default.jpg')
+        ).fetchone()[0]
+
+
+def add_user(email, status='student'):
+    with db.transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO users (email, name, status, address) VALUES (?, ?, ?, ?)',
+                     (email, 'Test User', status, '1 Test Lane'))
+    return email
@@ -0,0 +1,93 @@
+import unittest
+from unittest import mock
+
+from tests import add_book, add_user
+import db
+import jobs
+import payments
+from app import app
+from models import Book, Inventory, Order, OutOfStock
+
+
+def count(sql, *params):
+    with db.get_connection() as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+
+class PlaceOrderTest(unittest.TestCase):
+    def setUp(self):
+        self.email = add_user('checkout@test.edu')
+        self.in_stock = add_book('In Stock', 20.0)
+        self.short = add_book('Short', 30.0)
+        Inventory.set_stock(self.in_stock, 'warehouse', 5)
+        Inventory.set_stock(self.short, 'warehouse', 1)
+
+    def orders(self):
+        return count('SELECT count(*) FROM orders WHERE user_email = ?', self.email)
+
+    def test_out_of_stock_writes_nothing(self):
+        orders = self.orders()
+        items = [(Book.get_book_by_id(self.in_stock), 2), (Book.get_book_by_id(self.short), 3)]
+        with self.assertRaises(OutOfStock) as raised:
+            Order.place_order(self.email, items, 'Shipping')
+        self.assertEqual(raised.exception.shortages, [(self.short, 3, 1)])
+        self.assertEqual(self.orders(), orders)
+        self.assertEqual(Inventory.get_stock(self.in_stock)['warehouse']['reserved'], 0)
+        self.assertEqual(count('SELECT count(*) FROM stock_reservation_items WHERE book_id IN (?, ?)',
+                               self.in_stock, self.short), 0)
+
+    def test_failed_enqueue_rolls_back_the_order(self):
+        orders = self.orders()
+        items = [(Book.get_book_by_id(self.in_stock), 2)]
+        with mock.patch.object(jobs, 'enqueue', side_effect=RuntimeError('queue down')):
+            with self.assertRaises(RuntimeError):
+                payments.checkout(self.email, items, 'Shipping', 'PayPal')
+        self.assertEqual(self.orders(), orders)
+        self.assertEqual(Inventory.get_stock(self.in_stock)['warehouse']['reserved'], 0)
+
+    def test_lines_use_the_current_price(self):
+        book = Book.get_book_by_id(self.in_stock)
+        with db.transaction() as conn:
+            conn.execute('UPDATE books SET price = 25.0 WHERE id = ?', (self.in_stock,))
+        order = Order.place_order(self.email, [(book, 2)], 'Shipping')
+        self.assertEqual(order.total_amount, 50.0)
+        self.assertEqual(count('SELECT price FROM order_items WHERE order_id = ?', order.order_id), 25.0)
+        self.assertEqual(count('SELECT count(*) FROM order_items WHERE order_id = ?', order.order_id), 1)
+        Order.mark_failed(order.order_id)
+
+
+class CheckoutRouteTest(unittest.TestCase):
+    def setUp(self):
+        self.email = add_user('checkout-route@test.edu')
+        self.book_id = add_book('Checkout Route', 15.0)
+        Inventory.set_stock(self.book_id, 'warehouse', 2)
+        self.client = app.test_client()
+        self.client.post('/login', data={'email': self.email})
+
+    def checkout(self, quantity):
+        self.client.get(f"/add_to_cart/{self.book_id}")
+        self.client.post(f"/cart/update/{self.book_id}", data={'quantity': quantity})
+        return self.client.post('/checkout', data={'delivery_method': 'Shipping', 'payment_method': 'PayPal'})
+
+    def test_checkout_places_a_pending_order_and_queues_its_payment(self):
+        response = self.checkout(2)
+        order_id = int(response.headers['Location'].rsplit('/', 1)[1])
+        self.assertEqual(Order.get_status(order_id), (self.email, 'pending'))
+        self.assertEqual(Order.get_order_by_id(order_id).total_amount, 30.0)
+        self.assertEqual(Inventory.get_stock(self.book_id)['warehouse']['reserved'], 2)
+        self.assertEqual(count("SELECT count(*) FROM jobs WHERE queue = ? AND payload LIKE ?",
+                               payments.QUEUE, f'%"order_id": {order_id},%'), 1)
+        self.assertIn(b'Your cart is empty', self.client.get('/cart').data)
+        Order.mark_failed(order_id)
+
+    def test_short_stock_keeps_the_cart(self):
+        orders = count('SELECT count(*) FROM orders WHERE user_email = ?', self.email)
+        response = self.checkout(3)
+        self.assertTrue(response.headers['Location'].endswith('/cart'))
+        self.assertEqual(count('SELECT count(*) FROM orders WHERE user_email = ?', self.email), orders)
+        self.assertEqual(Inventory.get_stock(self.book_id)['warehouse']['reserved'], 0)
+        self.assertIn(b'Checkout Route', self.client.get('/cart').data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import sys
+import threading
+import unittest
+
+from tests import add_book
+import db
+from models import CourseListIndex
+
+
+class CourseListIndexTest(unittest.TestCase):
+    def setUp(self):
+        with db.transaction() as conn:
+            course_list_id = conn.execute(
+                "INSERT INTO course_lists (professor, professor_name, course_title, department, course_number) "
+                "VALUES ('index@test.edu', 'Index Test', 'Indexing', 'TEST', '1000')").lastrowid
+            self.book_id = add_book('Index Test')
+            conn.execute('INSERT INTO course_list_books (course_list_id, book_id) VALUES (?, ?)',
+                         (course_list_id, self.book_id))
+        self.course_list_id = course_list_id
+
+    def tearDown(self):
+        with db.transaction() as conn:
+            conn.execute('DELETE FROM course_list_books WHERE course_list_id = ?', (self.course_list_id,))
+            conn.execute('DELETE FROM course_lists WHERE id = ?', (self.course_list_id,))
+            conn.execute('DELETE FROM books WHERE id = ?', (self.book_id,))
+
+    def test_reads_while_invalidated(self):
+        index = CourseListIndex(db.DB_PATH)
+        errors = []
+        done = threading.Event()
+
+        def read():
+            try:
+                while not done.is_set():
+                    self.assertTrue(index.has_course_list(self.book_id))
+                    self.assertEqual([c['id'] for c in index.course_lists_for(self.book_id)],
+                                     [self.course_list_id])
+                    self.assertGreater(len(index), 0)
+            except Exception as e:
+                errors.append(e)
+                done.set()
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            readers = [threading.Thread(target=read) for _ in range(4)]
+            for reader in readers:
+                reader.start()
+            for _ in range(500):
+                index.invalidate()
+            done.set()
+            for reader in readers:
+                reader.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import base64
+import json
+import unittest
+
+import tests  # noqa: F401  (scratch database)
+from app import app
+from models import decode_cursor, encode_cursor
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+MALFORMED = [
+    raw_cursor([{}, 1]),
+    raw_cursor([[1], 2]),
+    raw_cursor(['title', [1]]),
+    raw_cursor(['title', 'x']),
+    raw_cursor(['title', None]),
+    raw_cursor(['title', 1, 2]),
+    raw_cursor({'a': 1}),
+    raw_cursor(1),
+    'not base64!',
+    '',
+]
+
+
+class DecodeCursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        for value in ['Physics', 19.99, 3]:
+            self.assertEqual(decode_cursor(encode_cursor(value, 42)), (value, 42))
+
+    def test_malformed(self):
+        for cursor in MALFORMED + [raw_cursor(['title', 1e400])]:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(decode_cursor(cursor))
+
+
+class CursorRoutesTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_catalog_ignores_malformed_cursors(self):
+        for cursor in MALFORMED:
+            for name in ('after', 'before'):
+                with self.subTest(name=name, cursor=cursor):
+                    self.assertEqual(self.client.get('/', query_string={name: cursor}).status_code, 200)
+
+    def test_order_history_ignores_malformed_cursors(self):
+        with self.client.session_transaction() as session:
+            session['user_email'] = 'student@example.edu'
+            session['role'] = 'student'
+        for cursor in MALFORMED:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/my_orders', query_string={'after': cursor}).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
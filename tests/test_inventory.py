@@ -0,0 +1,61 @@
+import threading
+import unittest
+
+from tests import add_book
+from models import Inventory, OutOfStock
+
+
+class InventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.book_id = add_book('Inventory Test')
+        Inventory.set_stock(self.book_id, 'warehouse', 5)
+
+    def stock(self, book_id=None):
+        return Inventory.get_stock(book_id or self.book_id)['warehouse']
+
+    def test_concurrent_reservations_never_oversell(self):
+        reserved = []
+        short = []
+        start = threading.Barrier(20)
+
+        def buy():
+            start.wait()
+            try:
+                reserved.append(Inventory.reserve([(self.book_id, 1)], 'warehouse'))
+            except OutOfStock as e:
+                short.append(e.shortages)
+
+        threads = [threading.Thread(target=buy) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(reserved), 5)
+        self.assertEqual(len(short), 15)
+        self.assertEqual(short[0], [(self.book_id, 1, 0)])
+        self.assertEqual(self.stock(), {'on_hand': 5, 'reserved': 5, 'available': 0})
+        for reservation_id in reserved:
+            self.assertTrue(Inventory.release(reservation_id))
+        self.assertEqual(self.stock()['available'], 5)
+
+    def test_reservation_is_all_or_nothing(self):
+        other = add_book('Inventory Test 2')
+        Inventory.set_stock(other, 'warehouse', 1)
+        with self.assertRaises(OutOfStock):
+            Inventory.reserve([(self.book_id, 2), (other, 2)], 'warehouse')
+        self.assertEqual(self.stock()['reserved'], 0)
+        self.assertEqual(self.stock(other)['reserved'], 0)
+
+    def test_untracked_books_are_not_reserved(self):
+        untracked = add_book('Untracked')
+        self.assertIsNone(Inventory.reserve([(untracked, 100)], 'warehouse'))
+        self.assertIsNone(Inventory.reserve([(self.book_id, 100)], 'digital'))
+
+    def test_fulfilled_order_becomes_a_sale(self):
+        Inventory.reserve([(self.book_id, 2)], 'warehouse', order_id=-1)
+        Inventory.fulfil(-1)
+        self.assertEqual(self.stock(), {'on_hand': 3, 'reserved': 0, 'available': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
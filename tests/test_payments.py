@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+from tests import add_book, add_user
+import db
+import jobs
+import payments
+from models import Book, Inventory, Order
+
+
+class PaymentJobTest(unittest.TestCase):
+    def setUp(self):
+        # Only this test's job is in the queue
+        with db.transaction() as conn:
+            conn.execute('DELETE FROM jobs')
+        self.email = add_user('payments@test.edu')
+        self.book_id = add_book('Payment Test', 40.0)
+        Inventory.set_stock(self.book_id, 'warehouse', 3)
+
+    def checkout(self, **gateway):
+        self.gateway = payments.FakeGateway(latency=0, jitter=0, **gateway)
+        patcher = mock.patch.object(payments, 'gateway', self.gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        order = payments.checkout(self.email, [(Book.get_book_by_id(self.book_id), 2)], 'Shipping', 'PayPal')
+        return order.order_id
+
+    def run_next_job(self):
+        # Runs the queued job now, whatever its backoff
+        with db.transaction() as conn:
+            conn.execute("UPDATE jobs SET run_at = 0 WHERE status = 'queued'")
+        job = jobs.claim([payments.QUEUE])
+        self.assertIsNotNone(job)
+        return jobs.run_job(job)
+
+    def job(self):
+        with db.get_connection() as conn:
+            return conn.execute('SELECT status, attempts FROM jobs').fetchone()
+
+    def stock(self):
+        return Inventory.get_stock(self.book_id)['warehouse']
+
+    def test_approved_payment_sells_the_stock(self):
+        order_id = self.checkout(decline_rate=0, error_rate=0)
+        self.assertEqual(self.stock()['reserved'], 2)
+        self.assertTrue(self.run_next_job())
+        self.assertEqual(Order.get_status(order_id)[1], 'paid')
+        self.assertEqual(self.stock(), {'on_hand': 1, 'reserved': 0, 'available': 1})
+        self.assertEqual(tuple(self.job()), ('done', 1))
+
+    def test_declined_payment_fails_the_order_at_once(self):
+        order_id = self.checkout(decline_rate=1, error_rate=0)
+        self.assertTrue(self.run_next_job())
+        self.assertEqual(Order.get_status(order_id)[1], 'failed')
+        self.assertEqual(self.stock(), {'on_hand': 3, 'reserved': 0, 'available': 3})
+        self.assertEqual(tuple(self.job()), ('done', 1))
+
+    def test_gateway_errors_are_retried(self):
+        order_id = self.checkout(decline_rate=0, error_rate=1)
+        self.assertFalse(self.run_next_job())
+        self.assertEqual(tuple(self.job()), ('queued', 1))
+        self.assertEqual(Order.get_status(order_id)[1], 'pending')
+        self.assertEqual(self.stock()['reserved'], 2)
+
+        self.gateway.error_rate = 0
+        self.assertTrue(self.run_next_job())
+        self.assertEqual(Order.get_status(order_id)[1], 'paid')
+        self.assertEqual(tuple(self.job()), ('done', 2))
+
+    def test_order_fails_after_the_last_attempt(self):
+        order_id = self.checkout(decline_rate=0, error_rate=1)
+        for _ in range(payments.MAX_ATTEMPTS):
+            self.assertFalse(self.run_next_job())
+        self.assertEqual(tuple(self.job()), ('failed', payments.MAX_ATTEMPTS))
+        self.assertEqual(Order.get_status(order_id)[1], 'failed')
+        self.assertEqual(self.stock()['reserved'], 0)
+        self.assertIsNone(jobs.claim([payments.QUEUE]))
+
+
+if __name__ == '__main__':
+    unittest.main()